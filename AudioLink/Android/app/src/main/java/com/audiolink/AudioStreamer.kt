@@ -11,6 +11,10 @@ import okhttp3.WebSocket
 import okhttp3.WebSocketListener
 import okio.ByteString
 import okio.ByteString.Companion.toByteString
+import org.json.JSONObject
+import java.net.DatagramPacket
+import java.net.DatagramSocket
+import java.net.InetAddress
 import java.nio.ByteBuffer
 import java.nio.ByteOrder
 
@@ -35,7 +39,43 @@ class AudioStreamer(private val useOpus: Boolean = false) {  // Default to PCM m
     private val channelConfig = AudioFormat.CHANNEL_IN_MONO
     private val audioFormat = AudioFormat.ENCODING_PCM_16BIT
     private val bufferSize = AudioRecord.getMinBufferSize(sampleRate, channelConfig, audioFormat)
-    private val frameSize = 960 // 20ms at 48kHz
+    private var frameSize = 960 // Samples per frame, agreed with the server (20ms at 48kHz by default)
+
+    // Stream format offered in the handshake, in order of preference.
+    // Shorter frames cut packetization delay; the server picks the first it supports.
+    private val offeredFrameMs = listOf(10, 20)
+    private val handshakeTimeoutMs = 1000L
+
+    // Frame header (must match Server/protocol.py)
+    private val protocolVersion = 1
+    private val headerSize = 8
+    private var sequence = 0
+    private var timestamp = 0L
+
+    // Discontinuous transmission: while the mic is silent, send a silence marker
+    // instead of every frame (must match Server/protocol.py)
+    private val flagSilence = 0x01
+    private val silenceThreshold = 100.0  // RMS below this counts as silence
+    private val silenceHangoverFrames = 10  // Keep sending this long after speech, so the server tracks the background
+    private val silenceMarkerFrames = 20  // Frames each marker declares silent
+    @Volatile private var dtx = false
+    private var quietFrames = 0
+    private var silenceEnd = -1  // Sequence number where the last marker's silence ends
+
+    // UDP audio transport (offered by the server with --udp)
+    private val udpKeySize = 4
+    @Volatile private var udpSocket: DatagramSocket? = null
+    @Volatile private var udpAddress: InetAddress? = null
+    private var udpPort = 0
+    private var udpKey = 0L
+
+    // Session resume: the server holds our session for a grace period after a dropout
+    @Volatile private var resumeToken: String? = null
+    private var resumeGraceMs = 0L
+    private val reconnectDelayMs = 100L
+    @Volatile private var disconnectedAt = 0L
+    @Volatile private var handshakeDone = false
+    @Volatile private var userStopped = false
 
     interface StreamListener {
         fun onConnectionOpened()
@@ -54,6 +94,13 @@ class AudioStreamer(private val useOpus: Boolean = false) {  // Default to PCM m
     @SuppressLint("MissingPermission") // Checked in Activity
     fun startStreaming(ipAddress: String, port: Int = 8765) {
         if (isStreaming) return
+        userStopped = false
+        resumeToken = null
+        connect(ipAddress, port)
+    }
+
+    private fun connect(ipAddress: String, port: Int) {
+        handshakeDone = false
 
         // Initialize WebSocket
         val request = Request.Builder().url("ws://$ipAddress:$port").build()
@@ -67,24 +114,117 @@ class AudioStreamer(private val useOpus: Boolean = false) {  // Default to PCM m
                 Log.i("AudioStreamer", "  • Stay close to router")
                 Log.i("AudioStreamer", "  • Expected latency: 90-115ms")
                 Log.i("AudioStreamer", "========================================")
-                listener?.onConnectionOpened()
-                startAudioCapture()
+                if (disconnectedAt == 0L) {
+                    listener?.onConnectionOpened()
+                }
+                sendHello(webSocket)
+            }
+
+            override fun onMessage(webSocket: WebSocket, text: String) {
+                try {
+                    val message = JSONObject(text)
+                    when (message.optString("type")) {
+                        "config" -> applyConfig(message)
+                        "error" -> {
+                            Log.e("AudioStreamer", "Server rejected stream format: ${message.optString("reason")}")
+                            webSocket.close(1000, "Unsupported stream format")
+                        }
+                        "token" -> {
+                            resumeToken = message.getString("token")
+                            resumeGraceMs = (message.optDouble("grace_s", 0.0) * 1000).toLong()
+                        }
+                        "resumed" -> Log.i("AudioStreamer", "Session resumed (server had up to seq ${message.opt("last_seq")})")
+                        "udp" -> enableUdp(ipAddress, message.getInt("port"), message.getLong("key"))
+                        "feedback" -> onFeedback(message)
+                        else -> Log.d("AudioStreamer", "Ignoring control message: $text")
+                    }
+                } catch (e: Exception) {
+                    Log.w("AudioStreamer", "Invalid control message: $text")
+                }
             }
 
             override fun onClosed(webSocket: WebSocket, code: Int, reason: String) {
+                if (this@AudioStreamer.webSocket !== webSocket) return
                 Log.i("AudioStreamer", "Connection closed: $reason")
                 stopAudioCapture()
                 listener?.onConnectionClosed(reason)
             }
 
             override fun onFailure(webSocket: WebSocket, t: Throwable, response: okhttp3.Response?) {
+                if (this@AudioStreamer.webSocket !== webSocket) return
                 Log.e("AudioStreamer", "Connection failed", t)
+                if (!userStopped && resumeToken != null && reconnect(ipAddress, port)) return
                 stopAudioCapture()
                 listener?.onConnectionFailed(t)
             }
         })
     }
 
+    // Keeps capturing (the sequence keeps counting) and tries to resume the session
+    // while the server still holds it. Returns false once the grace period is over.
+    private fun reconnect(ipAddress: String, port: Int): Boolean {
+        handshakeDone = false
+        val now = System.currentTimeMillis()
+        if (disconnectedAt == 0L) disconnectedAt = now
+        if (now - disconnectedAt + reconnectDelayMs > resumeGraceMs) {
+            disconnectedAt = 0L
+            return false
+        }
+        Thread {
+            Thread.sleep(reconnectDelayMs)
+            if (!userStopped) connect(ipAddress, port)
+        }.start()
+        return true
+    }
+
+    private fun sendHello(webSocket: WebSocket) {
+        val hello = JSONObject()
+            .put("type", "hello")
+            .put("codec", "pcm")
+            .put("rate", sampleRate)
+            .put("channels", 1)
+            .put("frame_ms", org.json.JSONArray(offeredFrameMs))
+            .put("dtx", true)
+            .put("feedback", true)
+        resumeToken?.let { hello.put("resume", it) }
+        webSocket.send(hello.toString())
+
+        // Servers without the handshake ignore the hello: stream the default format
+        Thread {
+            Thread.sleep(handshakeTimeoutMs)
+            if (!isStreaming && this.webSocket === webSocket) {
+                Log.w("AudioStreamer", "No handshake reply, streaming 20ms PCM frames")
+                handshakeDone = true
+                startAudioCapture()
+            }
+        }.start()
+    }
+
+    private fun applyConfig(config: JSONObject) {
+        handshakeDone = true
+        if (disconnectedAt != 0L) {
+            Log.i("AudioStreamer", "Reconnected after ${System.currentTimeMillis() - disconnectedAt}ms")
+            disconnectedAt = 0L
+        }
+        frameSize = config.getInt("frame_size")
+        dtx = config.optBoolean("dtx", false)
+        Log.i("AudioStreamer", "Stream format: ${config.getString("codec")} ${config.getInt("rate")}Hz, " +
+                "${config.get("frame_ms")}ms frames ($frameSize samples)${if (dtx) ", DTX" else ""}")
+        startAudioCapture()
+    }
+
+    // Receiver report from the server (loss, jitter, buffer depth). Opus senders would
+    // apply its bitrate, fec and packet_loss_perc to the encoder; PCM has nothing to tune.
+    private fun onFeedback(report: JSONObject) {
+        val loss = report.optDouble("loss", 0.0)
+        val late = report.optDouble("late", 0.0)
+        if (loss + late > 0.0) {
+            Log.d("AudioStreamer", "Server report: ${"%.1f".format(loss * 100)}% lost, " +
+                    "${"%.1f".format(late * 100)}% late, jitter ${report.optDouble("jitter_ms")}ms, " +
+                    "buffer ${report.optInt("depth_ms")}ms")
+        }
+    }
+
     private var volume = 1.0f
     private var isMuted = false
 
@@ -96,6 +236,7 @@ class AudioStreamer(private val useOpus: Boolean = false) {  // Default to PCM m
         isMuted = mute
     }
 
+    @Synchronized
     private fun startAudioCapture() {
         if (isStreaming) return
         try {
@@ -113,6 +254,10 @@ class AudioStreamer(private val useOpus: Boolean = false) {  // Default to PCM m
             }
 
             audioRecord?.startRecording()
+            sequence = 0
+            timestamp = 0L
+            quietFrames = 0
+            silenceEnd = -1
             isStreaming = true
 
             Thread {
@@ -131,9 +276,10 @@ class AudioStreamer(private val useOpus: Boolean = false) {  // Default to PCM m
                             }
                         }
 
-                        // Send raw PCM (convert short[] to byte[])
-                        val pcmBytes = shortArrayToByteArray(pcmBuffer)
-                        webSocket?.send(pcmBytes.toByteString())
+                        // Send raw PCM (header + short[] as little-endian bytes),
+                        // or during silence only a marker now and then
+                        val frameBytes = if (dtx && isQuiet(pcmBuffer)) silenceFrame(pcmBuffer.size) else buildFrame(pcmBuffer)
+                        if (frameBytes != null) send(frameBytes)
                     }
                 }
             }.start()
@@ -144,17 +290,100 @@ class AudioStreamer(private val useOpus: Boolean = false) {  // Default to PCM m
         }
     }
 
-    private fun shortArrayToByteArray(shorts: ShortArray): ByteArray {
-        val bytes = ByteArray(shorts.size * 2)
+    private fun send(frameBytes: ByteArray) {
+        val socket = udpSocket
+        if (socket != null) {
+            sendDatagram(socket, frameBytes)
+        } else if (handshakeDone) {
+            // Frames captured while reconnecting are dropped; the server conceals them
+            webSocket?.send(frameBytes.toByteString())
+        }
+    }
+
+    // True once the mic has been below the threshold for the whole hangover
+    private fun isQuiet(shorts: ShortArray): Boolean {
+        var sum = 0.0
+        for (s in shorts) sum += s * s.toDouble()
+        if (Math.sqrt(sum / shorts.size) >= silenceThreshold) {
+            quietFrames = 0
+            silenceEnd = -1
+            return false
+        }
+        quietFrames++
+        return quietFrames > silenceHangoverFrames
+    }
+
+    // A marker declaring the next silenceMarkerFrames slots silent, renewed a few frames
+    // before the previous one runs out; null for silent frames already covered.
+    // The sequence and timestamp advance either way.
+    private fun silenceFrame(samples: Int): ByteArray? {
+        var bytes: ByteArray? = null
+        if (silenceEnd < 0 || ((silenceEnd - sequence) and 0xFFFF) <= 5) {
+            silenceEnd = (sequence + silenceMarkerFrames) and 0xFFFF
+            bytes = ByteArray(headerSize + 2)
+            val buffer = ByteBuffer.wrap(bytes).order(ByteOrder.LITTLE_ENDIAN)
+            buffer.put(protocolVersion.toByte())
+            buffer.put(flagSilence.toByte())
+            buffer.putShort(sequence.toShort())
+            buffer.putInt(timestamp.toInt())
+            buffer.putShort(silenceEnd.toShort())
+        }
+        sequence = (sequence + 1) and 0xFFFF
+        timestamp = (timestamp + samples) and 0xFFFFFFFFL
+        return bytes
+    }
+
+    private fun buildFrame(shorts: ShortArray): ByteArray {
+        val bytes = ByteArray(headerSize + shorts.size * 2)
         val buffer = ByteBuffer.wrap(bytes).order(ByteOrder.LITTLE_ENDIAN)
+        // Header: version, flags, sequence (uint16), sample-clock timestamp (uint32)
+        buffer.put(protocolVersion.toByte())
+        buffer.put(0.toByte())
+        buffer.putShort(sequence.toShort())
+        buffer.putInt(timestamp.toInt())
         for (s in shorts) {
             buffer.putShort(s)
         }
+        sequence = (sequence + 1) and 0xFFFF
+        timestamp = (timestamp + shorts.size) and 0xFFFFFFFFL
         return bytes
     }
 
+    private fun enableUdp(ipAddress: String, port: Int, key: Long) {
+        Thread {
+            try {
+                udpAddress = InetAddress.getByName(ipAddress)
+                udpPort = port
+                udpKey = key
+                udpSocket = DatagramSocket()
+                Log.i("AudioStreamer", "Streaming audio over UDP port $port")
+            } catch (e: Exception) {
+                Log.w("AudioStreamer", "UDP unavailable, staying on WebSocket: ${e.message}")
+                closeUdp()
+            }
+        }.start()
+    }
+
+    private fun sendDatagram(socket: DatagramSocket, frameBytes: ByteArray) {
+        val datagram = ByteArray(udpKeySize + frameBytes.size)
+        val buffer = ByteBuffer.wrap(datagram).order(ByteOrder.LITTLE_ENDIAN)
+        buffer.putInt(udpKey.toInt())
+        buffer.put(frameBytes)
+        try {
+            socket.send(DatagramPacket(datagram, datagram.size, udpAddress, udpPort))
+        } catch (e: Exception) {
+            Log.w("AudioStreamer", "UDP send failed: ${e.message}")
+        }
+    }
+
+    private fun closeUdp() {
+        udpSocket?.close()
+        udpSocket = null
+    }
+
     private fun stopAudioCapture() {
         isStreaming = false
+        closeUdp()
         try {
             audioRecord?.stop()
             audioRecord?.release()
@@ -165,6 +394,9 @@ class AudioStreamer(private val useOpus: Boolean = false) {  // Default to PCM m
     }
 
     fun stopStreaming() {
+        userStopped = true
+        resumeToken = null
+        disconnectedAt = 0L
         isStreaming = false
         webSocket?.close(1000, "User stopped")
         webSocket = null
@@ -0,0 +1,251 @@
+import gc
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+import numpy as np
+
+from DeviceCache import DeviceCache
+from SharedRing import ORDERED_STORES, SharedRing
+from Sinks import AudioSink, SinkError, create_sink
+
+logger = logging.getLogger("AudioProcess")
+
+STARTUP_TIMEOUT_S = 15.0  # Spawning re-imports the server; opening the device can be slow too
+STATUS_INTERVAL_S = 0.5
+
+
+def _raise_priority():
+    """Best effort: the engine process only wakes up for the device, let it preempt the rest."""
+    try:
+        if os.name == 'nt':
+            import ctypes
+            HIGH_PRIORITY_CLASS = 0x80
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), HIGH_PRIORITY_CLASS)
+        else:
+            os.nice(-10)
+    except (OSError, AttributeError) as e:
+        logger.debug(f"Could not raise the audio process priority: {e}")
+
+
+def engine_main(kind, ring_name, capacity, rate, channels, frame_size, device_index, path, cache_path, sample_format,
+                conn, stop):
+    """
+    Entry point of the audio process: play the shared ring on the device until stop is set.
+
+    Touches nothing but the ring and the sink, which converts the mono
+    ring samples to its channels and sample format. Status goes back to the
+    server over conn: ('ready', None), ('error', message) or
+    ('recovered', seconds).
+    """
+    if not logging.getLogger().handlers:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    # Ctrl+C reaches the whole console group; the server decides when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _raise_priority()
+
+    ring = SharedRing(capacity, ring_name)
+    out = np.zeros(frame_size, dtype=np.int16)
+
+    def render(frame_count):
+        nonlocal out
+        if frame_count > len(out):
+            out = np.zeros(frame_count, dtype=np.int16)
+        block = out[:frame_count]
+        count = ring.read_into(block)
+        if count < frame_count:
+            block[count:] = 0
+        ring.count_period(count < frame_count)
+        return memoryview(block).cast('B')
+
+    cache = DeviceCache(cache_path) if cache_path else None
+    sink = create_sink(kind, rate, channels, frame_size, device_index=device_index, path=path, cache=cache,
+                       sample_format=sample_format)
+    sink.on_recovery = lambda seconds: conn.send(('recovered', seconds))
+    try:
+        sink.start(render)
+    except SinkError as e:
+        conn.send(('error', str(e)))
+        ring.close()
+        return
+
+    # Nothing here creates reference cycles; keep the collector from pausing the callback
+    gc.collect()
+    gc.disable()
+    conn.send(('ready', None))
+    while not stop.wait(STATUS_INTERVAL_S):
+        ring.device_underflows = sink.counters().get('output_underflows', 0)
+    sink.stop()
+    ring.close()
+
+
+class AudioProcessSink(AudioSink):
+    """
+    Runs another sink in a separate audio process, fed through a SharedRing.
+
+    The asyncio loop, the decode worker, logging and metrics all share this
+    process's GIL; a burst of network work or a GC pause there can delay a
+    PortAudio callback in the same process and cause a click. Here the
+    callback lives in its own process and only copies samples out of the
+    shared ring. A feeder thread in the server keeps lead_ms of audio
+    rendered ahead in the ring, so a stall on the server side shorter than
+    that is absorbed by the ring instead of reaching the device.
+
+    Decoding and mixing stay in the server process. If the audio process
+    dies, it is started again.
+    """
+
+    name = 'process'
+    WATCHDOG_INTERVAL_S = 0.25
+
+    def __init__(self, kind, rate, channels, frame_size, device_index=None, path=None, cache=None,
+                 lead_ms=20, sample_format='int16'):
+        """
+        Args:
+            kind: Sink run in the audio process (one of Sinks.SINK_TYPES)
+            device_index: Output device for the PyAudio sinks
+            path: Output file for the file sink
+            cache: DeviceCache for the PyAudio sinks (reopened by path in the audio process)
+            lead_ms: Audio rendered ahead into the ring (adds that much latency)
+            sample_format: Output sample format, converted in the audio process
+        """
+        # Building the sink is cheap and checks the arguments here, where the error can still be reported
+        create_sink(kind, rate, channels, frame_size, path=path, sample_format=sample_format)
+        super().__init__(rate, channels, frame_size, sample_format)
+        self.kind = kind
+        self.device_index = device_index
+        self.path = path
+        self.cache_path = cache.path if cache else None
+        # Whole periods, at least one
+        self.lead = max(1, round(rate * lead_ms / 1000 / frame_size)) * frame_size
+        self.period_s = frame_size / rate
+        self.context = multiprocessing.get_context('spawn')  # Same behaviour on Windows and elsewhere
+        self.ring = None
+        self.process = None
+        self.conn = None
+        self.stop_event = None
+        self.ready = False  # The audio process reported its output open
+        self.feeder = None
+
+    def _spawn(self):
+        """Start the audio process and wait until its output is open."""
+        self.ready = False
+        self.conn, child_conn = self.context.Pipe(duplex=False)
+        self.stop_event = self.context.Event()
+        self.process = self.context.Process(
+            target=engine_main, name="AudioEngine", daemon=True,
+            args=(self.kind, self.ring.name, self.ring.capacity, self.rate, self.channels, self.frame_size,
+                  self.device_index, self.path, self.cache_path, self.sample_format, child_conn, self.stop_event)
+        )
+        self.process.start()
+        child_conn.close()
+
+        if not self.conn.poll(STARTUP_TIMEOUT_S):
+            self._terminate()
+            raise SinkError(f"Audio process did not start within {STARTUP_TIMEOUT_S:.0f} s")
+        try:
+            status, detail = self.conn.recv()
+        except EOFError:
+            status, detail = 'error', f"Audio process exited with code {self.process.exitcode}"
+        if status == 'error':
+            self._terminate()
+            raise SinkError(detail)
+        self.ready = True
+        logger.info(f"Audio process {self.process.pid} playing ({self.kind} sink, "
+                    f"{self.lead / self.rate * 1000:.1f} ms ahead)")
+
+    def _terminate(self):
+        if self.process is None:
+            return
+        self.stop_event.set()
+        self.process.join(timeout=2.0)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout=1.0)
+        self.conn.close()
+        self.process = None
+
+    def start(self, render):
+        self.render = render
+        if not ORDERED_STORES:
+            logger.warning("This CPU may reorder stores: the audio process may occasionally play stale samples")
+        # Room for the lead plus one host-API block larger than planned
+        self.ring = SharedRing(max(self.lead * 2, self.frame_size * 4))
+        self.running = True
+        self.feeder = threading.Thread(target=self._feed, name="AudioProcessFeeder", daemon=True)
+        self.feeder.start()  # Fill the ring before the device asks for audio
+        try:
+            self._spawn()
+        except SinkError:
+            self.stop()
+            raise
+
+    def _feed(self):
+        """Keep the ring lead samples ahead of the audio process; watch that process."""
+        poll_s = max(self.period_s / 4, 0.001)
+        next_check = time.monotonic() + self.WATCHDOG_INTERVAL_S
+        while self.running:
+            while self.ring.available() < self.lead and self.ring.space() >= self.frame_size:
+                self.ring.write(np.frombuffer(self.render(self.frame_size), dtype=np.int16))
+            time.sleep(poll_s)
+
+            if time.monotonic() >= next_check:
+                next_check = time.monotonic() + self.WATCHDOG_INTERVAL_S
+                self._check_process()
+
+    def _check_process(self):
+        if not self.ready:
+            return  # Starting; _spawn() reads the status
+        process = self.process
+        try:
+            while self.conn.poll():
+                status, detail = self.conn.recv()
+                if status == 'recovered' and self.on_recovery:
+                    self.on_recovery(detail)
+        except (EOFError, OSError):
+            pass
+        if process.is_alive() or not self.running:
+            return
+
+        lost_at = time.monotonic()
+        logger.error(f"Audio process exited (code {process.exitcode}), restarting it")
+        self.conn.close()
+        self.process = None
+        delay = 0.1
+        while self.running:
+            try:
+                self._spawn()
+                break
+            except SinkError as e:
+                logger.warning(f"{e}; retrying in {delay:.1f} s")
+                time.sleep(delay)
+                delay = min(delay * 2, 2.0)
+        else:
+            return
+        recovery_s = time.monotonic() - lost_at
+        logger.info(f"Audio process restarted after {recovery_s:.2f} s")
+        if self.on_recovery:
+            self.on_recovery(recovery_s)
+
+    def counters(self):
+        if self.ring is None:
+            return {}
+        return {
+            'output_periods': self.ring.periods,
+            'output_underruns': self.ring.underruns,
+            'output_underflows': self.ring.device_underflows
+        }
+
+    def stop(self):
+        self.running = False
+        if self.feeder:
+            self.feeder.join(timeout=1.0)
+            self.feeder = None
+        self._terminate()
+        if self.ring:
+            self.ring.close()
+            self.ring = None
@@ -0,0 +1,446 @@
+import asyncio
+import logging
+import math
+import time
+
+import numpy as np
+import websockets
+
+from protocol import pack_frame, encode_control, decode_control
+
+logger = logging.getLogger("Calibration")
+
+CHIRP_S = 0.2
+CHIRP_BAND_HZ = (200.0, 8000.0)
+CHIRP_LEVEL = 12000  # Peak amplitude; loud enough to survive the gate and AGC
+MAX_DELAY_S = 1.0  # Longest delay searched for
+MIN_CORRELATION = 0.5  # Weaker matches are reported as not found
+LEAD_IN_S = 1.0  # Silence before the first chirp, while the buffer fills
+CAPTURE_DEVICE_NAMES = ("CABLE Output", "VB-Audio", "Virtual Audio Cable")
+OFFERED_FRAME_MS = [10, 20]  # Same offer as the Android app
+
+
+def chirp(rate, duration_s=CHIRP_S, band=CHIRP_BAND_HZ, level=CHIRP_LEVEL):
+    """Exponential sine sweep with 5 ms raised-cosine ends, as int16."""
+    n = int(rate * duration_s)
+    t = np.arange(n) / rate
+    f0, f1 = band
+    k = math.log(f1 / f0)
+    sweep = np.sin(2 * np.pi * f0 * duration_s / k * (np.exp(t * k / duration_s) - 1.0))
+    ramp = int(rate * 0.005)
+    window = 0.5 - 0.5 * np.cos(np.pi * np.arange(ramp) / ramp)
+    sweep[:ramp] *= window
+    sweep[-ramp:] *= window[::-1]
+    return (sweep * level).astype(np.int16)
+
+
+def find_delay(reference, captured):
+    """
+    Locate reference inside captured by FFT cross-correlation.
+
+    Returns:
+        (lag, score): offset of reference in captured in samples, and the
+        normalized correlation there (1.0 for an exact copy), or (None, 0.0)
+        if captured is shorter than reference
+    """
+    n = len(reference)
+    if len(captured) < n:
+        return None, 0.0
+    ref = reference.astype(np.float64)
+    x = captured.astype(np.float64)
+    nfft = 1 << (len(x) + n - 1).bit_length()
+    corr = np.fft.irfft(np.fft.rfft(x, nfft) * np.conj(np.fft.rfft(ref, nfft)), nfft)[:len(x) - n + 1]
+    lag = int(np.argmax(corr))
+    energy = np.concatenate(([0.0], np.cumsum(x ** 2)))
+    denominator = math.sqrt(float(np.dot(ref, ref)) * (energy[lag + n] - energy[lag]))
+    return lag, float(corr[lag] / denominator) if denominator > 0 else 0.0
+
+
+class Recording:
+    """
+    Preallocated recording of int16 blocks, each stamped with the
+    time.monotonic() of its first sample. Written by one thread (the
+    render or capture callback), read after the recording stopped.
+    """
+
+    def __init__(self, rate, seconds, max_blocks=8192):
+        self.rate = rate
+        self.samples = np.zeros(int(rate * seconds), dtype=np.int16)
+        self.offsets = np.zeros(max_blocks, dtype=np.int64)
+        self.times = np.zeros(max_blocks, dtype=np.float64)
+        self.length = 0
+        self.blocks = 0
+
+    def add(self, samples, start_time):
+        n = min(len(samples), len(self.samples) - self.length)
+        if n <= 0 or self.blocks == len(self.times):
+            return
+        self.samples[self.length:self.length + n] = samples[:n]
+        self.offsets[self.blocks] = self.length
+        self.times[self.blocks] = start_time
+        self.length += n
+        self.blocks += 1
+
+    def locate(self, reference, not_before):
+        """
+        Find reference in the audio recorded from not_before up to
+        MAX_DELAY_S later.
+
+        Returns:
+            (time of its first sample, correlation score), or (None, score)
+        """
+        times = self.times[:self.blocks]
+        offsets = self.offsets[:self.blocks]
+        first = max(0, int(np.searchsorted(times, not_before, side='right')) - 1)
+        last = int(np.searchsorted(times, not_before + MAX_DELAY_S, side='right'))
+        if first >= last:
+            return None, 0.0
+        start = offsets[first]
+        end = offsets[last] if last < self.blocks else self.length
+        lag, score = find_delay(reference, self.samples[start:end])
+        if lag is None or score < MIN_CORRELATION:
+            return None, score
+        # Time from the block holding the match: blocks need not be contiguous
+        position = start + lag
+        block = int(np.searchsorted(offsets, position, side='right')) - 1
+        return float(times[block] + (position - offsets[block]) / self.rate), score
+
+
+class OutputTap:
+    """
+    Records every block the server renders (the output_tap hook), before
+    the sink plays it. Also samples how far the calibration session is
+    decoded ahead of the render (its output ring).
+    """
+
+    def __init__(self, rate, seconds):
+        self.recording = Recording(rate, seconds)
+        self.session = None
+        self.ring_samples = 0
+        self.renders = 0
+
+    def __call__(self, data):
+        self.recording.add(np.frombuffer(data, dtype=np.int16), time.monotonic())
+        session = self.session
+        if session is not None:
+            self.ring_samples += session.output_ring.available() + len(data) // 2  # Before this render took its share
+            self.renders += 1
+
+
+class InputCapture:
+    """
+    Records an input device, normally CABLE Output: what the server plays
+    into the virtual cable, as an application reading the cable hears it.
+    """
+
+    def __init__(self, rate, seconds, device=None):
+        """
+        Args:
+            device: Input device index, a substring of its name, or None to look for the virtual cable
+        """
+        self.rate = rate
+        self.device = device
+        self.recording = Recording(rate, seconds)
+        self.pyaudio = None
+        self.p = None
+        self.stream = None
+        self.name = None
+        self.clock_offset = None  # time.monotonic() minus the PortAudio stream clock
+
+    def _find_device(self, pyaudio_instance):
+        wanted = [self.device] if isinstance(self.device, str) else list(CAPTURE_DEVICE_NAMES)
+        for name in wanted:
+            for i in range(pyaudio_instance.get_device_count()):
+                info = pyaudio_instance.get_device_info_by_index(i)
+                if name.lower() in info.get('name', '').lower() and info.get('maxInputChannels', 0) > 0:
+                    return i
+        return None
+
+    def start(self):
+        """Open the input. Returns False if there is no such device (or no PyAudio)."""
+        try:
+            import pyaudio
+        except ImportError:
+            logger.warning("PyAudio is not installed, measuring up to the server's output only")
+            return False
+        self.pyaudio = pyaudio
+        self.p = pyaudio.PyAudio()
+        index = self.device if isinstance(self.device, int) else self._find_device(self.p)
+        if index is None:
+            logger.warning("No capture device found (CABLE Output), measuring up to the server's output only")
+            self.p.terminate()
+            self.p = None
+            return False
+        self.name = self.p.get_device_info_by_index(index).get('name')
+        try:
+            self.stream = self.p.open(format=pyaudio.paInt16, channels=1, rate=self.rate, input=True,
+                                      input_device_index=index, frames_per_buffer=256,
+                                      stream_callback=self._callback)
+        except Exception as e:
+            logger.warning(f"Could not open {self.name} for capture: {e}")
+            self.p.terminate()
+            self.p = None
+            return False
+        logger.info(f"Capturing from {self.name}")
+        return True
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        now = time.monotonic()
+        adc_time = time_info.get('input_buffer_adc_time', 0.0)
+        if adc_time > 0.0:
+            if self.clock_offset is None:
+                self.clock_offset = now - time_info['current_time']
+            start_time = adc_time + self.clock_offset
+        else:
+            # Host API without timing: assume the block was just recorded
+            start_time = now - frame_count / self.rate - self.stream.get_input_latency()
+        self.recording.add(np.frombuffer(in_data, dtype=np.int16), start_time)
+        return None, self.pyaudio.paContinue
+
+    def stop(self):
+        if self.stream:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+        if self.p:
+            self.p.terminate()
+            self.p = None
+
+
+class Calibrator:
+    """
+    Measures the real playout delay of this server on this machine.
+
+    Connects to the running server like a phone (same handshake offer as
+    the app), streams silence with a chirp every interval_s, and finds
+    each chirp again by FFT cross-correlation in:
+    - what the server renders (the output_tap hook), and
+    - optionally an input device such as CABLE Output, which adds the
+      output device and virtual cable.
+
+    The delay is counted from the moment the first sample of the chirp
+    would have been spoken into the phone. The breakdown splits it into
+    packetization (frame duration), network and decode queue (from the
+    frame timestamps and their arrival times), JitterBuffer depth, output
+    ring and output device. Phones connected during the calibration are
+    reported too: their measured jitter is what the JitterBuffer
+    suggestion is based on.
+    """
+
+    def __init__(self, server, port, rate, capture_device=None, chirps=5, interval_s=1.0):
+        """
+        Args:
+            server: The running AudioServer
+            port: Its WebSocket port
+            rate: Output sample rate
+            capture_device: Input device for the end-to-end measurement (index or name),
+                            None to look for CABLE Output, False to measure up to the render only
+            chirps: Chirps sent
+            interval_s: Time between chirps
+        """
+        self.server = server
+        self.port = port
+        self.rate = rate
+        self.capture_device = capture_device
+        self.chirps = chirps
+        self.interval_s = interval_s
+        self.reference = chirp(rate)
+
+    async def _handshake(self, ws):
+        await ws.send(encode_control('hello', codec='pcm', rate=self.rate, channels=1, frame_ms=OFFERED_FRAME_MS))
+        while True:
+            message = decode_control(await ws.recv())
+            if message.get('type') == 'config':
+                return message
+            if message.get('type') == 'error':
+                raise RuntimeError(f"Server rejected the calibration stream: {message.get('reason')}")
+
+    async def run(self):
+        """Stream the chirps and return the report (see format_report)."""
+        duration = LEAD_IN_S + self.chirps * self.interval_s
+        tap = OutputTap(self.rate, duration + MAX_DELAY_S + 1.0)
+        capture = None
+        if self.capture_device is not False:
+            capture = InputCapture(self.rate, duration + MAX_DELAY_S + 1.0, self.capture_device)
+            if not await asyncio.to_thread(capture.start):
+                capture = None
+        self.server.output_tap = tap
+
+        starts = [int((LEAD_IN_S + k * self.interval_s) * self.rate) for k in range(self.chirps)]
+        try:
+            async with websockets.connect(f"ws://127.0.0.1:{self.port}", compression=None) as ws:
+                known = set(self.server.sessions)
+                config = await self._handshake(ws)
+                frame_size = config['frame_size']
+                frame_s = frame_size / self.rate
+                signal = np.zeros(int(duration * self.rate) // frame_size * frame_size + frame_size, dtype=np.int16)
+                for start in starts:
+                    signal[start:start + len(self.reference)] = self.reference
+
+                transits = []
+                session = None
+                t0 = time.monotonic()
+                for seq in range(len(signal) // frame_size):
+                    # Frame seq is complete (captured) one frame after its first sample
+                    await asyncio.sleep(max(0.0, t0 + (seq + 1) * frame_s - time.monotonic()))
+                    pcm = signal[seq * frame_size:(seq + 1) * frame_size].tobytes()
+                    await ws.send(pack_frame(seq & 0xFFFF, seq * frame_size, pcm))
+                    if session is None:
+                        new = set(self.server.sessions) - known
+                        session = self.server.sessions[new.pop()] if new else None
+                        tap.session = session
+                    elif session.jitter_buffer.last_arrival_ms is not None:
+                        # Arrival of the newest frame, against the time its last sample was spoken
+                        jb = session.jitter_buffer
+                        transits.append(jb.last_arrival_ms / 1000.0 - t0 - jb.last_arrival_ts / self.rate - frame_s)
+                if session is None:
+                    raise RuntimeError("The server did not start a session for the calibration stream")
+                # Network figures now: the calibration stream underruns from here on
+                others = [s for s in self.server.active_sessions if s is not session]
+                if others:
+                    networks = [self._network(f"phone {other}", other) for other in others]
+                else:
+                    networks = [self._network('local loopback; connect a phone to measure its network', session)]
+                depth_frames = session.metrics.depth.mean()
+                await asyncio.sleep(MAX_DELAY_S)
+                await ws.close(1000, "Calibration done")
+        finally:
+            self.server.output_tap = None
+            if capture:
+                await asyncio.to_thread(capture.stop)
+
+        render, output, scores = [], [], []
+        for start in starts:
+            spoken = t0 + start / self.rate
+            rendered, score = tap.recording.locate(self.reference, spoken)
+            scores.append(score)
+            if rendered is None:
+                continue
+            render.append(rendered - spoken)
+            if capture:
+                captured, _ = capture.recording.locate(self.reference, rendered)
+                if captured is not None:
+                    output.append(captured - rendered)
+
+        return self._report(config, networks, depth_frames, render, output, scores, transits,
+                            tap.ring_samples / tap.renders if tap.renders else 0.0,
+                            capture.name if capture else None)
+
+    def _report(self, config, networks, depth_frames, render, output, scores, transits, ring_samples,
+                capture_name):
+        frame_ms = config['frame_ms']
+        ms = lambda seconds: round(seconds * 1000.0, 1)
+        report = {
+            'frame_ms': frame_ms,
+            'period_ms': round(self.server.period_size * 1000.0 / self.rate, 1),
+            'chirps_sent': self.chirps,
+            'chirps_found': len(render),
+            'correlation': round(min(scores), 3) if scores else 0.0,
+            'capture_device': capture_name,
+            'render_ms': None,
+            'output_ms': None,
+            'total_ms': None,
+            'stages': [],
+            'networks': networks,
+            'suggestions': []
+        }
+        if not render:
+            report['suggestions'].append("No chirp came back: check that nothing else is feeding the output "
+                                         "and that the DSP gate threshold is not above speech level")
+            return report
+
+        render_s = float(np.median(render))
+        report['render_ms'] = {'median': ms(render_s), 'min': ms(min(render)), 'max': ms(max(render))}
+        network_s = float(np.median(transits)) if transits else 0.0
+        buffer_s = depth_frames * frame_ms / 1000.0
+        ring_s = ring_samples / self.rate
+        report['stages'] = [
+            ('packetization', float(frame_ms), 'one frame captured before it is sent'),
+            ('network + decode queue', ms(network_s), 'frame arrival against its timestamp'),
+            ('jitter buffer', ms(buffer_s), f'mean depth {depth_frames:.1f} frames'),
+            ('output ring', ms(ring_s), 'decoded ahead of the render'),
+            ('scheduling', ms(render_s - frame_ms / 1000.0 - network_s - buffer_s - ring_s),
+             'remainder up to the render')
+        ]
+        total_s = render_s
+        if output:
+            output_s = float(np.median(output))
+            report['output_ms'] = {'median': ms(output_s), 'min': ms(min(output)), 'max': ms(max(output))}
+            report['stages'].append(('output device + cable', ms(output_s), f'render to {capture_name}'))
+            total_s += output_s
+        report['total_ms'] = ms(total_s)
+
+        self._suggest(report)
+        return report
+
+    @staticmethod
+    def _network(source, session):
+        stats = session.get_stats()
+        return {
+            'source': source,
+            'frame_ms': session.config.frame_ms,
+            'jitter_ms': round(stats['jitter_ms'], 1),
+            'iat_p99_ms': round(session.metrics.interarrival.quantile(0.99) * 1000, 1),
+            'lost': stats['lost'],
+            'underruns': stats['underruns'],
+            'target_ms': stats['target_ms']
+        }
+
+    def _suggest(self, report):
+        suggestions = report['suggestions']
+        # Same rule as the adaptive JitterBuffer (one frame + 4 x jitter), covering the worst arrival gap too
+        wanted = []
+        for network in report['networks']:
+            frame_ms = network['frame_ms']
+            needed = max(frame_ms + 4.0 * network['jitter_ms'], network['iat_p99_ms'], 20.0)
+            wanted.append((math.ceil(needed / frame_ms) * frame_ms, network))
+        buffer_ms, network = max(wanted, key=lambda item: item[0])
+        buffer_ms = min(int(buffer_ms), 100)
+        if network['iat_p99_ms'] <= 2 * network['frame_ms'] and not network['lost']:
+            suggestions.append(f"--buffer-ms {buffer_ms} --fixed-buffer (arrivals are steady: "
+                               f"p99 gap {network['iat_p99_ms']} ms)")
+        else:
+            suggestions.append(f"--buffer-ms {buffer_ms} (adaptive; measured jitter {network['jitter_ms']} ms)")
+        if network['underruns'] and network['source'].startswith('phone'):
+            suggestions.append("Underruns during calibration: consider --udp, 5 GHz WiFi, or a larger --buffer-ms")
+
+        if report['output_ms'] and report['output_ms']['median'] > 3 * report['period_ms'] \
+                and self.server.period_size > 256:
+            suggestions.append("The output device holds several periods: try --period-size 256")
+        if report['render_ms']['max'] - report['render_ms']['min'] > report['frame_ms']:
+            suggestions.append("Delay varied by more than a frame between chirps: the buffer adapted, "
+                               "or the server is overloaded (see --audio-process)")
+
+
+def format_report(report):
+    """Human-readable calibration report."""
+    lines = ["", "=" * 60, " LATENCY CALIBRATION", "=" * 60]
+    lines.append(f" Chirps found: {report['chirps_found']}/{report['chirps_sent']} "
+                 f"(weakest correlation {report['correlation']})")
+    lines.append(f" Stream: {report['frame_ms']} ms frames, output period {report['period_ms']} ms")
+    if report['render_ms']:
+        r = report['render_ms']
+        lines.append(f" Mouth to render:  {r['median']} ms (min {r['min']}, max {r['max']})")
+    if report['output_ms']:
+        o = report['output_ms']
+        lines.append(f" Render to capture: {o['median']} ms (min {o['min']}, max {o['max']})")
+    if report['total_ms'] is not None:
+        lines.append(f" Total measured:   {report['total_ms']} ms"
+                     + ("" if report['output_ms'] else " (output device not included)"))
+    if report['stages']:
+        lines.append("")
+        lines.append(" Breakdown:")
+        for name, value, note in report['stages']:
+            lines.append(f"   {name:<24} {value:>7.1f} ms   {note}")
+    for network in report['networks']:
+        lines.append("")
+        lines.append(f" Network ({network['source']}):")
+        lines.append(f"   jitter {network['jitter_ms']} ms, p99 arrival gap {network['iat_p99_ms']} ms, "
+                     f"lost {network['lost']}, underruns {network['underruns']}, current target {network['target_ms']} ms")
+    if report['suggestions']:
+        lines.append("")
+        lines.append(" Suggested settings:")
+        for suggestion in report['suggestions']:
+            lines.append(f"   {suggestion}")
+    lines.append("=" * 60)
+    return '\n'.join(lines)
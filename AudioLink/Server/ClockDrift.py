@@ -0,0 +1,265 @@
+import logging
+import numpy as np
+
+from SampleRing import SampleRing
+
+logger = logging.getLogger("ClockDrift")
+
+
+class DriftEstimator:
+    """
+    Estimates the clock drift between the sender's capture clock and the
+    local output clock from the long-term trend of the buffer depth.
+
+    Clock drift shows as a trend, not as an offset: where the depth sits
+    against the target depends on how arrivals and output periods line up,
+    and the JitterBuffer steers it with its own grow/shrink steps. So the
+    depth is averaged over the first smoothing period to learn a baseline,
+    and only a slow move away from that baseline counts as drift. The
+    caller takes the JitterBuffer's grow/shrink steps out of the depth it
+    passes in, or the two loops would pull against each other.
+
+    A slow exponential average removes network jitter from the depth, and a
+    PI controller turns the error beyond a small deadband into a resampling
+    ratio. A stream without drift never leaves the deadband and keeps a
+    ratio of exactly 1.0, which the resampler passes through untouched.
+    Inside the deadband the integral is held, so a learned drift keeps
+    being corrected. Once the depth is pinned the average correction equals
+    the real drift, so a long average of it is reported as the estimate.
+    """
+
+    def __init__(self, frame_duration_ms=20, max_ppm=1000, smoothing_s=10.0, kp=2e-3, ki=2e-5, deadband=0.25):
+        """
+        Args:
+            frame_duration_ms: Interval between update() calls
+            max_ppm: Correction range (1000 ppm = +/-0.1%)
+            smoothing_s: Time constant of the depth average in seconds, and
+                         the time spent learning the baseline
+            kp: Proportional gain (ratio per frame of depth error)
+            ki: Integral gain (ratio per frame-second of depth error)
+            deadband: Frames the smoothed depth may move from the baseline uncorrected
+        """
+        self.dt = frame_duration_ms / 1000.0
+        self.max_correction = max_ppm * 1e-6
+        self.alpha = min(1.0, self.dt / smoothing_s)
+        self.settle_updates = max(1, round(smoothing_s / self.dt))
+        self.kp = kp
+        self.ki = ki
+        self.deadband = deadband
+
+        self.updates = 0
+        self.smoothed_depth = 0.0
+        self.baseline = None
+        self.integral = 0.0
+        self.ratio = 1.0
+        self.avg_correction = 0.0
+        self.report_alpha = min(1.0, self.dt / 60.0)
+
+    def update(self, depth):
+        """
+        Feed one depth sample (in frames) and return the new output/input ratio.
+        A ratio below 1.0 means the buffer is filling up and must be drained.
+        """
+        self.updates += 1
+        # Plain mean while learning the baseline, then the exponential average
+        alpha = max(self.alpha, 1.0 / self.updates)
+        self.smoothed_depth += (depth - self.smoothed_depth) * alpha
+        if self.baseline is None:
+            if self.updates < self.settle_updates:
+                return self.ratio
+            self.baseline = self.smoothed_depth
+
+        error = self.smoothed_depth - self.baseline
+        if error > self.deadband:
+            error -= self.deadband
+        elif error < -self.deadband:
+            error += self.deadband
+        else:
+            error = 0.0
+        if error:
+            integral = self.integral + error * self.dt
+            # Anti-windup: only integrate while the integral term alone is in range
+            if abs(integral * self.ki) <= self.max_correction:
+                self.integral = integral
+
+        correction = self.kp * error + self.ki * self.integral
+        correction = max(-self.max_correction, min(self.max_correction, correction))
+        self.ratio = 1.0 - correction
+        self.avg_correction += (correction - self.avg_correction) * self.report_alpha
+        return self.ratio
+
+    @property
+    def drift_ppm(self):
+        """Long-term drift estimate (positive: sender clock runs fast)."""
+        return self.avg_correction * 1e6
+
+    def reset(self):
+        self.updates = 0
+        self.smoothed_depth = 0.0
+        self.baseline = None
+        self.integral = 0.0
+        self.ratio = 1.0
+        self.avg_correction = 0.0
+
+
+class FractionalResampler:
+    """
+    Streaming linear-interpolation resampler for small ratio changes.
+
+    Each block is processed with one vectorized NumPy interpolation. The
+    fractional read position and the last input sample are carried over
+    so consecutive blocks join without discontinuities. Linear
+    interpolation is adequate for the +/-0.1% range used for drift
+    correction. At a ratio of exactly 1.0 the samples are copied instead
+    (one sample late, as the interpolating path is at phase 0): a lasting
+    fractional phase would low-pass the signal for nothing.
+
+    Work arrays are allocated for the largest block seen and reused, so
+    steady-state processing does not allocate sample memory.
+    """
+
+    MAX_STEP_CHANGE = 0.01  # Work arrays cover ratios down to 0.99
+
+    def __init__(self):
+        self.phase = 0.0  # Read position relative to the previous block's last sample
+        self.prev = 0.0
+        self.block_size = 0
+
+    def _ensure_capacity(self, n_in):
+        if n_in <= self.block_size:
+            return
+        max_out = int(np.ceil(n_in / (1.0 - self.MAX_STEP_CHANGE))) + 2
+        self.block_size = n_in
+        self.history = np.zeros(n_in + 1, dtype=np.float32)
+        self.ramp = np.arange(max_out, dtype=np.float64)
+        self.pos = np.empty(max_out, dtype=np.float64)
+        self.index = np.empty(max_out, dtype=np.int64)
+        self.frac = np.empty(max_out, dtype=np.float32)
+        self.left = np.empty(max_out, dtype=np.float32)
+        self.right = np.empty(max_out, dtype=np.float32)
+
+    def process(self, samples, ratio):
+        """
+        Args:
+            samples: 1-D int16 or float32 block
+            ratio: Output samples per input sample
+
+        Returns:
+            float32 view of about len(samples) * ratio samples, valid until
+            the next call
+        """
+        n_in = len(samples)
+        self._ensure_capacity(n_in)
+        if ratio == 1.0:
+            # Snap back onto the sample grid (a one-off sub-sample step) and copy
+            out = self.left[:n_in]
+            out[0] = self.prev
+            out[1:] = samples[:-1]
+            self.phase = 0.0
+            self.prev = float(samples[-1])
+            return out
+
+        step = 1.0 / ratio
+        count = int(np.ceil((n_in - self.phase) / step))
+        if count <= 0:
+            self.phase -= n_in
+            self.prev = float(samples[-1])
+            return self.left[:0]
+
+        history = self.history[:n_in + 1]
+        history[0] = self.prev
+        history[1:] = samples
+
+        pos = self.pos[:count]
+        index = self.index[:count]
+        frac = self.frac[:count]
+        left = self.left[:count]
+        right = self.right[:count]
+
+        np.multiply(self.ramp[:count], step, out=pos)
+        pos += self.phase
+        index[:] = pos  # Truncation == floor for non-negative positions
+        np.subtract(pos, index, out=frac, casting='unsafe')
+        np.take(history, index, out=left)
+        np.take(history[1:], index, out=right)
+        # left + (right - left) * frac
+        right -= left
+        right *= frac
+        left += right
+
+        self.phase = pos[-1] + step - n_in
+        self.prev = float(samples[-1])
+        return left
+
+    def reset(self):
+        self.phase = 0.0
+        self.prev = 0.0
+
+
+class DriftCompensator:
+    """
+    Drift-correction stage between the decoder and the output.
+
+    Decoded frames are resampled by the ratio the DriftEstimator derives
+    from the buffer depth, and the variable-length result is re-chunked
+    into fixed output frames through a preallocated SampleRing.
+    """
+
+    def __init__(self, frame_size, frame_duration_ms=20, max_ppm=1000, output_size=None):
+        """
+        Args:
+            frame_size: Samples per decoded frame
+            frame_duration_ms: Duration of each decoded frame
+            max_ppm: Correction range (1000 ppm = +/-0.1%)
+            output_size: Samples per output frame (default: frame_size)
+        """
+        self.frame_size = frame_size
+        self.output_size = output_size or frame_size
+        self.estimator = DriftEstimator(frame_duration_ms=frame_duration_ms, max_ppm=max_ppm)
+        self.resampler = FractionalResampler()
+        self.ring = SampleRing(max(frame_size, self.output_size) * 4, dtype=np.float32)
+        self.output = np.zeros(self.output_size, dtype=np.float32)
+        self.output_int16 = np.zeros(self.output_size, dtype=np.int16)
+
+    def available(self):
+        """Number of resampled samples ready for output."""
+        return self.ring.available()
+
+    def feed(self, pcm, depth):
+        """
+        Resample one decoded frame.
+
+        Args:
+            pcm: int16 PCM bytes
+            depth: Jitter-buffer fill level in frames without the JitterBuffer's own
+                   grow/shrink steps, or None to keep the current ratio
+        """
+        if depth is None:
+            ratio = self.estimator.ratio
+        else:
+            # Each correction moves audio between the jitter buffer and the resampled
+            # backlog here, so the drift only shows smoothly in the sum of the two
+            ratio = self.estimator.update(depth + self.available() / self.frame_size)
+        samples = np.frombuffer(pcm, dtype=np.int16)
+        self.ring.write(self.resampler.process(samples, ratio))
+
+    def read(self):
+        """Take one output frame as an int16 array (reused between calls)."""
+        out = self.output
+        count = self.ring.read_into(out)
+        out[count:] = 0
+        np.rint(out, out=out)
+        np.clip(out, -32768, 32767, out=out)
+        self.output_int16[:] = out
+        return self.output_int16
+
+    def get_stats(self):
+        return {
+            'drift_ppm': round(self.estimator.drift_ppm, 1),
+            'resample_ratio': self.estimator.ratio
+        }
+
+    def reset(self):
+        self.estimator.reset()
+        self.resampler.reset()
+        self.ring.clear()
@@ -0,0 +1,205 @@
+import logging
+import math
+import numpy as np
+
+logger = logging.getLogger("Concealment")
+
+
+class Concealer:
+    """
+    Base class for concealment stages.
+
+    Tracks the background-noise level of decoded frames so subclasses can
+    synthesize comfort noise and callers can tell silent frames apart
+    (the adaptive JitterBuffer only skips silent frames when shrinking).
+    comfort_noise() fills frames the sender declared silent (DTX) without
+    touching the decoder.
+    """
+
+    NOISE_TABLE_FRAMES = 50  # Unit-level noise generated once, read at random offsets
+
+    def __init__(self, frame_samples, max_noise_level=300.0, silence_margin=2.0):
+        """
+        Args:
+            frame_samples: Interleaved samples per frame
+            max_noise_level: Upper bound for the tracked noise RMS (int16 units)
+            silence_margin: A frame is silent if its RMS is below margin * noise level
+        """
+        self.frame_samples = frame_samples
+        self.work = np.zeros(frame_samples, dtype=np.float32)  # Reused for level measurement
+        self.max_noise_level = max_noise_level
+        self.silence_margin = silence_margin
+        self.noise_level = 0.0
+        self.last_rms = 0.0
+        self.rng = np.random.default_rng()
+        self.noise_table = None
+        self.stats = self._new_stats()
+
+    @staticmethod
+    def _new_stats():
+        return {
+            'concealed': 0,
+            'fec_recovered': 0
+        }
+
+    def _track_noise(self, samples):
+        """Follow the background level: fall immediately, rise slowly."""
+        if len(samples) != len(self.work):
+            return
+        self.work[:] = samples
+        rms = math.sqrt(float(np.dot(self.work, self.work)) / len(self.work))
+        self.last_rms = rms
+        if rms < self.noise_level or self.noise_level == 0.0:
+            self.noise_level = rms
+        else:
+            self.noise_level += (rms - self.noise_level) * 0.01
+        self.noise_level = min(self.noise_level, self.max_noise_level)
+
+    def comfort_noise(self):
+        """One frame of noise at the tracked background level, as an int16 array reused between calls."""
+        n = self.frame_samples
+        if self.noise_table is None:
+            self.noise_table = self.rng.standard_normal(n * self.NOISE_TABLE_FRAMES).astype(np.float32)
+            self.noise_frame = np.zeros(n, dtype=np.int16)
+        start = int(self.rng.integers(0, len(self.noise_table) - n))
+        np.multiply(self.noise_table[start:start + n], self.noise_level, out=self.work)
+        self.noise_frame[:] = self.work  # Background level is capped far below full scale
+        return self.noise_frame
+
+    def is_silent(self):
+        """True if the most recently decoded frame is at the background-noise level."""
+        return self.last_rms <= max(self.noise_level * self.silence_margin, 1.0)
+
+    def reset(self):
+        self.noise_level = 0.0
+        self.last_rms = 0.0
+        self.stats = self._new_stats()
+
+
+class PcmConcealer(Concealer):
+    """
+    Packet-loss concealment for raw 16-bit PCM.
+
+    The first concealed frame replays the last good frame with a fade-out
+    that crossfades into comfort noise. Further concealed frames are pure
+    comfort noise at the tracked background-noise level. The first real
+    frame after a gap is faded back in to avoid a click.
+    """
+
+    def __init__(self, frame_size, channels=1, max_noise_level=300.0):
+        """
+        Args:
+            frame_size: Samples per channel in each frame
+            channels: Interleaved channel count
+            max_noise_level: Upper bound for the comfort-noise RMS (int16 units)
+        """
+        super().__init__(frame_size * channels, max_noise_level)
+        self.last_samples = None
+        self.concealing = False
+        self.fade_out = np.linspace(1.0, 0.0, self.frame_samples, dtype=np.float32)
+        self.fade_in = self.fade_out[::-1].copy()
+        self.mix = np.zeros(self.frame_samples, dtype=np.float32)  # Reused crossfade buffers
+        self.mix_int16 = np.zeros(self.frame_samples, dtype=np.int16)
+
+    def decode(self, payload):
+        """Pass a received PCM frame through, fading in after a concealed gap."""
+        samples = np.frombuffer(payload, dtype=np.int16)
+        if len(samples) != self.frame_samples:
+            return payload
+
+        self._track_noise(samples)
+        self.last_samples = samples
+
+        if self.concealing:
+            self.concealing = False
+            return (samples * self.fade_in).astype(np.int16).tobytes()
+        return payload
+
+    def comfort_noise(self):
+        self.concealing = True  # Fade the first frame after the silence back in
+        return super().comfort_noise()
+
+    def conceal(self, next_payload=None):
+        """Synthesize one frame for a missing slot."""
+        self.stats['concealed'] += 1
+        noise = super().comfort_noise()
+        crossfade = not self.concealing and self.last_samples is not None
+        self.concealing = True
+        if not crossfade:
+            return noise.tobytes()
+
+        np.multiply(self.last_samples, self.fade_out, out=self.mix)
+        np.multiply(noise, self.fade_in, out=self.work)
+        self.mix += self.work
+        np.clip(self.mix, -32768, 32767, out=self.mix)
+        self.mix_int16[:] = self.mix
+        return self.mix_int16.tobytes()
+
+    def reset(self):
+        super().reset()
+        self.last_samples = None
+        self.concealing = False
+
+
+class OpusConcealer(Concealer):
+    """
+    Opus decoding with packet-loss concealment.
+
+    Packets are decoded at playout time, in sequence order, so the decoder
+    state always matches the stream. A missing packet is recovered from the
+    in-band FEC data of the next packet when it has already arrived,
+    otherwise the decoder's PLC path (decode with no packet) is used, and
+    comfort noise if that fails too.
+    """
+
+    def __init__(self, decoder, frame_size, channels=1):
+        """
+        Args:
+            decoder: opuslib.Decoder instance
+            frame_size: Samples per channel in each frame
+            channels: Channel count the decoder was created with
+        """
+        import opuslib
+        import opuslib.api.decoder
+
+        super().__init__(frame_size * channels)
+        self.decoder = decoder
+        self.frame_size = frame_size
+        self.channels = channels
+        self.opus_error = opuslib.OpusError
+        self._decode_raw = opuslib.api.decoder.decode
+
+    def decode(self, payload):
+        """Decode one Opus packet to PCM, concealing it if it is corrupt."""
+        try:
+            pcm = self.decoder.decode(payload, self.frame_size)
+        except self.opus_error as e:
+            logger.warning(f"Opus decode error: {e}")
+            return self.conceal()
+        self._track_noise(np.frombuffer(pcm, dtype=np.int16))
+        return pcm
+
+    def conceal(self, next_payload=None):
+        """Synthesize one frame for a missing slot using FEC or PLC."""
+        self.stats['concealed'] += 1
+
+        if next_payload is not None:
+            try:
+                pcm = self.decoder.decode(next_payload, self.frame_size, decode_fec=True)
+                self.stats['fec_recovered'] += 1
+                return pcm
+            except self.opus_error:
+                pass
+
+        # PLC: decode with no packet
+        try:
+            return self._decode_raw(
+                self.decoder.decoder_state, None, 0, self.frame_size, False, channels=self.channels
+            )
+        except self.opus_error as e:
+            logger.warning(f"Opus PLC error: {e}")
+            return self.comfort_noise().tobytes()
+
+    def reset(self):
+        super().reset()
+        self.decoder.reset_state()
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import math
+import queue
+import threading
+
+logger = logging.getLogger("DecodeWorker")
+
+
+class DecodeWorker:
+    """
+    Dedicated thread for everything between the network and the output.
+
+    The event loop only parses headers and hands frames over through a
+    bounded queue; it never decodes. The worker drains whatever has piled
+    up in one batch into the sessions' JitterBuffers, then decodes,
+    conceals and drift-corrects as many periods as each session needs to
+    keep its output ring `lead_periods` ahead of the audio callback.
+
+    When the queue is full the overload policy applies:
+    - 'drop-oldest': discard the oldest queued frame to make room
+      (stale audio is worth less than fresh audio)
+    - 'backpressure': WebSocket handlers stop reading until there is room,
+      which pushes back on the sender through TCP flow control. UDP
+      datagrams cannot be paused and fall back to drop-oldest.
+    """
+
+    POLICIES = ('drop-oldest', 'backpressure')
+    MIN_LEAD_S = 0.005  # Decode at least this far ahead, however short the period
+    MIN_POLL_S = 0.001
+
+    def __init__(self, get_sessions, frame_duration_ms=20, queue_size=256, policy='drop-oldest', lead_periods=1):
+        """
+        Args:
+            get_sessions: Callable returning the current tuple of active sessions
+            frame_duration_ms: Output period length
+            queue_size: Maximum number of frames waiting for the worker
+            policy: Overload policy, one of POLICIES
+            lead_periods: Output periods decoded ahead of the audio callback
+        """
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown overload policy: {policy}")
+
+        self.get_sessions = get_sessions
+        self.period_s = frame_duration_ms / 1000.0
+        self.poll_interval = max(self.period_s / 4, self.MIN_POLL_S)
+        self.policy = policy
+        # Short periods: cover the worker's wake-up jitter with more of them
+        self.lead_periods = max(lead_periods, math.ceil(self.MIN_LEAD_S / self.period_s))
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.running = False
+
+        self.stats = {
+            'frames_queued': 0,
+            'frames_dropped': 0,
+            'batches': 0,
+            'max_batch': 0,
+            'errors': 0
+        }
+
+    def start(self):
+        if self.thread:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="DecodeWorker", daemon=True)
+        self.thread.start()
+        logger.info(f"Decode worker started (queue={self.queue.maxsize}, policy={self.policy}, "
+                    f"lead={self.lead_periods} periods)")
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+
+    def submit(self, session, frame):
+        """
+        Queue a frame without blocking (event-loop side).
+        Returns False if a frame had to be dropped.
+        """
+        try:
+            self.queue.put_nowait((session, frame))
+            self.stats['frames_queued'] += 1
+            return True
+        except queue.Full:
+            pass
+
+        # Drop the oldest frame and retry once
+        try:
+            self.queue.get_nowait()
+        except queue.Empty:
+            pass
+        self.stats['frames_dropped'] += 1
+        if self.stats['frames_dropped'] % 100 == 1:
+            logger.warning(f"Decode queue full, dropping oldest frame. Total dropped: {self.stats['frames_dropped']}")
+        try:
+            self.queue.put_nowait((session, frame))
+            self.stats['frames_queued'] += 1
+        except queue.Full:
+            pass
+        return False
+
+    async def submit_async(self, session, frame):
+        """Queue a frame from a WebSocket handler, honouring the backpressure policy."""
+        if self.policy == 'backpressure':
+            while self.queue.full() and self.running:
+                await asyncio.sleep(self.poll_interval)
+        return self.submit(session, frame)
+
+    def _run(self):
+        while self.running:
+            try:
+                item = self.queue.get(timeout=self.poll_interval)
+            except queue.Empty:
+                item = None
+
+            # Drain everything that piled up in one batch
+            batch = 0
+            while item is not None:
+                session, frame = item
+                try:
+                    session.receive(frame)
+                except Exception as e:
+                    self.stats['errors'] += 1
+                    logger.error(f"Receive error in session {session}: {e}")
+                batch += 1
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    item = None
+
+            if batch:
+                self.stats['batches'] += 1
+                self.stats['max_batch'] = max(self.stats['max_batch'], batch)
+
+            for session in self.get_sessions():
+                try:
+                    session.fill(self.lead_periods)
+                except Exception as e:
+                    self.stats['errors'] += 1
+                    logger.error(f"Playout error in session {session}: {e}")
+
+    def get_stats(self):
+        stats = self.stats.copy()
+        stats['queue_depth'] = self.queue.qsize()
+        return stats
@@ -0,0 +1,103 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger("DeviceCache")
+
+
+def default_cache_path():
+    """Per-user cache file: %LOCALAPPDATA%\\AudioLink on Windows, ~/.cache/audiolink elsewhere."""
+    if os.name == 'nt' and os.environ.get('LOCALAPPDATA'):
+        base = os.path.join(os.environ['LOCALAPPDATA'], 'AudioLink')
+    else:
+        base = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'audiolink')
+    return os.path.join(base, 'devices.json')
+
+
+def device_fingerprint(pa, index):
+    """
+    Identify an output device by name and host API.
+
+    PortAudio indices shift whenever a device is plugged in or removed; the
+    name plus host API ("CABLE Input (VB-Audio Virtual Cable)" on
+    "Windows WASAPI") survives that. Returns None if the index is invalid.
+    """
+    try:
+        info = pa.get_device_info_by_index(index)
+        host_api = pa.get_host_api_info_by_index(info.get('hostApi')).get('name', 'Unknown')
+    except Exception:
+        return None
+    if info.get('maxOutputChannels', 0) <= 0:
+        return None
+    return {'name': info.get('name', ''), 'host_api': host_api}
+
+
+def find_device(pa, fingerprint):
+    """Index of the output device matching fingerprint, or None (full scan)."""
+    for i in range(pa.get_device_count()):
+        if device_fingerprint(pa, i) == fingerprint:
+            return i
+    return None
+
+
+class DeviceCache:
+    """
+    Remembers the selected output device between runs.
+
+    The entry holds the device's fingerprint and the index it had last
+    time. If that index still carries the same fingerprint, the device
+    scan is skipped entirely (two PortAudio queries instead of several per
+    endpoint); otherwise the device is looked up by fingerprint.
+    """
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path: Cache file; defaults to default_cache_path()
+        """
+        self.path = path or default_cache_path()
+        self.entry = None
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entry = json.load(f).get('output')
+            if entry and {'name', 'host_api', 'index'} <= set(entry):
+                self.entry = entry
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError) as e:
+            logger.warning(f"Ignoring unreadable device cache {self.path}: {e}")
+
+    @property
+    def fingerprint(self):
+        return {'name': self.entry['name'], 'host_api': self.entry['host_api']} if self.entry else None
+
+    def lookup(self, pa):
+        """Index of the cached device, or None if there is no entry or it is gone."""
+        if not self.entry:
+            return None
+        fingerprint = self.fingerprint
+        if device_fingerprint(pa, self.entry['index']) == fingerprint:
+            return self.entry['index']
+        index = find_device(pa, fingerprint)
+        if index is not None:
+            self.store(fingerprint, index)
+        return index
+
+    def store(self, fingerprint, index):
+        """Remember a selected device (written atomically, errors only logged)."""
+        self.entry = dict(fingerprint, index=index)
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp = self.path + '.tmp'
+            with open(temp, 'w', encoding='utf-8') as f:
+                json.dump({'output': self.entry}, f, indent=2)
+            os.replace(temp, self.path)
+        except OSError as e:
+            logger.warning(f"Could not write device cache {self.path}: {e}")
+
+    def clear(self):
+        self.entry = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
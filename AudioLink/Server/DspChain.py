@@ -0,0 +1,324 @@
+import math
+import time
+
+import numpy as np
+
+from Metrics import Histogram, PROCESSING_BUCKETS
+
+FULL_SCALE = 32768.0
+DEFAULT_STAGES = ('highpass', 'gate', 'agc', 'limiter')
+
+
+def _db_to_gain(db):
+    return 10.0 ** (db / 20.0)
+
+
+def _level_db(x):
+    """RMS level of a block in dBFS."""
+    rms = math.sqrt(float(np.mean(np.square(x)))) if x.size else 0.0
+    return 20.0 * math.log10(max(rms, 1e-3) / FULL_SCALE)
+
+
+def _running_min(a, width):
+    """
+    Minimum of every window a[i:i + width] (van Herk / Gil-Werman): prefix and
+    suffix minima over width-sized blocks, O(n) regardless of width.
+    """
+    n = len(a)
+    blocks = -(-n // width)
+    padded = np.full(blocks * width, np.inf)
+    padded[:n] = a
+    tiles = padded.reshape(blocks, width)
+    prefix = np.minimum.accumulate(tiles, axis=1).reshape(-1)
+    suffix = np.minimum.accumulate(tiles[:, ::-1], axis=1)[:, ::-1].reshape(-1)
+    count = n - width + 1
+    return np.minimum(suffix[:count], prefix[width - 1:width - 1 + count])
+
+
+class _Ramp:
+    """Per-frame gain ramps, so gain changes never click and never loop per sample."""
+
+    def __init__(self):
+        self.size = 0
+        self.ramp = None
+
+    def apply(self, x, start, end):
+        n = x.shape[0]
+        if n != self.size:
+            self.size = n
+            self.ramp = np.linspace(0.0, 1.0, n, endpoint=False, dtype=np.float32).reshape(-1, 1)
+        if start == end:
+            x *= end
+        else:
+            x *= start + (end - start) * self.ramp
+
+
+class HighPass:
+    """
+    Second-order Butterworth high-pass (RBJ biquad) for mic rumble and handling noise.
+
+    The recursion runs block-wise without a per-sample loop: within a block
+    the output is the input convolved with the filter's impulse response
+    (exact, since only the first N taps can reach it) plus the decay of the
+    state carried in from the previous block. Both responses are computed
+    once per block size; the convolution is a single FFT multiply.
+    """
+
+    def __init__(self, rate, channels=1, cutoff_hz=80.0, q=0.7071):
+        w0 = 2.0 * math.pi * cutoff_hz / rate
+        alpha = math.sin(w0) / (2.0 * q)
+        cos_w0 = math.cos(w0)
+        a0 = 1.0 + alpha
+        self.b = ((1.0 + cos_w0) / 2.0 / a0, -(1.0 + cos_w0) / a0, (1.0 + cos_w0) / 2.0 / a0)
+        self.a = (-2.0 * cos_w0 / a0, (1.0 - alpha) / a0)
+        self.z1 = np.zeros(channels)
+        self.z2 = np.zeros(channels)
+        self.size = 0
+
+    def _prepare(self, n):
+        """Impulse response and state responses for blocks of n samples."""
+        b0, b1, b2 = self.b
+        a1, a2 = self.a
+
+        def respond(x, z1, z2):
+            # Direct form II transposed, run once per block size
+            y = np.zeros(n)
+            for i in range(n):
+                y[i] = b0 * x[i] + z1
+                z1, z2 = b1 * x[i] - a1 * y[i] + z2, b2 * x[i] - a2 * y[i]
+            return y
+
+        impulse = np.zeros(n)
+        impulse[0] = 1.0
+        self.nfft = 1 << (2 * n - 1).bit_length()
+        self.h_fft = np.fft.rfft(respond(impulse, 0.0, 0.0), self.nfft).reshape(-1, 1)
+        silence = np.zeros(n)
+        self.g1 = respond(silence, 1.0, 0.0).reshape(-1, 1)
+        self.g2 = respond(silence, 0.0, 1.0).reshape(-1, 1)
+        self.size = n
+
+    def process(self, x):
+        n = x.shape[0]
+        if n != self.size:
+            self._prepare(n)
+
+        y = np.fft.irfft(np.fft.rfft(x, self.nfft, axis=0) * self.h_fft, self.nfft, axis=0)[:n]
+        y += self.g1 * self.z1 + self.g2 * self.z2
+
+        # State after the block, from its last two samples
+        b0, b1, b2 = self.b
+        a1, a2 = self.a
+        z2_prev = b2 * x[-2] - a2 * y[-2] if n > 1 else self.z2
+        self.z1 = b1 * x[-1] - a1 * y[-1] + z2_prev
+        self.z2 = b2 * x[-1] - a2 * y[-1]
+        x[:] = y
+
+    def reset(self):
+        self.z1[:] = 0.0
+        self.z2[:] = 0.0
+
+
+class NoiseGate:
+    """
+    Attenuates the signal between phrases.
+
+    Opens as soon as a frame is louder than threshold_db, closes after
+    hold_ms below threshold_db - hysteresis_db, then fades to floor_db at
+    release_db_per_s.
+    """
+
+    def __init__(self, rate, channels=1, threshold_db=-50.0, hysteresis_db=6.0, floor_db=-30.0,
+                 hold_ms=200, release_db_per_s=60.0):
+        self.rate = rate
+        self.threshold_db = threshold_db
+        self.close_db = threshold_db - hysteresis_db
+        self.floor_db = floor_db
+        self.hold_s = hold_ms / 1000.0
+        self.release_db_per_s = release_db_per_s
+        self.gain_db = floor_db
+        self.quiet_s = 0.0
+        self.open = False
+        self.ramp = _Ramp()
+
+    def process(self, x):
+        duration = x.shape[0] / self.rate
+        level = _level_db(x)
+        if level > self.threshold_db:
+            self.open = True
+            self.quiet_s = 0.0
+        elif level < self.close_db:
+            self.quiet_s += duration
+            if self.quiet_s >= self.hold_s:
+                self.open = False
+
+        start = self.gain_db
+        if self.open:
+            self.gain_db = 0.0
+        else:
+            self.gain_db = max(self.floor_db, self.gain_db - self.release_db_per_s * duration)
+        self.ramp.apply(x, _db_to_gain(start), _db_to_gain(self.gain_db))
+
+    def reset(self):
+        self.gain_db = self.floor_db
+        self.quiet_s = 0.0
+        self.open = False
+
+
+class Agc:
+    """
+    Slow automatic gain control towards target_db RMS.
+
+    Only frames above activity_db update the gain, so pauses and the gate's
+    floor are never pumped up. Gain falls quickly (attack) and rises slowly
+    (release), and is limited to [min_gain_db, max_gain_db].
+    """
+
+    def __init__(self, rate, channels=1, target_db=-20.0, activity_db=-45.0, max_gain_db=20.0,
+                 min_gain_db=-10.0, attack_db_per_s=40.0, release_db_per_s=6.0):
+        self.rate = rate
+        self.target_db = target_db
+        self.activity_db = activity_db
+        self.max_gain_db = max_gain_db
+        self.min_gain_db = min_gain_db
+        self.attack_db_per_s = attack_db_per_s
+        self.release_db_per_s = release_db_per_s
+        self.gain_db = 0.0
+        self.ramp = _Ramp()
+
+    def process(self, x):
+        duration = x.shape[0] / self.rate
+        level = _level_db(x)
+        start = self.gain_db
+        if level > self.activity_db:
+            desired = min(self.max_gain_db, max(self.min_gain_db, self.target_db - level))
+            if desired < self.gain_db:
+                self.gain_db = max(desired, self.gain_db - self.attack_db_per_s * duration)
+            else:
+                self.gain_db = min(desired, self.gain_db + self.release_db_per_s * duration)
+        self.ramp.apply(x, _db_to_gain(start), _db_to_gain(self.gain_db))
+
+    def reset(self):
+        self.gain_db = 0.0
+
+
+class Limiter:
+    """
+    Look-ahead peak limiter: output never exceeds ceiling_db.
+
+    The signal is delayed by lookahead_ms. The required gain per sample is
+    min-filtered over the look-ahead window and then box-smoothed over the
+    same length; every window in the average contains the sample itself, so
+    the smoothed gain is still low enough for it while ramping in ahead
+    of the peak. Recovery is limited to release_db_per_s: the envelope
+    e[n] = min(g[n], e[n-1] * r) unrolls to a cumulative minimum of
+    g[k] / r^k, so it too is computed without a per-sample loop.
+    """
+
+    def __init__(self, rate, channels=1, ceiling_db=-1.0, lookahead_ms=2.0, release_db_per_s=40.0):
+        self.rate = rate
+        self.ceiling = _db_to_gain(ceiling_db) * FULL_SCALE
+        self.lookahead = max(1, int(rate * lookahead_ms / 1000.0))
+        self.release_db_per_s = release_db_per_s
+        self.history = np.zeros((2 * self.lookahead, channels), dtype=np.float32)
+        self.release_per_sample = _db_to_gain(release_db_per_s / rate)
+        self.envelope = 1.0
+        self.size = 0
+
+    def process(self, x):
+        n = x.shape[0]
+        look = self.lookahead
+        ext = np.concatenate((self.history, x))  # 2L samples of history, then the new block
+        self.history[:] = ext[n:]
+
+        peak = np.max(np.abs(ext), axis=1)
+        required = np.minimum(1.0, self.ceiling / np.maximum(peak, 1.0))
+        # Minimum over the next `look` samples, then the mean of the last `look` minima
+        window_min = _running_min(required, look)
+        cumulative = np.concatenate(([0.0], np.cumsum(window_min)))
+        gain = (cumulative[look + 1:look + n + 1] - cumulative[1:n + 1]) / look
+
+        # Release envelope: e[k] = r^k * min(e_prev * r, min_{i<=k} g[i] / r^i)
+        if n != self.size:
+            self.size = n
+            self.release_pow = self.release_per_sample ** np.arange(n)
+        envelope = np.minimum.accumulate(gain / self.release_pow)
+        np.minimum(envelope, self.envelope * self.release_per_sample, out=envelope)
+        envelope *= self.release_pow
+        np.minimum(envelope, 1.0, out=envelope)
+        self.envelope = float(envelope[-1])
+
+        x[:] = ext[look:look + n] * envelope.reshape(-1, 1)
+
+    def reset(self):
+        self.history[:] = 0.0
+        self.envelope = 1.0
+
+
+STAGES = {
+    'highpass': HighPass,
+    'gate': NoiseGate,
+    'agc': Agc,
+    'limiter': Limiter,
+}
+
+
+class DspChain:
+    """
+    Per-session processing chain run on each decoded 20 ms frame.
+
+    Stages work in place on a float32 (samples, channels) block and time
+    themselves into per-stage histograms for the metrics endpoint. Output
+    is an int16 array reused between calls.
+    """
+
+    def __init__(self, stages=DEFAULT_STAGES, rate=48000, channels=1, highpass_hz=80.0):
+        """
+        Args:
+            stages: Stage names in processing order (keys of STAGES)
+            rate: Sample rate in Hz
+            channels: Channel count (frames are interleaved)
+            highpass_hz: High-pass cutoff
+        """
+        self.channels = channels
+        self.stages = []
+        for name in stages:
+            if name not in STAGES:
+                raise ValueError(f"Unknown DSP stage: {name}")
+            options = {'cutoff_hz': highpass_hz} if name == 'highpass' else {}
+            self.stages.append((name, STAGES[name](rate, channels, **options)))
+        self.timings = {name: Histogram(PROCESSING_BUCKETS) for name, _ in self.stages}
+        self.total = Histogram(PROCESSING_BUCKETS)
+        self.work = np.zeros((0, channels), dtype=np.float32)
+        self.output = np.zeros(0, dtype=np.int16)
+
+    def process(self, pcm):
+        """
+        Run the chain on one frame.
+
+        Args:
+            pcm: int16 PCM bytes or array (interleaved)
+        Returns:
+            int16 array, reused between calls
+        """
+        samples = np.frombuffer(pcm, dtype=np.int16)
+        if samples.size != self.output.size:
+            self.work = np.zeros((samples.size // self.channels, self.channels), dtype=np.float32)
+            self.output = np.zeros(samples.size, dtype=np.int16)
+
+        x = self.work
+        x.reshape(-1)[:] = samples
+        chain_start = time.perf_counter()
+        for name, stage in self.stages:
+            start = time.perf_counter()
+            stage.process(x)
+            self.timings[name].observe(time.perf_counter() - start)
+        self.total.observe(time.perf_counter() - chain_start)
+
+        np.rint(x, out=x)
+        np.clip(x, -32768, 32767, out=x)
+        self.output[:] = x.reshape(-1)
+        return self.output
+
+    def reset(self):
+        for _, stage in self.stages:
+            stage.reset()
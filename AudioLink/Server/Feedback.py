@@ -0,0 +1,167 @@
+import logging
+import math
+
+from protocol import encode_control
+
+logger = logging.getLogger("Feedback")
+
+MIN_BITRATE = 12000  # Wideband speech falls apart below this
+LOSS_DECREASE = 0.10  # More missing frames than this: lower the bitrate
+LOSS_INCREASE = 0.02  # Fewer than this: the bitrate may grow again
+INCREASE_PER_S = 1.08  # Growth per second of clean reports
+FEC_ON_LOSS = 0.01  # Loss that turns FEC on; it goes off again below half of this
+MAX_LOSS_PERC = 30  # Opus packet-loss hint ceiling
+LOSS_DECAY = 0.25  # Smoothing of falling loss (rising loss is taken at once)
+
+
+class BitratePolicy:
+    """
+    Recommends Opus encoder settings from what the receiver saw.
+
+    The bitrate follows the loss-based controller of Google Congestion
+    Control: above 10% missing frames it is cut by half the loss, below 2%
+    it grows by 8% a second, in between it holds. Frames that arrived too
+    late to play count as missing, so a TCP link that queues instead of
+    dropping still backs off. It never grows while the jitter is more than
+    half a frame, which is when a crowded link starts to raise the playout
+    delay, and never above the bitrate agreed in the handshake.
+
+    FEC and the packet-loss hint follow the loss alone, with fast attack
+    and slow decay, so a loss burst protects the next frames at once.
+    """
+
+    def __init__(self, max_bitrate, frame_ms, fec_allowed, interval_s=1.0, min_bitrate=MIN_BITRATE):
+        """
+        Args:
+            max_bitrate: Bitrate agreed in the handshake (the ceiling and the start)
+            frame_ms: Frame duration in milliseconds
+            fec_allowed: Whether the sender can add in-band FEC (agreed in the handshake)
+            interval_s: Seconds between update() calls
+            min_bitrate: Floor of the recommendation
+        """
+        self.max_bitrate = max_bitrate
+        self.min_bitrate = min(min_bitrate, max_bitrate)
+        self.frame_ms = frame_ms
+        self.fec_allowed = fec_allowed
+        self.increase = INCREASE_PER_S ** interval_s
+
+        self.bitrate = max_bitrate
+        self.fec = False
+        self.loss = 0.0  # Smoothed loss
+
+    def update(self, loss, late, jitter_ms):
+        """
+        Fold in one report interval.
+
+        Args:
+            loss: Share of frames that never arrived in the interval
+            late: Share of frames that arrived after their slot had been played
+            jitter_ms: Current interarrival jitter estimate
+        """
+        if loss > self.loss:
+            self.loss = loss
+        else:
+            self.loss += (loss - self.loss) * LOSS_DECAY
+
+        missing = loss + late
+        if missing > LOSS_DECREASE:
+            self.bitrate *= 1.0 - 0.5 * missing
+        elif missing < LOSS_INCREASE and jitter_ms <= self.frame_ms / 2:
+            self.bitrate *= self.increase
+        self.bitrate = min(max(self.bitrate, self.min_bitrate), self.max_bitrate)
+
+        threshold = FEC_ON_LOSS / 2 if self.fec else FEC_ON_LOSS
+        self.fec = self.fec_allowed and self.loss >= threshold
+
+    @property
+    def packet_loss_perc(self):
+        """Expected loss in percent, for the encoder's packet-loss hint."""
+        return min(math.ceil(self.loss * 100 - 0.5), MAX_LOSS_PERC) if self.loss >= 0.005 else 0
+
+    def recommendation(self):
+        return {
+            'bitrate': int(round(self.bitrate, -3)),
+            'fec': self.fec,
+            'packet_loss_perc': self.packet_loss_perc
+        }
+
+
+class FeedbackReporter:
+    """
+    Turns a session's running statistics into periodic receiver reports.
+
+    Each report covers the interval since the previous one: the share of
+    frame slots lost and of frames that came after their slot was played
+    (the JitterBuffer counts such a slot as lost too, so it is only counted
+    as late here), the jitter
+    estimate and the buffer depth. For Opus sessions it also carries the
+    BitratePolicy's recommended bitrate, FEC and packet-loss hint. The
+    report is a JSON control message on the session's WebSocket:
+
+        {"type": "feedback", "loss": 0.031, "late": 0.0, "jitter_ms": 4.2,
+         "depth_ms": 40, "target_ms": 40, "bitrate": 24000, "fec": true,
+         "packet_loss_perc": 3}
+    """
+
+    def __init__(self, config, interval_s=1.0):
+        """
+        Args:
+            config: The session's StreamConfig
+            interval_s: Seconds between reports
+        """
+        self.frame_ms = config.frame_ms
+        self.policy = BitratePolicy(config.bitrate, config.frame_ms, config.fec, interval_s) \
+            if config.use_opus else None
+        self.previous = None
+        self.last_recommendation = None
+
+    def reset(self):
+        """Start the next interval afresh (after a gap that was not the network's doing)."""
+        self.previous = None
+
+    def report(self, stats):
+        """
+        Build the report for the interval ending now.
+
+        Args:
+            stats: Session.get_stats()
+        Returns:
+            The control message, or None while there is no interval to report yet
+        """
+        previous, self.previous = self.previous, stats
+        if previous is None or not stats['packets_played'] and not stats['lost']:
+            return None
+
+        # Slots passed in the interval. Underruns are not slots: the slots they
+        # delay are played or skipped as lost later, so they are counted then.
+        played = stats['packets_played'] - previous['packets_played']
+        lost = stats['lost'] - previous['lost']
+        arrived_late = stats['late'] - previous['late']
+        total = played + lost
+        # A late frame's slot went by as lost, possibly in an earlier interval
+        loss = max(lost - arrived_late, 0) / total if total else 0.0
+        late = min(arrived_late / total, 1.0) if total else 0.0
+
+        fields = {
+            'loss': round(loss, 3),
+            'late': round(late, 3),
+            'jitter_ms': round(stats['jitter_ms'], 1),
+            'depth_ms': round(stats['current_depth'] * self.frame_ms),
+            'target_ms': stats['target_ms']
+        }
+        if self.policy:
+            # A silent interval (DTX) says nothing about the link
+            if total:
+                self.policy.update(loss, late, stats['jitter_ms'])
+            fields.update(self.policy.recommendation())
+        return encode_control('feedback', **fields)
+
+    def changed(self):
+        """The current recommendation if it differs from the last one this was asked about, else None."""
+        if self.policy is None:
+            return None
+        recommendation = self.policy.recommendation()
+        if recommendation == self.last_recommendation:
+            return None
+        self.last_recommendation = recommendation
+        return recommendation
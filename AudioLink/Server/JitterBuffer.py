@@ -1,103 +1,490 @@
-import collections
+import math
 import time
 import logging
 
+from protocol import seq_delta, TIMESTAMP_MODULO
+
 logger = logging.getLogger("JitterBuffer")
 
+SILENCE = object()  # pop() result for a slot the sender declared silent (play comfort noise)
+
 class JitterBuffer:
     """
     Adaptive Jitter Buffer for audio streaming.
-    
+
     Handles:
-    - Packet reordering (if sequence numbers are added later)
+    - Packet reordering by sequence number (late frames fill their slot)
+    - Loss, duplicate and late-arrival detection
     - Dynamic buffering based on network jitter
-    - Underrun protection (frame repetition)
+    - Underrun and loss reporting (the caller conceals the gap)
+    - Declared silence (DTX): slots the sender marked silent play as
+      SILENCE instead of being counted as lost or as underruns
     - Statistics tracking
+
+    Frames are stored in a fixed ring of slots indexed by an extended
+    (unwrapped) sequence number modulo the capacity. Playout walks the slots
+    in order, so the buffer always knows exactly which frames are missing
+    between the playout point and the newest frame received.
+
+    Threading: the DecodeWorker thread is the only caller of push(),
+    push_silence(), pop(), peek() and shrink() (via Session), so producer
+    and consumer state are never written concurrently; reset() is only safe
+    while that thread leaves the buffer alone, and resume() only raises a
+    flag that thread acts on. A slot is valid when its stored sequence
+    number equals the one being looked up, so played slots never need to
+    be cleared. The event loop reads a few
+    fields without a lock and tolerates a value one frame stale:
+    highest_seq (the resume reply), last_arrival_ms/last_arrival_ts (the
+    calibration), and get_stats() for receiver reports and the metrics
+    endpoint. get_stats() returns a copy and only stores the target and
+    jitter figures it reports, which nothing else writes.
+
+    In adaptive mode the interarrival jitter is estimated online (RFC 3550,
+    section 6.4.1) and the playout target follows it within min/max. The
+    buffer grows by asking the caller to conceal one extra frame and
+    shrinks by letting the caller skip a silent frame, at most once per
+    adaptation interval, so the delay never jumps.
+
+    During a declared silence nothing arrives, so the sender's position is
+    extrapolated from the marker's arrival time. The depth, and with it the
+    playout delay, stays where it was until speech resumes.
     """
-    
-    def __init__(self, target_buffer_ms=40, min_buffer_ms=20, max_buffer_ms=100, frame_duration_ms=20):
+
+    DEPTH_WINDOW = 100  # Pops averaged into avg_depth
+    GROW_MARGIN = 0.5  # Grow when the smoothed depth falls this many frames below the target
+    SHRINK_MARGIN = 1.0  # Skip a silent frame when it is this many frames above
+    DEPTH_SMOOTHING_MS = 200.0  # Time constant of depth_ema
+    TARGET_TOLERANCE = 0.01  # Frames of wanted depth ignored when rounding the target up
+
+    def __init__(self, target_buffer_ms=40, min_buffer_ms=20, max_buffer_ms=100, frame_duration_ms=20,
+                 adaptive=False, clock_rate=48000, jitter_factor=4.0, adapt_interval=50):
         """
         Args:
-            target_buffer_ms: Target buffer depth in milliseconds
+            target_buffer_ms: Target buffer depth in milliseconds (initial target in adaptive mode)
             min_buffer_ms: Minimum buffer depth
             max_buffer_ms: Maximum buffer depth
-            frame_duration_ms: Duration of each audio frame (20ms for Opus)
+            frame_duration_ms: Duration of each audio frame (2.5 to 20 ms)
+            adaptive: Move the target with the measured jitter
+            clock_rate: Sample clock of the frame timestamps (Hz)
+            jitter_factor: Target = one frame + jitter_factor * jitter estimate
+            adapt_interval: Minimum number of frames between two adjustments
         """
-        self.target_frames = target_buffer_ms // frame_duration_ms
-        self.min_frames = min_buffer_ms // frame_duration_ms
-        self.max_frames = max_buffer_ms // frame_duration_ms
+        self.target_frames = int(target_buffer_ms // frame_duration_ms)
+        self.min_frames = int(min_buffer_ms // frame_duration_ms)
+        self.max_frames = int(max_buffer_ms // frame_duration_ms)
         self.frame_duration_ms = frame_duration_ms
-        
-        self.buffer = collections.deque(maxlen=self.max_frames * 2)
-        self.last_frame = None  # For frame repetition on underrun
-        
-        # Statistics
-        self.stats = {
+        self.capacity = max(self.max_frames * 2, 2)
+
+        self.adaptive = adaptive
+        self.clock_rate = clock_rate
+        self.jitter_factor = jitter_factor
+        self.adapt_interval = adapt_interval
+        # Per pop, so the average spans the same time whatever the frame size and however
+        # bursty the output takes its frames
+        self.depth_alpha = min(1.0, frame_duration_ms / self.DEPTH_SMOOTHING_MS)
+        self.initial_target_frames = self.target_frames
+
+        # Preallocated slot ring (written by the producer only)
+        self.slot_seq = [-1] * self.capacity
+        self.slot_frame = [None] * self.capacity
+        self.slot_timestamp = [None] * self.capacity
+        self.depth_window = [0] * self.DEPTH_WINDOW
+
+        self._clear_state()
+
+    def _clear_state(self):
+        # Producer state
+        self.first_seq = None  # Extended seq of the first frame received
+        self.highest_seq = None  # Newest extended seq received
+        self.jitter_ms = 0.0  # RFC 3550 interarrival jitter estimate
+        self.last_arrival_ms = None  # Arrival time of the previous frame
+        self.last_arrival_ts = None  # Timestamp of the previous frame
+        self.pushes_since_lower = 0
+        # Declared silence [silence_start, silence_end) in extended seqs, and when it was announced
+        self.silence_start = None
+        self.silence_end = None
+        self.silence_arrival = 0.0
+        self.resuming = False  # Set by resume(); the next push rebases onto the resumed stream
+
+        # Consumer state
+        self.next_seq = None  # Extended seq of the next frame to play
+        self.playout_timestamp = None  # Sample clock of the frame being played
+        self.last_lost = False  # True if the previous pop() hit a missing slot
+        self.underrun_debt = 0  # Underrun pops since the last played frame
+        self.depth_ema = 0.0  # Smoothed depth used for grow/shrink decisions
+        self.downstream_frames = 0.0  # Decoded audio the caller still holds, counted into depth_ema
+        self.pops_since_adapt = 0
+        self.depth_sum = 0  # Running sum over depth_window
+        self.depth_count = 0
+
+        # Statistics (each key is written by one side only)
+        self.stats = self._new_stats()
+
+    @staticmethod
+    def _new_stats():
+        return {
             'underruns': 0,
             'overruns': 0,
             'packets_received': 0,
             'packets_played': 0,
+            'lost': 0,
+            'late': 0,
+            'duplicates': 0,
+            'stretched': 0,
+            'shrunk': 0,
+            'silent': 0,
             'current_depth': 0,
-            'avg_depth': 0
+            'avg_depth': 0,
+            'target_depth': 0,
+            'target_ms': 0,
+            'jitter_ms': 0.0
         }
-        self.depth_samples = collections.deque(maxlen=100)
-        
-    def push(self, frame_data):
-        """Add a frame to the buffer."""
-        if len(self.buffer) >= self.max_frames * 2:
+
+    def _extend_seq(self, seq):
+        """Map a wrapping 16-bit sequence number onto the extended sequence space."""
+        if self.highest_seq is None:
+            return seq
+        return self.highest_seq + seq_delta(seq, self.highest_seq)
+
+    def _update_jitter(self, ext_seq, timestamp, arrival_time):
+        """RFC 3550 estimator: J += (|D| - J) / 16 over consecutive arrivals."""
+        arrival_ms = arrival_time * 1000.0
+        if timestamp is None:
+            timestamp = int(ext_seq * self.frame_duration_ms * self.clock_rate // 1000)
+
+        if self.last_arrival_ms is not None:
+            ts_delta = (timestamp - self.last_arrival_ts) % TIMESTAMP_MODULO
+            if ts_delta >= TIMESTAMP_MODULO // 2:
+                ts_delta -= TIMESTAMP_MODULO
+            d = (arrival_ms - self.last_arrival_ms) - ts_delta * 1000.0 / self.clock_rate
+            self.jitter_ms += (abs(d) - self.jitter_ms) / 16.0
+
+        self.last_arrival_ms = arrival_ms
+        self.last_arrival_ts = timestamp
+
+    def _update_target(self):
+        """Raise the target immediately, lower it one frame per adaptation interval."""
+        wanted_ms = self.frame_duration_ms + self.jitter_factor * self.jitter_ms
+        # The jitter estimate only decays towards zero; don't let its last traces hold a frame
+        wanted = math.ceil(wanted_ms / self.frame_duration_ms - self.TARGET_TOLERANCE)
+        wanted = max(self.min_frames, min(self.max_frames, wanted))
+
+        self.pushes_since_lower += 1
+        if wanted > self.target_frames:
+            self.target_frames = wanted
+        elif wanted < self.target_frames and self.pushes_since_lower >= self.adapt_interval:
+            self.target_frames -= 1
+            self.pushes_since_lower = 0
+
+    def push(self, frame_data, seq=None, timestamp=None, arrival_time=None):
+        """
+        Add a frame to the buffer (producer side).
+
+        Args:
+            frame_data: Frame payload
+            seq: 16-bit sequence number from the frame header. When omitted the
+                 frame is treated as the successor of the newest frame.
+            timestamp: Sample-clock timestamp from the frame header
+            arrival_time: Arrival time in seconds (defaults to time.monotonic())
+
+        Returns:
+            True if the frame was stored, False if it was late or a duplicate.
+        """
+        if seq is None:
+            ext_seq = 0 if self.highest_seq is None else self.highest_seq + 1
+        else:
+            ext_seq = self._extend_seq(seq)
+        if self.resuming:
+            self._rebase(ext_seq)
+
+        # Jitter is measured in fixed mode too (reported, and used by the calibration)
+        self._update_jitter(ext_seq, timestamp, time.monotonic() if arrival_time is None else arrival_time)
+        if self.adaptive:
+            self._update_target()
+
+        if self.first_seq is None:
+            self.first_seq = ext_seq
+
+        next_seq = self.next_seq if self.next_seq is not None else self.first_seq
+        if ext_seq < next_seq:
+            # Its playout slot has already passed (it was played as lost)
+            self.stats['late'] += 1
+            return False
+
+        index = ext_seq % self.capacity
+        if self.slot_seq[index] == ext_seq:
+            self.stats['duplicates'] += 1
+            return False
+
+        if ext_seq - next_seq >= self.capacity:
+            # Overwrites the oldest unplayed slot; the consumer skips past it
             self.stats['overruns'] += 1
-            logger.warning(f"Buffer overrun! Dropping oldest frame. Depth: {len(self.buffer)}")
-            # Let deque handle it with maxlen
-        
-        self.buffer.append(frame_data)
+            logger.warning(f"Buffer overrun! Dropping oldest frame. Depth: {ext_seq - next_seq}")
+
+        if self._silent(ext_seq):
+            # Speech is back before the declared end of the silence
+            self.silence_end = ext_seq
+
+        # Publish: payload first, then the sequence number that validates it
+        self.slot_frame[index] = frame_data
+        self.slot_timestamp[index] = timestamp
+        self.slot_seq[index] = ext_seq
+
+        if self.highest_seq is None or ext_seq > self.highest_seq:
+            self.highest_seq = ext_seq
         self.stats['packets_received'] += 1
-        self.last_frame = frame_data
-        
-    def pop(self):
+        return True
+
+    def push_silence(self, seq, end_seq, timestamp=None, arrival_time=None):
+        """
+        Declare slots seq .. end_seq - 1 silent (producer side).
+
+        A frame that does arrive for one of these slots still plays. A
+        marker continuing the current silence extends it; otherwise it
+        replaces it.
+
+        Returns:
+            True if the declaration was accepted, False if it was late or empty.
+        """
+        arrival_time = time.monotonic() if arrival_time is None else arrival_time
+        ext_seq = self._extend_seq(seq)
+        if self.resuming:
+            self._rebase(ext_seq)
+        ext_end = ext_seq + seq_delta(end_seq, seq)
+        if ext_end <= ext_seq:
+            return False
+
+        self._update_jitter(ext_seq, timestamp, arrival_time)
+        if self.adaptive:
+            self._update_target()
+        if self.first_seq is None:
+            self.first_seq = ext_seq
+
+        next_seq = self.next_seq if self.next_seq is not None else self.first_seq
+        if ext_end <= next_seq:
+            self.stats['late'] += 1
+            return False
+
+        if self.silence_end is None or not (self.silence_start <= ext_seq <= self.silence_end):
+            self.silence_start = ext_seq
+        self.silence_end = max(ext_end, self.silence_end or ext_end)
+
+        if self.highest_seq is None or ext_seq > self.highest_seq:
+            # Arrival first: the consumer extrapolates from the newest marker
+            self.silence_arrival = arrival_time
+            self.highest_seq = ext_seq
+        return True
+
+    def resume(self):
+        """
+        The sender is back after a dropped connection (event-loop side).
+
+        Only sets a flag: the next push() or push_silence(), on the
+        DecodeWorker thread, rebases the buffer onto the resumed stream.
+        """
+        self.resuming = True
+
+    def _rebase(self, ext_seq):
         """
-        Get the next frame to play.
-        Returns None if buffer is building up (initial buffering).
-        Returns repeated frame if underrun occurs.
+        First frame after a resume: skip the slots whose time the outage
+        already concealed in one go, so a long outage neither reads as an
+        overrun nor counts as lost, and the frames buffered before it keep
+        their delay. The arrival gap is not jitter either.
+        """
+        self.resuming = False
+        self.last_arrival_ms = self.last_arrival_ts = None
+        if self.next_seq is not None and ext_seq > self.next_seq:
+            skip = min(self.underrun_debt, ext_seq - self.next_seq)
+            self.next_seq += skip
+            self.underrun_debt -= skip
+
+    def _silent(self, ext_seq):
+        start = self.silence_start
+        return start is not None and start <= ext_seq < self.silence_end
+
+    def _sender_seq(self):
+        """Newest slot the sender has reached: the newest frame, or further into a declared silence."""
+        highest = self.highest_seq
+        if highest is not None and self._silent(highest):
+            elapsed = int((time.monotonic() - self.silence_arrival) * 1000.0 / self.frame_duration_ms)
+            highest = min(highest + elapsed, self.silence_end - 1)
+        return highest
+
+    def _slot(self, ext_seq):
+        """Index of the slot holding ext_seq, or -1 if it has not arrived."""
+        index = ext_seq % self.capacity
+        return index if self.slot_seq[index] == ext_seq else -1
+
+    def depth(self):
+        """Number of slots between the playout point and the newest frame (including gaps)."""
+        highest = self._sender_seq()
+        next_seq = self.next_seq if self.next_seq is not None else self.first_seq
+        if highest is None or highest < next_seq:
+            return 0
+        return highest - next_seq + 1
+
+    def fill_level(self, now=None):
         """
-        current_depth = len(self.buffer)
+        Depth in fractional frames: depth() plus the part of the next frame the
+        sender has captured since the newest frame arrived (at most one frame).
+        Unlike depth() it moves smoothly as the sender's and the output's clocks
+        drift apart, instead of in whole-frame steps.
+        """
+        depth = self.depth()
+        if self.last_arrival_ms is None:
+            return float(depth)
+        now = time.monotonic() if now is None else now
+        age = (now * 1000.0 - self.last_arrival_ms) / self.frame_duration_ms
+        return depth + min(max(age, 0.0), 1.0)
+
+    def missing(self):
+        """Return the 16-bit sequence numbers of the slots still waiting for a frame."""
+        if self.depth() == 0:
+            return []
+        next_seq = self.next_seq if self.next_seq is not None else self.first_seq
+        return [ext_seq & 0xFFFF for ext_seq in range(next_seq, self.highest_seq)
+                if self._slot(ext_seq) < 0 and not self._silent(ext_seq)]
+
+    @property
+    def started(self):
+        """True once initial buffering has finished and playout has begun."""
+        return self.stats['packets_played'] > 0 or self.stats['silent'] > 0
+
+    def peek(self):
+        """Return the payload of the next slot without consuming it (None if missing)."""
+        if self.next_seq is None:
+            return None
+        index = self._slot(self.next_seq)
+        return self.slot_frame[index] if index >= 0 else None
+
+    def should_shrink(self):
+        """True if the buffer holds more than the target and may skip a silent frame."""
+        return (self.adaptive
+                and self.pops_since_adapt >= self.adapt_interval
+                and self.depth_ema > self.target_frames + self.SHRINK_MARGIN)
+
+    def shrink(self):
+        """
+        Consume the next slot on behalf of a skipped silent frame.
+        Returns its payload so the caller can keep decoder state in sync, or
+        None (and skips nothing) if that slot has not arrived.
+        """
+        index = self._slot(self.next_seq)
+        if index < 0:
+            return None
+        self.next_seq += 1
+        self.pops_since_adapt = 0
+        self.stats['shrunk'] += 1
+        self.stats['packets_played'] += 1
+        self.playout_timestamp = self.slot_timestamp[index]
+        return self.slot_frame[index]
+
+    def _record_depth(self, current_depth):
+        """O(1) running statistics over the last DEPTH_WINDOW pops."""
+        position = self.depth_count % self.DEPTH_WINDOW
+        self.depth_sum += current_depth - self.depth_window[position]
+        self.depth_window[position] = current_depth
+        self.depth_count += 1
+
         self.stats['current_depth'] = current_depth
-        self.depth_samples.append(current_depth)
-        
-        if self.depth_samples:
-            self.stats['avg_depth'] = sum(self.depth_samples) / len(self.depth_samples)
-        
+        self.stats['avg_depth'] = self.depth_sum / min(self.depth_count, self.DEPTH_WINDOW)
+        self.depth_ema += (current_depth + self.downstream_frames - self.depth_ema) * self.depth_alpha
+
+    def pop(self):
+        """
+        Get the next frame to play (consumer side).
+        Returns None if buffer is building up (initial buffering), if the
+        slot is missing or if an underrun occurs. Once `started` is True a
+        None result means the caller must conceal one frame. SILENCE means
+        the slot was declared silent: play comfort noise, nothing to decode.
+        """
+        if self.next_seq is None:
+            if self.first_seq is None:
+                self._record_depth(0)
+                return None
+            self.next_seq = self.first_seq
+
+        # Overrun: the producer has lapped the playout point, skip ahead
+        highest = self.highest_seq
+        if highest - self.next_seq + 1 > self.capacity:
+            self.next_seq = highest - self.capacity + 1
+
+        current_depth = self.depth()
+        self._record_depth(current_depth)
+        self.pops_since_adapt += 1
+        self.last_lost = False
+
         # Initial buffering: wait until we have target_frames
-        if current_depth < self.target_frames and self.stats['packets_played'] == 0:
+        if current_depth < self.target_frames and not self.started:
             logger.debug(f"Initial buffering... {current_depth}/{self.target_frames}")
             return None
-        
+
+        # Grow: hold the playout point for one frame (caller conceals it)
+        if (self.adaptive and current_depth > 0
+                and self.pops_since_adapt >= self.adapt_interval
+                and self.depth_ema < self.target_frames - self.GROW_MARGIN):
+            self.pops_since_adapt = 0
+            self.stats['stretched'] += 1
+            return None
+
         # Normal operation
         if current_depth > 0:
-            frame = self.buffer.popleft()
+            index = self._slot(self.next_seq)
+            # Slots still missing after an underrun were lost, and their time
+            # has already been concealed: skip them instead of concealing twice,
+            # otherwise every loss burst permanently adds playout delay.
+            while index < 0 and self.underrun_debt > 0 and not self._silent(self.next_seq):
+                self.underrun_debt -= 1
+                self.stats['lost'] += 1
+                self.next_seq += 1
+                index = self._slot(self.next_seq)
+            if index < 0 and self._silent(self.next_seq):
+                return self._play_silence()
+            self.next_seq += 1
+
+            if index < 0:
+                # Missing slot: the frame was lost or is still in flight
+                self.last_lost = True
+                self.stats['lost'] += 1
+                if self.stats['lost'] % 10 == 1:  # Log every 10th lost frame
+                    logger.warning(f"Missing frame in sequence! Total lost: {self.stats['lost']}")
+                return None
+
+            self.playout_timestamp = self.slot_timestamp[index]
+            self.underrun_debt = 0
             self.stats['packets_played'] += 1
-            self.last_frame = frame
-            return frame
+            return self.slot_frame[index]
+        elif self._silent(self.next_seq):
+            # Caught up with the sender inside a declared silence
+            return self._play_silence()
         else:
-            # Underrun: repeat last frame
+            # Underrun: nothing buffered
+            self.underrun_debt += 1
             self.stats['underruns'] += 1
             if self.stats['underruns'] % 10 == 1:  # Log every 10th underrun
-                logger.warning(f"Buffer underrun! Repeating last frame. Total underruns: {self.stats['underruns']}")
-            return self.last_frame
-    
+                logger.warning(f"Buffer underrun! Total underruns: {self.stats['underruns']}")
+            return None
+
+    def _play_silence(self):
+        self.next_seq += 1
+        self.underrun_debt = 0
+        self.stats['silent'] += 1
+        return SILENCE
+
     def get_stats(self):
         """Return current buffer statistics."""
+        self.stats['target_depth'] = self.target_frames
+        self.stats['target_ms'] = self.target_frames * self.frame_duration_ms
+        self.stats['jitter_ms'] = round(self.jitter_ms, 2)
         return self.stats.copy()
-    
+
     def reset(self):
-        """Clear the buffer and reset statistics."""
-        self.buffer.clear()
-        self.last_frame = None
-        self.stats = {
-            'underruns': 0,
-            'overruns': 0,
-            'packets_received': 0,
-            'packets_played': 0,
-            'current_depth': 0,
-            'avg_depth': 0
-        }
-        self.depth_samples.clear()
+        """Clear the buffer and reset statistics. Only safe while playout is idle."""
+        for index in range(self.capacity):
+            self.slot_seq[index] = -1
+            self.slot_frame[index] = None
+            self.slot_timestamp[index] = None
+        for position in range(self.DEPTH_WINDOW):
+            self.depth_window[position] = 0
+        self.target_frames = self.initial_target_frames
+        self._clear_state()
@@ -0,0 +1,271 @@
+import asyncio
+import bisect
+import json
+import logging
+import time
+
+logger = logging.getLogger("Metrics")
+
+# Bucket upper bounds (Prometheus "le" labels)
+INTERARRIVAL_BUCKETS = (0.005, 0.01, 0.015, 0.02, 0.025, 0.03, 0.04, 0.05, 0.075, 0.1, 0.25, 0.5, 1.0)
+PROCESSING_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.02)
+LOOP_LAG_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+DEPTH_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10)
+CONCEALMENT_RUN_BUCKETS = (1, 2, 3, 5, 10, 25, 50)
+RECOVERY_BUCKETS = (0.25, 0.5, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0, 30.0)
+RESUME_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+MAX_KNOWN_REMOTES = 256  # Hosts remembered for reconnect counting, least recently seen dropped first
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram in the Prometheus style.
+
+    Each histogram is written by a single thread; observe() only bumps
+    preallocated counters, so it is cheap enough for the audio callback.
+    """
+
+    def __init__(self, buckets):
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside its bucket (like histogram_quantile)."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            if cumulative + n >= rank and n > 0:
+                if i == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                return lower + (self.bounds[i] - lower) * (rank - cumulative) / n
+            cumulative += n
+        return self.bounds[-1]
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+
+class SessionMetrics:
+    """
+    Per-session measurements.
+
+    on_frame() runs where frames arrive (event loop), on_playout() on the
+    decode worker; they touch disjoint fields.
+    """
+
+    def __init__(self):
+        self.interarrival = Histogram(INTERARRIVAL_BUCKETS)
+        self.decode_time = Histogram(PROCESSING_BUCKETS)
+        self.depth = Histogram(DEPTH_BUCKETS)
+        self.concealment_runs = Histogram(CONCEALMENT_RUN_BUCKETS)
+        self.bytes_in = 0
+        self.frames = 0
+        self.last_arrival = None
+        self.concealing = 0
+
+    def on_frame(self, nbytes, now=None):
+        """Record one received frame of nbytes on the wire."""
+        now = time.monotonic() if now is None else now
+        if self.last_arrival is not None:
+            self.interarrival.observe(now - self.last_arrival)
+        self.last_arrival = now
+        self.bytes_in += nbytes
+        self.frames += 1
+
+    def on_playout(self, decode_s, depth, concealed):
+        """Record one decoded (or concealed) frame."""
+        self.decode_time.observe(decode_s)
+        self.depth.observe(depth)
+        if concealed:
+            self.concealing += 1
+        elif self.concealing:
+            self.concealment_runs.observe(self.concealing)
+            self.concealing = 0
+
+
+class ServerMetrics:
+    """
+    Server-wide measurements plus the exporters.
+
+    Exposes everything in the Prometheus text format over a small HTTP
+    endpoint and logs a compact JSON summary line periodically.
+    """
+
+    def __init__(self):
+        self.callback_duration = Histogram(PROCESSING_BUCKETS)
+        self.loop_lag = Histogram(LOOP_LAG_BUCKETS)
+        self.output_recovery = Histogram(RECOVERY_BUCKETS)
+        self.resume_gap = Histogram(RESUME_BUCKETS)
+        self.ready_s = None  # Launch until the WebSocket server listens
+        self.output_open_s = None  # Opening the output at the first connection
+        self.connections = 0
+        self.reconnects = 0
+        self.known_remotes = {}  # Insertion-ordered: least recently connected first
+        self.started = time.time()
+
+    def on_connect(self, remote):
+        """Count a connection; a host that connected before counts as a reconnect."""
+        self.connections += 1
+        if self.known_remotes.pop(remote, False):
+            self.reconnects += 1
+        self.known_remotes[remote] = True
+        if len(self.known_remotes) > MAX_KNOWN_REMOTES:
+            del self.known_remotes[next(iter(self.known_remotes))]
+
+    async def monitor_loop_lag(self, interval=0.1):
+        """Measure how late the event loop wakes up from a sleep."""
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            self.loop_lag.observe(max(0.0, loop.time() - start - interval))
+
+    async def log_periodically(self, get_sessions, interval=10.0):
+        while True:
+            await asyncio.sleep(interval)
+            logger.info(json.dumps(self.summary(get_sessions()), separators=(',', ':')))
+
+    async def serve(self, get_sessions, get_counters, host="127.0.0.1", port=9100):
+        """
+        Serve GET /metrics in the Prometheus text format.
+
+        Args:
+            get_sessions: Callable returning the active sessions
+            get_counters: Callable returning extra server counters {name: value}
+        """
+        async def handle(reader, writer):
+            try:
+                request = await reader.readline()
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                parts = request.split()
+                if len(parts) >= 2 and parts[1] in (b'/metrics', b'/'):
+                    body = self.render(get_sessions(), get_counters()).encode()
+                    status = b'200 OK'
+                else:
+                    body = b'Not Found\n'
+                    status = b'404 Not Found'
+                writer.write(
+                    b'HTTP/1.1 ' + status + b'\r\n'
+                    b'Content-Type: text/plain; version=0.0.4\r\n'
+                    b'Content-Length: ' + str(len(body)).encode() + b'\r\n'
+                    b'Connection: close\r\n\r\n' + body
+                )
+                await writer.drain()
+            except (ConnectionError, asyncio.IncompleteReadError):
+                pass
+            finally:
+                writer.close()
+
+        server = await asyncio.start_server(handle, host, port)
+        logger.info(f"Metrics endpoint on http://{host}:{port}/metrics")
+        return server
+
+    def summary(self, sessions):
+        """Compact snapshot for the periodic JSON log line (times in ms)."""
+        result = {
+            'uptime_s': round(time.time() - self.started),
+            'loop_lag_p99_ms': round(self.loop_lag.quantile(0.99) * 1000, 2),
+            'callback_p99_ms': round(self.callback_duration.quantile(0.99) * 1000, 3),
+            'reconnects': self.reconnects,
+            'output_recoveries': self.output_recovery.count,
+            'resumes': self.resume_gap.count,
+            'sessions': {}
+        }
+        for session in sessions:
+            m = session.metrics
+            stats = session.get_stats()
+            result['sessions'][str(session.session_id)] = {
+                'format': str(session.config) if session.config else None,
+                'frames': m.frames,
+                'bytes': m.bytes_in,
+                'iat_p50_ms': round(m.interarrival.quantile(0.5) * 1000, 1),
+                'iat_p99_ms': round(m.interarrival.quantile(0.99) * 1000, 1),
+                'decode_p99_ms': round(m.decode_time.quantile(0.99) * 1000, 3),
+                'depth_mean': round(m.depth.mean(), 2),
+                'dsp_p99_ms': round(session.dsp.total.quantile(0.99) * 1000, 3) if session.dsp else None,
+                'underruns': stats['underruns'],
+                'lost': stats['lost'],
+                'concealed': stats['concealed'],
+                'silent': stats['silent']
+            }
+        return result
+
+    def render(self, sessions, counters=None):
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def gauge(name, help_text, value):
+            if value is not None:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f'{name} {value}')
+
+        def histogram(name, help_text, series):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, h in series:
+                prefix = f'{labels},' if labels else ''
+                cumulative = 0
+                for bound, n in zip(h.bounds, h.counts):
+                    cumulative += n
+                    lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {h.count}')
+                suffix = f'{{{labels}}}' if labels else ''
+                lines.append(f'{name}_sum{suffix} {h.sum}')
+                lines.append(f'{name}_count{suffix} {h.count}')
+
+        def counter(name, help_text, series):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in series:
+                suffix = f'{{{labels}}}' if labels else ''
+                lines.append(f'{name}{suffix} {value}')
+
+        labelled = [(f'session="{s.session_id}"', s) for s in sessions]
+
+        histogram('audiolink_interarrival_seconds', 'Time between received frames',
+                  [(l, s.metrics.interarrival) for l, s in labelled])
+        histogram('audiolink_decode_seconds', 'Time to decode or conceal one frame',
+                  [(l, s.metrics.decode_time) for l, s in labelled])
+        histogram('audiolink_buffer_depth_frames', 'JitterBuffer depth at each playout',
+                  [(l, s.metrics.depth) for l, s in labelled])
+        histogram('audiolink_concealment_run_frames', 'Consecutive concealed frames per event',
+                  [(l, s.metrics.concealment_runs) for l, s in labelled])
+        histogram('audiolink_dsp_stage_seconds', 'Time spent in each DSP stage per frame',
+                  [(f'{l},stage="{name}"', h) for l, s in labelled if s.dsp for name, h in s.dsp.timings.items()])
+        histogram('audiolink_callback_seconds', 'Audio callback duration',
+                  [('', self.callback_duration)])
+        histogram('audiolink_event_loop_lag_seconds', 'Event loop scheduling delay',
+                  [('', self.loop_lag)])
+        histogram('audiolink_output_recovery_seconds', 'Silence from losing the output device until it reopened',
+                  [('', self.output_recovery)])
+        histogram('audiolink_resume_gap_seconds', 'Time from a dropped connection until the session was resumed',
+                  [('', self.resume_gap)])
+        gauge('audiolink_startup_seconds', 'Launch until ready for connections', self.ready_s)
+        gauge('audiolink_output_open_seconds', 'Time to open the audio output', self.output_open_s)
+
+        counter('audiolink_bytes_received_total', 'Bytes received including headers',
+                [(l, s.metrics.bytes_in) for l, s in labelled])
+        counter('audiolink_frames_received_total', 'Frames received',
+                [(l, s.metrics.frames) for l, s in labelled])
+        stats = [(l, s.get_stats()) for l, s in labelled]
+        for key in ('underruns', 'lost', 'late', 'concealed', 'fec_recovered', 'silent'):
+            counter(f'audiolink_{key}_total', f'Frames counted as {key.replace("_", " ")}',
+                    [(l, st[key]) for l, st in stats])
+        counter('audiolink_connections_total', 'WebSocket connections accepted', [('', self.connections)])
+        counter('audiolink_reconnects_total', 'Connections from a host that connected before', [('', self.reconnects)])
+        for name, value in (counters or {}).items():
+            counter(f'audiolink_{name}_total', name.replace('_', ' ').capitalize(), [('', value)])
+
+        return '\n'.join(lines) + '\n'
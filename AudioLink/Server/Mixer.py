@@ -0,0 +1,76 @@
+import numpy as np
+
+
+class Mixer:
+    """
+    Mixes one block of PCM per client into a single int16 output block.
+
+    Inputs are copied into rows of a preallocated float32 matrix and mixed
+    with one vectorized dot product against the per-client gains, then
+    saturated to the int16 range. The cost is a single BLAS call plus one
+    row copy per client, so it stays flat as clients are added. Blocks may
+    have any length (the audio callback decides); memory is only
+    allocated when a block is longer than any before it.
+
+    Usage from the audio thread: add() once per active client, all with
+    blocks of the same length, then mix().
+    """
+
+    def __init__(self, frame_size, max_clients=16):
+        """
+        Args:
+            frame_size: Expected samples per output block (grows on demand)
+            max_clients: Initial row capacity (grows on demand)
+        """
+        self.frame_size = frame_size
+        self.frames = np.zeros((max_clients, frame_size), dtype=np.float32)
+        self.gains = np.zeros(max_clients, dtype=np.float32)
+        self.count = 0
+        self.size = 0  # Length of the blocks added since the last mix()
+        self.out = np.empty(frame_size, dtype=np.float32)
+        self.out_int16 = np.empty(frame_size, dtype=np.int16)
+
+    def _grow(self, rows, frame_size):
+        frames = np.zeros((rows, frame_size), dtype=np.float32)
+        frames[:self.count, :self.size] = self.frames[:self.count, :self.size]
+        gains = np.zeros(rows, dtype=np.float32)
+        gains[:self.count] = self.gains[:self.count]
+        self.frames, self.gains = frames, gains
+        if frame_size != self.frame_size:
+            self.frame_size = frame_size
+            self.out = np.empty(frame_size, dtype=np.float32)
+            self.out_int16 = np.empty(frame_size, dtype=np.int16)
+
+    def add(self, samples, gain=1.0):
+        """Queue one client's int16 block for the next mix()."""
+        n = len(samples)
+        if self.count == len(self.gains) or n > self.frame_size:
+            self._grow(len(self.gains) * (2 if self.count == len(self.gains) else 1), max(n, self.frame_size))
+
+        self.frames[self.count, :n] = samples
+        self.gains[self.count] = gain
+        self.size = n
+        self.count += 1
+
+    def mix(self):
+        """
+        Mix the queued blocks.
+
+        Returns:
+            int16 array view (into memory reused between calls), or None if nothing was added
+        """
+        count = self.count
+        self.count = 0
+        if count == 0:
+            return None
+
+        n = self.size
+        out = self.out[:n]
+        if count == 1:
+            np.multiply(self.frames[0, :n], self.gains[0], out=out)
+        else:
+            np.dot(self.gains[:count], self.frames[:count, :n], out=out)
+        np.clip(out, -32768, 32767, out=out)
+        out_int16 = self.out_int16[:n]
+        out_int16[:] = out
+        return out_int16
@@ -0,0 +1,294 @@
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+import wave
+import zlib
+
+from protocol import FLAG_SILENCE, seq_delta, silence_end
+from SampleFormat import SAMPLE_BYTES, InputConverter
+
+logger = logging.getLogger("Recorder")
+
+OPUS_PRE_SKIP = 312  # libopus encoder lookahead at 48 kHz
+OGG_PAGE_PACKETS = 50  # Packets per Ogg page (~1 s at 20 ms)
+
+# Ogg uses the non-reflected CRC-32 (poly 0x04c11db7, init 0, no final xor).
+# zlib implements the reflected variant, so bit-reverse the input bytes and
+# the result to get the Ogg checksum at C speed.
+_REVERSE_BITS = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
+
+
+def ogg_crc(data):
+    reflected = zlib.crc32(data.translate(_REVERSE_BITS), 0xFFFFFFFF) ^ 0xFFFFFFFF
+    return int(f"{reflected:032b}"[::-1], 2)
+
+
+class Recorder:
+    """
+    Records one session's frames exactly as received, without decoding.
+
+    add() only queues the frame, so it is safe on the receive path. A
+    background thread puts frames back into sequence order (within a
+    small reorder window; late and duplicate frames are dropped) and
+    writes them through a buffered file, so a disk stall only grows the
+    queue. If the queue fills, frames are dropped from the recording, never
+    from playout.
+
+    DTX silence markers are queued too: they keep the sequence position
+    current while no audio arrives (the wire sequence is only 16 bits), and
+    the slots they declare are written as silence rather than counted lost.
+    """
+
+    REORDER_WINDOW = 8  # Frames a reordered packet may lag behind the newest one
+    extension = ''
+
+    def __init__(self, path, frame_size, rate=48000, channels=1, queue_size=1024):
+        """
+        Args:
+            path: Output file
+            frame_size: Samples per channel in each frame
+            rate: Sample rate in Hz
+            channels: Channel count
+            queue_size: Frames that may wait for the writer thread
+        """
+        self.path = path
+        self.frame_size = frame_size
+        self.rate = rate
+        self.channels = channels
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.file = None
+        self.active = True
+        self.stats = {'frames': 0, 'silent': 0, 'lost': 0, 'late': 0, 'dropped': 0}
+
+        self.thread = threading.Thread(target=self._run, name="Recorder", daemon=True)
+        self.thread.start()
+
+    def add(self, frame):
+        """Queue a received frame (never blocks)."""
+        if not self.active:
+            return
+        try:
+            self.queue.put_nowait(frame)
+        except queue.Full:
+            self.stats['dropped'] += 1
+            if self.stats['dropped'] % 100 == 1:
+                logger.warning(f"Recording queue full, {self.path} is missing {self.stats['dropped']} frames")
+
+    def close(self, timeout=10.0):
+        """
+        Flush everything queued and finish the file. Blocks until written,
+        or for at most `timeout` seconds if the disk stalls.
+        """
+        if self.active:
+            self.active = False
+            if self.thread.is_alive():
+                try:
+                    self.queue.put(None, timeout=timeout)
+                except queue.Full:
+                    logger.error(f"Recording to {self.path} is stuck, giving up on it")
+        self.thread.join(timeout)
+
+    def _run(self):
+        try:
+            self._open()
+        except OSError as e:
+            logger.error(f"Cannot record to {self.path}: {e}")
+            self.active = False
+            return
+
+        try:
+            self._record()
+        except OSError as e:
+            # Disk full or file removed: stop recording, playout carries on
+            logger.error(f"Recording to {self.path} failed: {e}")
+            self.active = False
+            try:
+                self._abandon()
+            except OSError:
+                pass
+
+    def _record(self):
+        pending = {}  # index -> payload, relative to the first frame received
+        next_index = None  # Next frame index to write
+        first_index = None  # Index written as the start of the file
+        highest = None  # Newest frame index seen
+        last_seq = None  # Wire sequence number of `highest`
+        silences = []  # [start, end) index ranges declared silent by markers
+
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+
+            if highest is None:
+                index = highest = 0
+                last_seq = frame.seq
+            else:
+                index = highest + seq_delta(frame.seq, last_seq)
+                if index > highest:
+                    highest, last_seq = index, frame.seq
+            if frame.flags & FLAG_SILENCE:
+                silences.append((index, index + seq_delta(silence_end(frame), frame.seq)))
+            elif (next_index is not None and index < next_index) or index in pending:
+                self.stats['late'] += 1
+                continue
+            else:
+                pending[index] = frame.payload
+
+            # Frames that arrived ahead of the first one (reordered) may still start the file
+            if next_index is None and pending and highest - min(pending) >= self.REORDER_WINDOW:
+                next_index = first_index = min(pending)
+            while next_index is not None and next_index <= highest - self.REORDER_WINDOW:
+                self._emit(next_index - first_index, pending.pop(next_index, None),
+                           any(start <= next_index < end for start, end in silences))
+                next_index += 1
+            # Forget silences already written (or, before the file starts, too old to matter)
+            oldest = next_index if next_index is not None else highest - self.REORDER_WINDOW
+            silences = [(start, end) for start, end in silences if end > oldest]
+
+        if pending:
+            if next_index is None:
+                next_index = first_index = min(pending)
+            while next_index <= highest:
+                self._emit(next_index - first_index, pending.pop(next_index, None),
+                           any(start <= next_index < end for start, end in silences))
+                next_index += 1
+        self._finish()
+        logger.info(f"Recording saved: {self.path} ({self.stats['frames']} frames, {self.stats['silent']} silent, {self.stats['lost']} missing)")
+
+    def _emit(self, index, payload, silent):
+        if payload is None:
+            self.stats['silent' if silent else 'lost'] += 1
+        else:
+            self.stats['frames'] += 1
+        self._write(index, payload)
+
+    def _open(self):
+        raise NotImplementedError
+
+    def _write(self, index, payload):
+        """Write frame `index`; payload is None for a silent slot or a frame that never arrived."""
+        raise NotImplementedError
+
+    def _finish(self):
+        raise NotImplementedError
+
+    def _abandon(self):
+        """Close the file after a write error, without finishing it."""
+        raise NotImplementedError
+
+
+class OggOpusRecorder(Recorder):
+    """
+    Writes the received Opus packets into an Ogg Opus file (RFC 7845).
+
+    Granule positions come from the frame sequence, so missing packets show
+    up as a granule gap that players fill with silence or PLC, and the file
+    keeps the sender's timing.
+    """
+
+    extension = '.opus'
+
+    def _open(self):
+        self.file = open(self.path, 'wb', buffering=1 << 16)
+        self.serial = int.from_bytes(os.urandom(4), 'little')
+        self.page_seq = 0
+        self.samples_48k = self.frame_size * 48000 // self.rate
+        self.page_packets = []
+        self.granule = 0
+
+        head = struct.pack('<8sBBHIhB', b'OpusHead', 1, self.channels, OPUS_PRE_SKIP, self.rate, 0, 0)
+        vendor = b'AudioLink'
+        tags = b'OpusTags' + struct.pack('<I', len(vendor)) + vendor + struct.pack('<I', 0)
+        self._write_page([head], 0, 0x02)  # Beginning of stream
+        self._write_page([tags], 0, 0x00)
+
+    def _write(self, index, payload):
+        if payload is None:
+            return
+        segments = sum(len(p) // 255 + 1 for p in self.page_packets) + len(payload) // 255 + 1
+        if segments > 255:
+            self._flush()
+        self.page_packets.append(payload)
+        # Decoded samples so far; they already include the pre-skip (RFC 7845 4.)
+        self.granule = (index + 1) * self.samples_48k
+        if len(self.page_packets) >= OGG_PAGE_PACKETS:
+            self._flush()
+
+    def _flush(self, flags=0x00):
+        if self.page_packets or flags:
+            self._write_page(self.page_packets, self.granule, flags)
+            self.page_packets = []
+
+    def _finish(self):
+        self._flush(0x04)  # End of stream
+        self.file.close()
+
+    def _abandon(self):
+        self.file.close()
+
+    def _write_page(self, packets, granule, flags):
+        lacing = bytearray()
+        for packet in packets:
+            lacing.extend(b'\xff' * (len(packet) // 255))
+            lacing.append(len(packet) % 255)
+        header = struct.pack('<4sBBqIIIB', b'OggS', 0, flags, granule, self.serial, self.page_seq, 0, len(lacing))
+        page = bytearray(header + lacing + b''.join(packets))
+        struct.pack_into('<I', page, 22, ogg_crc(bytes(page)))
+        self.file.write(page)
+        self.page_seq += 1
+
+
+class WavRecorder(Recorder):
+    """
+    Writes received PCM frames to WAV, with silence where frames are missing.
+    int16 and 24-bit frames are written as received; float32 frames are
+    converted to int16 (the wave module only writes integer PCM).
+    """
+
+    extension = '.wav'
+
+    def __init__(self, path, frame_size, rate=48000, channels=1, queue_size=1024, sample_format='int16'):
+        self.sample_format = sample_format
+        self.converter = InputConverter(sample_format, frame_size * channels) if sample_format == 'float32' else None
+        super().__init__(path, frame_size, rate, channels, queue_size)
+
+    def _open(self):
+        sample_bytes = 2 if self.converter else SAMPLE_BYTES[self.sample_format]
+        self.raw = open(self.path, 'wb', buffering=1 << 16)
+        self.file = wave.open(self.raw, 'wb')
+        self.file.setnchannels(self.channels)
+        self.file.setsampwidth(sample_bytes)
+        self.file.setframerate(self.rate)
+        self.silence = bytes(self.frame_size * self.channels * sample_bytes)
+
+    def _write(self, index, payload):
+        if payload is None:
+            payload = self.silence
+        elif self.converter:
+            payload = self.converter.convert(payload)
+        self.file.writeframesraw(payload)
+
+    def _finish(self):
+        self.file.close()  # Patches the header with the final length
+        self.raw.close()
+
+    def _abandon(self):
+        try:
+            self.file.close()  # Detaches the wave writer, whose __del__ would write again
+        finally:
+            self.raw.close()
+
+
+def create_recorder(directory, session, use_opus, rate=48000, channels=1, sample_format='int16'):
+    """Start recording a session to <directory>/session-<id>-<time>.opus|.wav."""
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    extension = OggOpusRecorder.extension if use_opus else WavRecorder.extension
+    path = os.path.join(directory, f"session-{session.session_id}-{stamp}{extension}")
+    logger.info(f"Recording session {session} to {path}")
+    if use_opus:
+        return OggOpusRecorder(path, session.frame_size, rate, channels)
+    return WavRecorder(path, session.frame_size, rate, channels, sample_format=sample_format)
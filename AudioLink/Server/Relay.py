@@ -0,0 +1,173 @@
+import asyncio
+import ipaddress
+import logging
+from collections import deque
+
+import websockets
+import websockets.exceptions
+
+from protocol import DATAGRAM_KEY, encode_control
+
+logger = logging.getLogger("Relay")
+
+SUBSCRIBE_PATH = '/subscribe'
+
+
+def is_loopback(host):
+    """True if a peer address (IPv4, IPv6 or IPv4-mapped IPv6) belongs to this machine."""
+    try:
+        address = ipaddress.ip_address(host.split('%')[0])
+    except ValueError:
+        return False
+    if address.version == 6 and address.ipv4_mapped is not None:
+        address = address.ipv4_mapped
+    return address.is_loopback
+
+
+class Subscriber:
+    """
+    One listener with its own bounded queue.
+
+    offer() never waits: when the queue is full the oldest frame is
+    dropped, so a slow listener only loses its own audio. A per-subscriber
+    task drains the queue into the socket.
+    """
+
+    def __init__(self, websocket, session_id=None, queue_size=64):
+        """
+        Args:
+            websocket: Listener connection
+            session_id: Session to follow, or None for all sessions
+            queue_size: Frames that may wait for this listener
+        """
+        self.websocket = websocket
+        self.session_id = session_id
+        self.queue = deque(maxlen=queue_size)
+        self.ready = asyncio.Event()
+        self.stats = {'sent': 0, 'dropped': 0}
+
+    def offer(self, message):
+        if len(self.queue) == self.queue.maxlen:
+            self.stats['dropped'] += 1
+        self.queue.append(message)
+        self.ready.set()
+
+    async def run(self):
+        try:
+            while True:
+                await self.ready.wait()
+                self.ready.clear()
+                while self.queue:
+                    await self.websocket.send(self.queue.popleft())
+                    self.stats['sent'] += 1
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+
+class Relay:
+    """
+    Republishes every received frame to local listeners (OBS browser
+    sources, recorders, dashboards) without decoding or re-encoding.
+
+    Listeners connect to the server's WebSocket port from this machine
+    (the port is open to the LAN for phones, so other hosts are refused):
+    - /subscribe/<id>: the frames of session <id>, exactly as the phone
+      sent them (AudioLink header + Opus/PCM payload)
+    - /subscribe: frames of all sessions, each prefixed with the 4-byte
+      little-endian session id
+
+    Each received frame is handed to every listener as the same buffer.
+    A JSON text frame lists the active sessions and their stream formats
+    on connect; session start (with its format) and end are announced
+    while subscribed.
+    """
+
+    def __init__(self, queue_size=64):
+        """
+        Args:
+            queue_size: Per-subscriber queue length in frames
+        """
+        self.queue_size = queue_size
+        self.all_sessions = set()  # Subscribers to every session
+        self.by_session = {}  # session_id -> set of Subscribers
+        self.stats = {'subscribers': 0, 'frames': 0, 'dropped': 0}  # dropped: by departed subscribers
+
+    def publish(self, session, message):
+        """Hand a received frame message to every interested subscriber (event loop)."""
+        followers = self.by_session.get(session.session_id)
+        if not followers and not self.all_sessions:
+            return
+        self.stats['frames'] += 1
+        if followers:
+            for subscriber in followers:
+                subscriber.offer(message)
+        if self.all_sessions:
+            tagged = DATAGRAM_KEY.pack(session.session_id) + message
+            for subscriber in self.all_sessions:
+                subscriber.offer(tagged)
+
+    def session_event(self, session, event):
+        """Tell subscribers a session started (with its stream format) or ended."""
+        fields = session.config.as_dict() if event == 'start' else {}
+        message = encode_control('session', id=session.session_id, event=event, **fields)
+        for subscriber in list(self.all_sessions) + list(self.by_session.get(session.session_id, ())):
+            subscriber.offer(message)
+
+    def dropped(self):
+        """Frames dropped for slow subscribers, current and departed."""
+        subscribers = list(self.all_sessions) + [s for group in self.by_session.values() for s in group]
+        return self.stats['dropped'] + sum(s.stats['dropped'] for s in subscribers)
+
+    async def serve(self, websocket, path, sessions):
+        """
+        Handle a subscriber connection until it closes.
+
+        Args:
+            websocket: The listener's connection
+            path: Request path (/subscribe or /subscribe/<id>)
+            sessions: Active sessions by id, announced with their formats
+        """
+        if not is_loopback(websocket.remote_address[0]):
+            logger.warning(f"Refusing subscriber {websocket.remote_address[0]}: not a local connection")
+            await websocket.close(1008, "Subscribers must connect from this machine")
+            return
+
+        suffix = path[len(SUBSCRIBE_PATH):].strip('/')
+        try:
+            session_id = int(suffix) if suffix else None
+        except ValueError:
+            await websocket.close(1008, "Expected /subscribe or /subscribe/<session id>")
+            return
+
+        subscriber = Subscriber(websocket, session_id, self.queue_size)
+        if session_id is None:
+            self.all_sessions.add(subscriber)
+        else:
+            self.by_session.setdefault(session_id, set()).add(subscriber)
+        self.stats['subscribers'] += 1
+        logger.info(f"Subscriber {websocket.remote_address[0]} following "
+                    f"{'all sessions' if session_id is None else f'session #{session_id}'}")
+
+        subscriber.offer(encode_control('stream', sessions=[
+            {'id': session_id, **session.config.as_dict()} for session_id, session in sorted(sessions.items())
+        ]))
+        sender = asyncio.create_task(subscriber.run())
+        try:
+            # Listeners only receive; wait for them to go away
+            async for _ in websocket:
+                pass
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            sender.cancel()
+            if session_id is None:
+                self.all_sessions.discard(subscriber)
+            else:
+                followers = self.by_session.get(session_id)
+                if followers is not None:
+                    followers.discard(subscriber)
+                    if not followers:
+                        del self.by_session[session_id]
+            self.stats['dropped'] += subscriber.stats['dropped']
+            logger.info(f"Subscriber {websocket.remote_address[0]} left "
+                        f"(sent {subscriber.stats['sent']}, dropped {subscriber.stats['dropped']})")
@@ -0,0 +1,100 @@
+import numpy as np
+
+SAMPLE_FORMATS = ('int16', 'int24', 'float32')
+SAMPLE_BYTES = {'int16': 2, 'int24': 3, 'float32': 4}
+
+INT16_SCALE = 1.0 / 32768.0
+
+
+class OutputConverter:
+    """
+    Turns the server's mono int16 blocks into a device format: int16,
+    packed 24-bit or float32, duplicated onto N interleaved channels.
+
+    Each conversion is a single broadcasting NumPy operation into an output
+    buffer reused between calls (it only grows when the host asks for a
+    larger block), so a device can be opened in its native mix format
+    without the OS converting behind our back. The result is a memoryview
+    of that buffer, valid until the next call. Mono int16 passes through
+    untouched.
+    """
+
+    def __init__(self, sample_format='int16', channels=1):
+        """
+        Args:
+            sample_format: One of SAMPLE_FORMATS
+            channels: Output channels; the mono signal is copied to each
+        """
+        if sample_format not in SAMPLE_FORMATS:
+            raise ValueError(f"Unknown sample format: {sample_format}")
+        if channels < 1:
+            raise ValueError(f"Invalid channel count: {channels}")
+        self.sample_format = sample_format
+        self.channels = channels
+        self.sample_bytes = SAMPLE_BYTES[sample_format]
+        self.passthrough = sample_format == 'int16' and channels == 1
+        self.out = None
+        self.out_bytes = None  # Byte view of self.out
+        self.frames = 0
+
+    @property
+    def frame_bytes(self):
+        """Bytes per sample frame (all channels)."""
+        return self.sample_bytes * self.channels
+
+    def _buffer(self, frames):
+        if frames > self.frames:
+            if self.sample_format == 'float32':
+                self.out = np.zeros((frames, self.channels), dtype=np.float32)
+            elif self.sample_format == 'int16':
+                self.out = np.zeros((frames, self.channels), dtype=np.int16)
+            else:
+                # Little-endian 24-bit: the low byte stays zero, the int16 goes in the top two
+                self.out = np.zeros((frames, self.channels, 3), dtype=np.uint8)
+            self.out_bytes = memoryview(self.out).cast('B')
+            self.frames = frames
+        return self.out[:frames]
+
+    def convert(self, data):
+        """Convert int16 mono PCM (any bytes-like object); returns a memoryview in the output format."""
+        if self.passthrough:
+            return data
+        samples = np.frombuffer(data, dtype=np.int16)
+        out = self._buffer(len(samples))
+        if self.sample_format == 'float32':
+            np.multiply(samples[:, None], INT16_SCALE, out=out)
+        elif self.sample_format == 'int16':
+            out[:] = samples[:, None]
+        else:
+            out[:, :, 1:] = samples.view(np.uint8).reshape(-1, 1, 2)
+        return self.out_bytes[:len(samples) * self.frame_bytes]
+
+
+class InputConverter:
+    """
+    Turns received PCM payloads in another sample format into int16 (the
+    internal format), channels left interleaved, in a reused buffer.
+    """
+
+    def __init__(self, sample_format, samples):
+        """
+        Args:
+            sample_format: 'int24' or 'float32' ('int16' needs no converter)
+            samples: Interleaved samples per payload
+        """
+        if sample_format not in SAMPLE_FORMATS or sample_format == 'int16':
+            raise ValueError(f"No conversion from {sample_format} to int16")
+        self.sample_format = sample_format
+        self.out = np.zeros(samples, dtype=np.int16)
+        if sample_format == 'float32':
+            self.work = np.zeros(samples, dtype=np.float32)
+
+    def convert(self, payload):
+        """Convert one payload; returns an int16 array reused by the next call."""
+        if self.sample_format == 'float32':
+            np.clip(np.frombuffer(payload, dtype=np.float32), -1.0, 32767.0 / 32768.0, out=self.work)
+            np.multiply(self.work, 32768.0, out=self.out, casting='unsafe')
+        else:
+            # Keep the top two bytes of each 24-bit sample
+            self.out.view(np.uint8).reshape(-1, 2)[:] = np.frombuffer(payload, dtype=np.uint8).reshape(-1, 3)[:, 1:]
+        return self.out
@@ -0,0 +1,98 @@
+import numpy as np
+
+
+class SampleRing:
+    """
+    Fixed-capacity, preallocated ring buffer of audio samples.
+
+    Single-producer / single-consumer: one thread calls write(), one thread
+    calls read_into()/skip(). The producer only advances write_pos and the
+    consumer only advances read_pos, each after its copy is complete, so
+    no lock is needed. Positions grow monotonically; the storage index is
+    the position modulo the capacity.
+
+    Neither side allocates sample memory after construction.
+    """
+
+    def __init__(self, capacity, dtype=np.int16):
+        """
+        Args:
+            capacity: Maximum number of buffered samples
+            dtype: Sample type of the storage
+        """
+        self.capacity = capacity
+        self.data = np.zeros(capacity, dtype=dtype)
+        self.write_pos = 0
+        self.read_pos = 0
+
+    def available(self):
+        """Samples ready to be read."""
+        return self.write_pos - self.read_pos
+
+    def space(self):
+        """Samples that can be written without overwriting unread data."""
+        return self.capacity - self.available()
+
+    def write(self, samples):
+        """
+        Append samples (producer side). Returns the number written, which is
+        less than len(samples) if the ring is full.
+        """
+        count = min(len(samples), self.space())
+        if count <= 0:
+            return 0
+
+        start = self.write_pos % self.capacity
+        first = min(count, self.capacity - start)
+        self.data[start:start + first] = samples[:first]
+        if count > first:
+            self.data[:count - first] = samples[first:count]
+
+        self.write_pos += count
+        return count
+
+    def read_into(self, out):
+        """
+        Fill out with the oldest samples (consumer side). Returns the number
+        of samples copied; the rest of out is left untouched.
+        """
+        count = min(len(out), self.available())
+        if count <= 0:
+            return 0
+
+        start = self.read_pos % self.capacity
+        first = min(count, self.capacity - start)
+        out[:first] = self.data[start:start + first]
+        if count > first:
+            out[first:count] = self.data[:count - first]
+
+        self.read_pos += count
+        return count
+
+    def skip(self, count):
+        """Discard up to count samples (consumer side)."""
+        count = min(count, self.available())
+        self.read_pos += count
+        return count
+
+    def move_into(self, ring):
+        """
+        Move buffered samples into another ring (consumer side of this ring,
+        producer side of the other). Returns the number of samples moved.
+        """
+        count = min(self.available(), ring.space())
+        if count <= 0:
+            return 0
+
+        start = self.read_pos % self.capacity
+        first = min(count, self.capacity - start)
+        ring.write(self.data[start:start + first])
+        if count > first:
+            ring.write(self.data[:count - first])
+
+        self.read_pos += count
+        return count
+
+    def clear(self):
+        """Drop all buffered samples. Only safe while neither side is active."""
+        self.read_pos = self.write_pos = 0
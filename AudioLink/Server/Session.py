@@ -0,0 +1,300 @@
+import logging
+import time
+import numpy as np
+
+from protocol import FLAG_SILENCE, OPUS_DTX_BYTES, ProtocolError, silence_end
+from JitterBuffer import JitterBuffer, SILENCE
+from Concealment import OpusConcealer, PcmConcealer
+from ClockDrift import DriftCompensator
+from SampleRing import SampleRing
+from Metrics import SessionMetrics
+from DspChain import DspChain
+from SampleFormat import SAMPLE_BYTES, InputConverter
+
+logger = logging.getLogger("Session")
+
+
+class Session:
+    """
+    State for one connected client.
+
+    Each session owns its decoder, concealment stage, JitterBuffer and
+    drift compensator, so several phones can stream at the same time
+    without sharing decoder state or interleaving frames.
+
+    receive() and fill() run on the decode worker thread, read_output() on
+    the audio callback thread. The two only share the output SampleRing,
+    and the larger ring the worker hands over when the callback outgrows it.
+    """
+
+    MIN_OUTPUT_RING = 1024  # Samples; the output ring holds at least four times this
+
+    def __init__(self, session_id, remote, use_opus=True, rate=48000, channels=1, frame_size=960,
+                 target_buffer_ms=40, adaptive=True, drift_correction=True, gain=1.0, dsp_stages=None,
+                 highpass_hz=80.0, period_size=None, sample_format='int16'):
+        """
+        Args:
+            session_id: Server-assigned identifier (for logs)
+            remote: Remote address of the client
+            use_opus: If True, payloads are Opus packets. If False, raw PCM.
+            rate: Sample rate in Hz
+            channels: Channel count of the received frames (downmixed to mono for the output)
+            frame_size: Samples per channel in each received frame
+            target_buffer_ms: JitterBuffer target depth (initial target if adaptive)
+            adaptive: Let the JitterBuffer follow the measured network jitter
+            drift_correction: Resample to compensate sender/output clock drift
+            gain: Mixing gain applied to this client
+            dsp_stages: DSP stage names run on every decoded frame (None disables processing)
+            highpass_hz: Cutoff of the 'highpass' stage
+            period_size: Samples per output period the callback is expected to ask for (default: frame_size)
+            sample_format: Sample format of raw PCM payloads (converted to int16 at playout)
+        """
+        self.session_id = session_id
+        self.remote = remote
+        self.use_opus = use_opus
+        self.rate = rate
+        self.channels = channels
+        self.frame_size = frame_size
+        self.period_size = period_size or frame_size
+        self.request_size = self.period_size  # Largest block the callback asked for so far
+        self.config = None  # StreamConfig agreed in the handshake, set by the server
+        self.gain = gain
+        self.udp_key = None  # Assigned by UdpTransport when audio arrives over UDP
+        self.recorder = None  # Recorder tap, set by the server when recording is enabled
+        self.token = None  # Resume token, set by the server when sessions may be resumed
+        self.feedback = None  # FeedbackReporter, set by the server when the client asked for reports
+        self.parked_at = None  # When the connection dropped, while the session waits to be resumed
+        self.expiry = None  # Task ending the session if it is not resumed in time
+        self.frames_received = 0
+        self.malformed = 0
+        self.metrics = SessionMetrics()
+        # Raw PCM frames must be exactly one frame long; Opus packets vary
+        self.pcm_frame_bytes = None if use_opus else frame_size * channels * SAMPLE_BYTES[sample_format]
+        self.input_converter = None
+        if not use_opus and sample_format != 'int16':
+            self.input_converter = InputConverter(sample_format, frame_size * channels)
+
+        frame_duration_ms = frame_size * 1000 / rate
+
+        if use_opus:
+            import opuslib
+            self.concealer = OpusConcealer(opuslib.Decoder(rate, channels), frame_size, channels)
+        else:
+            self.concealer = PcmConcealer(frame_size, channels)
+
+        self.jitter_buffer = JitterBuffer(
+            target_buffer_ms=target_buffer_ms,
+            frame_duration_ms=frame_duration_ms,
+            adaptive=adaptive,
+            clock_rate=rate
+        )
+        # Everything after the decoder runs on mono frames
+        if channels > 1:
+            self.downmix_sum = np.zeros(frame_size, dtype=np.int32)
+            self.downmix_frame = np.zeros(frame_size, dtype=np.int16)
+        self.dsp = DspChain(dsp_stages, rate, 1, highpass_hz) if dsp_stages else None
+        self.drift = DriftCompensator(
+            frame_size, frame_duration_ms=frame_duration_ms, output_size=self.period_size
+        ) if drift_correction else None
+
+        # Decoded samples waiting for the audio callback, which may take any
+        # number of them at a time (room for host APIs that ask for more than planned)
+        self.output_ring = SampleRing(max(frame_size, self.period_size, self.MIN_OUTPUT_RING) * 4)
+        self.grown_ring = None  # Larger output ring waiting for the callback to move into it
+        self.output_frame = np.zeros(self.period_size, dtype=np.int16)
+
+    def __str__(self):
+        return f"#{self.session_id} ({self.remote})"
+
+    def receive(self, frame):
+        """Queue a parsed frame. Opus packets stay encoded until playout."""
+        if frame.flags & FLAG_SILENCE:
+            try:
+                end_seq = silence_end(frame)
+            except ProtocolError as e:
+                self.malformed += 1
+                if self.malformed % 100 == 1:
+                    logger.warning(f"Session {self}: {e}")
+                return
+            # The recorder writes the declared slots as silence and keeps its sequence position
+            if self.recorder is not None:
+                self.recorder.add(frame)
+            self.jitter_buffer.push_silence(frame.seq, end_seq, timestamp=frame.timestamp)
+            return
+
+        if self.pcm_frame_bytes is not None and len(frame.payload) != self.pcm_frame_bytes:
+            self.malformed += 1
+            if self.malformed % 100 == 1:
+                logger.warning(f"Session {self}: dropping PCM frame of {len(frame.payload)} bytes")
+            return
+
+        if self.recorder is not None:
+            self.recorder.add(frame)
+
+        if self.pcm_frame_bytes is None and len(frame.payload) <= OPUS_DTX_BYTES:
+            # Opus DTX frame: silence, skip the decoder
+            self.jitter_buffer.push_silence(frame.seq, frame.seq + 1, timestamp=frame.timestamp)
+        else:
+            self.jitter_buffer.push(frame.payload, seq=frame.seq, timestamp=frame.timestamp)
+
+        # Log statistics every 100 packets (~2 seconds)
+        self.frames_received += 1
+        if self.frames_received % 100 == 0:
+            self.log_stats()
+
+    def next_output(self):
+        """
+        Produce PCM for the output as an int16 array: one decoded frame, or
+        one output period when frames pass through the drift compensator.
+        Returns None while the buffer is still filling.
+        """
+        if self.drift is None:
+            pcm = self._next_frame()
+            return np.frombuffer(pcm, dtype=np.int16) if pcm is not None else None
+
+        # The part of a frame the resampler carried over from the last period is
+        # playout delay too, which the JitterBuffer counts for its grow/shrink decisions
+        self.jitter_buffer.downstream_frames = self.drift.available() / self.frame_size
+        while self.drift.available() < self.period_size:
+            pcm = self._next_frame()
+            if pcm is None:
+                return None
+            if self.parked_at is None:
+                # Each stretch added a frame of depth and each shrink removed one; the rest is drift
+                stats = self.jitter_buffer.stats
+                depth = self.jitter_buffer.fill_level() - stats['stretched'] + stats['shrunk']
+            else:
+                depth = None  # The buffer is empty because the phone is away, not because of clock drift
+            self.drift.feed(pcm, depth)
+
+        return self.drift.read()
+
+    def fill(self, lead_periods=1):
+        """Decode until the output ring holds lead_periods callback blocks (worker side)."""
+        if self.grown_ring is not None:
+            return  # The callback has not moved into the larger ring yet
+        ring = self.output_ring
+        headroom = max(self.frame_size, self.period_size)  # Largest chunk next_output() returns
+        if self.request_size > ring.capacity - headroom:
+            # The callback asks for more than this ring can hold at once. It moves
+            # into the new ring itself, so each ring keeps a single producer
+            self.grown_ring = SampleRing((self.request_size + headroom) * 2)
+            return
+        lead = min(lead_periods * self.request_size, ring.capacity - headroom)
+        while ring.available() < lead:
+            samples = self.next_output()
+            if samples is None:
+                return
+            ring.write(samples)
+
+    def read_output(self, count=None):
+        """
+        Take count decoded samples (default: one period) for the mixer
+        (callback side), sample-accurately whatever the decoded frame size.
+        Returns a view into memory reused between calls, or None if fewer
+        than count samples are decoded.
+        """
+        count = count or self.period_size
+        if count > self.request_size:
+            # The host asks for bigger blocks than planned: decode further ahead
+            self.request_size = count
+            if count > len(self.output_frame):
+                self.output_frame = np.zeros(count, dtype=np.int16)
+        if self.grown_ring is not None:
+            # The worker made room for the bigger blocks: carry the pending samples over
+            self.output_ring.move_into(self.grown_ring)
+            self.output_ring = self.grown_ring
+            self.grown_ring = None
+        if self.output_ring.available() < count:
+            return None
+        out = self.output_frame[:count]
+        self.output_ring.read_into(out)
+        return out
+
+    def _next_frame(self):
+        """
+        Pop the next slot from the jitter buffer and turn it into PCM.
+        Decoding happens here, in sequence order, so Opus PLC/FEC see the
+        same packet order the sender produced. Missing slots are concealed.
+        """
+        start = time.perf_counter()
+        payload = self.jitter_buffer.pop()
+
+        if payload is SILENCE:
+            # Declared silence: no decode, no processing
+            pcm = self.concealer.comfort_noise()
+            self.metrics.on_playout(time.perf_counter() - start, self.jitter_buffer.depth(), False)
+            return self._downmix(pcm) if self.channels > 1 else pcm
+
+        if payload is not None:
+            pcm = self._decode(payload)
+            # Adaptive shrink: skip a silent frame and play the next one instead
+            if self.jitter_buffer.should_shrink() and self.concealer.is_silent():
+                next_payload = self.jitter_buffer.shrink()
+                if next_payload is not None:
+                    pcm = self._decode(next_payload)
+            concealed = False
+        elif not self.jitter_buffer.started:
+            return None
+        else:
+            # Lost slot (try FEC from the next packet), underrun or adaptive stretch
+            fec_source = self.jitter_buffer.peek() if self.jitter_buffer.last_lost else None
+            pcm = self.concealer.conceal(fec_source)
+            concealed = True
+
+        self.metrics.on_playout(time.perf_counter() - start, self.jitter_buffer.depth(), concealed)
+
+        if self.channels > 1:
+            pcm = self._downmix(pcm)
+
+        # Cleanup (high-pass, gate, AGC, limiter) on decoded and concealed audio alike
+        if self.dsp is not None:
+            pcm = self.dsp.process(pcm)
+        return pcm
+
+    def _decode(self, payload):
+        if self.input_converter is not None:
+            payload = self.input_converter.convert(payload)
+        return self.concealer.decode(payload)
+
+    def _downmix(self, pcm):
+        """Average interleaved channels into a reused mono frame."""
+        samples = np.frombuffer(pcm, dtype=np.int16).reshape(-1, self.channels)
+        np.sum(samples, axis=1, dtype=np.int32, out=self.downmix_sum)
+        self.downmix_sum //= self.channels
+        self.downmix_frame[:] = self.downmix_sum
+        return self.downmix_frame
+
+    def get_stats(self):
+        """Combined JitterBuffer, concealment and drift statistics."""
+        stats = self.jitter_buffer.get_stats()
+        stats.update(self.concealer.stats)
+        if self.drift:
+            stats.update(self.drift.get_stats())
+        return stats
+
+    def log_stats(self):
+        stats = self.get_stats()
+        logger.info(
+            f"Stats {self}: Depth={stats['current_depth']:.1f} "
+            f"Avg={stats['avg_depth']:.1f} "
+            f"Target={stats['target_ms']}ms "
+            f"Jitter={stats['jitter_ms']:.1f}ms "
+            f"Underruns={stats['underruns']} "
+            f"Overruns={stats['overruns']} "
+            f"Lost={stats['lost']} "
+            f"Late={stats['late']} "
+            f"Concealed={stats['concealed']} "
+            f"FEC={stats['fec_recovered']} "
+            f"Silent={stats['silent']} "
+            f"Drift={stats.get('drift_ppm', 0):+.0f}ppm"
+        )
+
+    def reset(self):
+        """Drop buffered audio and statistics."""
+        self.jitter_buffer.reset()
+        self.concealer.reset()
+        if self.dsp:
+            self.dsp.reset()
+        if self.drift:
+            self.drift.reset()
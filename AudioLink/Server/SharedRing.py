@@ -0,0 +1,104 @@
+import platform
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from SampleRing import SampleRing
+
+# Header slots (int64). Each side's fields sit on their own 64-byte cache line.
+WRITE_POS = 0  # Producer line
+READ_POS = 8  # Consumer line
+UNDERRUNS = 9  # Periods the consumer could not fill completely
+PERIODS = 10  # Periods the consumer served
+DEVICE_UNDERFLOWS = 11  # Periods the consumer's device reported as played late
+HEADER_SLOTS = 16
+HEADER_BYTES = HEADER_SLOTS * 8
+# CPUs that never reorder one store with an earlier store (x86 total store order)
+ORDERED_STORES = platform.machine().lower() in ('x86_64', 'amd64', 'i386', 'i686', 'x86')
+
+
+class SharedRing(SampleRing):
+    """
+    SampleRing whose samples and positions live in a
+    multiprocessing.shared_memory block, so the producer and the consumer
+    can be in different processes.
+
+    The protocol is the same as SampleRing: each side copies its samples
+    first and then publishes its position in an aligned int64 slot with a
+    single store. Python exposes no atomics or memory fences, so this
+    relies on the CPU keeping stores in program order. x86-64 does;
+    weakly ordered CPUs such as ARM64 may make a new position visible
+    before the copy it covers, so the other side can read stale or
+    overwritten samples (see ORDERED_STORES). Neither side takes a lock or allocates after
+    construction. The consumer also counts the periods it served,
+    those it could not fill (underruns) and those its device played late,
+    for the producer to export.
+    """
+
+    def __init__(self, capacity, name=None):
+        """
+        Args:
+            capacity: Maximum number of buffered samples
+            name: Attach to an existing ring of this name; None creates a new one
+        """
+        self.capacity = capacity
+        self.owner = name is None
+        size = HEADER_BYTES + capacity * np.dtype(np.int16).itemsize
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        self.header = np.ndarray(HEADER_SLOTS, dtype=np.int64, buffer=self.shm.buf)
+        self.data = np.ndarray(capacity, dtype=np.int16, buffer=self.shm.buf, offset=HEADER_BYTES)
+        if self.owner:
+            self.header[:] = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def write_pos(self):
+        return int(self.header[WRITE_POS])
+
+    @write_pos.setter
+    def write_pos(self, value):
+        self.header[WRITE_POS] = value
+
+    @property
+    def read_pos(self):
+        return int(self.header[READ_POS])
+
+    @read_pos.setter
+    def read_pos(self, value):
+        self.header[READ_POS] = value
+
+    def count_period(self, underrun):
+        """Record one served period (consumer side)."""
+        self.header[PERIODS] += 1
+        if underrun:
+            self.header[UNDERRUNS] += 1
+
+    @property
+    def periods(self):
+        return int(self.header[PERIODS])
+
+    @property
+    def underruns(self):
+        return int(self.header[UNDERRUNS])
+
+    @property
+    def device_underflows(self):
+        return int(self.header[DEVICE_UNDERFLOWS])
+
+    @device_underflows.setter
+    def device_underflows(self, value):
+        self.header[DEVICE_UNDERFLOWS] = value
+
+    def close(self):
+        """Detach; the creator also frees the block."""
+        # numpy views must go before the mapping can be closed
+        self.header = self.data = None
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,490 @@
+import logging
+import os
+import threading
+import time
+import wave
+
+from DeviceCache import device_fingerprint, find_device
+from SampleFormat import OutputConverter
+
+logger = logging.getLogger("Sinks")
+
+SINK_TYPES = ('callback', 'blocking', 'null', 'file')
+
+
+class SinkError(RuntimeError):
+    """Raised when an output backend cannot be opened."""
+
+
+class AudioSink:
+    """
+    Output backend interface.
+
+    A sink pulls audio from the server: start(render) hands it a callable
+    render(frame_count) -> mono int16 PCM as a bytes-like object (a view
+    of a buffer reused by the next call), which the sink calls once per
+    period from its own thread. Backends differ only in who owns
+    the clock (the sound card, or a monotonic timer) and where the bytes
+    go. Each sink converts the mono block to its own sample format and
+    channel count (self.converter) before handing it on.
+    """
+
+    name = 'sink'
+
+    def __init__(self, rate, channels, frame_size, sample_format='int16'):
+        """
+        Args:
+            rate: Sample rate in Hz
+            channels: Output channel count (the mono mix is copied to each)
+            frame_size: Samples per channel in each period
+            sample_format: Output sample format, one of SampleFormat.SAMPLE_FORMATS
+        """
+        self.rate = rate
+        self.channels = channels
+        self.frame_size = frame_size
+        self.sample_format = sample_format
+        self.converter = OutputConverter(sample_format, channels)
+        self.render = None
+        self.running = False
+        self.on_recovery = None  # Optional callable(seconds) after the output came back
+
+    def start(self, render):
+        raise NotImplementedError
+
+    def counters(self):
+        """Backend counters for the metrics endpoint, {name: value}."""
+        return {}
+
+    def stop(self):
+        raise NotImplementedError
+
+
+class PyAudioCallbackSink(AudioSink):
+    """
+    PortAudio callback stream: the sound card's clock drives render().
+
+    PyAudio is imported and the device chosen only when the sink starts
+    (when the first phone connects), using the device cache to skip the
+    scan. A watchdog thread notices when the device goes away (the stream
+    stops, errors, or stops asking for audio) and reopens the output on
+    the same device once it is back, or on the fallback device. Sessions
+    are not touched; they keep buffering until audio flows again.
+    """
+
+    name = 'callback'
+    WATCHDOG_INTERVAL_S = 0.25
+    STALL_TIMEOUT_S = 1.0  # No period for this long means the device is gone
+    RETRY_MAX_S = 2.0  # Longest wait between reopen attempts
+
+    PA_FORMATS = {'int16': 'paInt16', 'int24': 'paInt24', 'float32': 'paFloat32'}
+
+    def __init__(self, rate, channels, frame_size, device_index=None, cache=None, sample_format='int16'):
+        """
+        Args:
+            device_index: PyAudio output device; None picks the virtual cable if present
+            cache: DeviceCache remembering the selected device between runs
+        """
+        super().__init__(rate, channels, frame_size, sample_format)
+        self.device_index = device_index
+        self.cache = cache
+        self.pyaudio = None
+        self.p = None
+        self.stream = None
+        self.fingerprint = None  # Device currently playing
+        self.last_period = 0.0
+        self.underflows = 0  # Periods PortAudio flagged as played late
+        self.failed = False
+        self.output_ok = threading.Event()
+        self.watchdog = None
+
+    def _init_pyaudio(self):
+        if self.pyaudio is None:
+            try:
+                import pyaudio
+            except ImportError as e:
+                raise SinkError("PyAudio is not installed (pip install pyaudio); "
+                                "use --sink null or --sink file without a sound card") from e
+            self.pyaudio = pyaudio
+        if self.p is not None:
+            # PortAudio only sees the devices present when it was initialised
+            self.p.terminate()
+        self.p = self.pyaudio.PyAudio()
+
+    def _select_device(self):
+        if self.fingerprint:
+            index = find_device(self.p, self.fingerprint)
+            if index is not None:
+                return index
+            logger.warning(f"{self.fingerprint['name']} is not available, falling back")
+            # Keep the cache on the preferred device; this is only a stand-in
+            return select_output_device(self.p, self.cache, remember=False)
+        if self.device_index is not None:
+            return self.device_index
+        return select_output_device(self.p, self.cache)
+
+    def _stream_options(self):
+        return {'stream_callback': self._callback}
+
+    def _open(self):
+        """(Re)initialise PortAudio, choose the device and open the stream."""
+        self._init_pyaudio()
+        index = self._select_device()
+        try:
+            self.stream = self.p.open(
+                format=getattr(self.pyaudio, self.PA_FORMATS[self.sample_format]),
+                channels=self.channels,
+                rate=self.rate,
+                output=True,
+                output_device_index=index,
+                frames_per_buffer=self.frame_size,
+                **self._stream_options()
+            )
+        except Exception as e:
+            raise SinkError(f"Failed to open audio output: {e}") from e
+
+        self.fingerprint = device_fingerprint(self.p, index) if index is not None else None
+        self.last_period = time.monotonic()
+        self.failed = False
+        self.output_ok.set()
+        device_name = self.fingerprint['name'] if self.fingerprint else "Default Output"
+        logger.info(f"Audio Output Stream Started on: {device_name} ({self.name}, "
+                    f"{self.sample_format} x {self.channels}ch)")
+
+    def _close(self):
+        self.output_ok.clear()
+        if self.stream:
+            # A vanished device may fail to stop; the stream is discarded either way
+            for action in (self.stream.stop_stream, self.stream.close):
+                try:
+                    action()
+                except Exception:
+                    pass
+            self.stream = None
+
+    def start(self, render):
+        self.render = render
+        self._open()
+        self.running = True
+        self.watchdog = threading.Thread(target=self._watch, name="OutputWatchdog", daemon=True)
+        self.watchdog.start()
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        """Called by PortAudio on its own thread when it needs more audio."""
+        self.last_period = time.monotonic()
+        if status & self.pyaudio.paOutputUnderflow:
+            self.underflows += 1
+        # PyAudio only takes an immutable bytes object back from the callback (it
+        # parses the result with "z#", which refuses memoryviews), so this copy
+        # is the one allocation left on the render path
+        return (bytes(self.converter.convert(self.render(frame_count))), self.pyaudio.paContinue)
+
+    def counters(self):
+        return {'output_underflows': self.underflows}
+
+    def _lost(self):
+        if self.failed:
+            return True
+        try:
+            if not self.stream.is_active():
+                return True
+        except Exception:
+            return True
+        return time.monotonic() - self.last_period > self.STALL_TIMEOUT_S
+
+    def _watch(self):
+        while self.running:
+            time.sleep(self.WATCHDOG_INTERVAL_S)
+            if self.running and self._lost():
+                self._recover()
+
+    def _recover(self):
+        """Reopen the output until it works again (or the sink is stopped)."""
+        silent_since = self.last_period
+        device_name = self.fingerprint['name'] if self.fingerprint else "default output"
+        logger.warning(f"Audio output lost ({device_name}), reopening")
+        delay = 0.1
+        while self.running:
+            self._close()
+            try:
+                self._open()
+                break
+            except SinkError as e:
+                logger.warning(f"{e}; retrying in {delay:.1f} s")
+                time.sleep(delay)
+                delay = min(delay * 2, self.RETRY_MAX_S)
+        else:
+            return
+
+        recovery_s = time.monotonic() - silent_since
+        logger.info(f"Audio output recovered after {recovery_s:.2f} s")
+        if self.on_recovery:
+            self.on_recovery(recovery_s)
+
+    def stop(self):
+        self.running = False
+        if self.watchdog:
+            self.watchdog.join(timeout=self.RETRY_MAX_S + 1.0)
+            self.watchdog = None
+        self._close()
+        if self.p is not None:
+            self.p.terminate()
+            self.p = None
+
+
+class PyAudioBlockingSink(PyAudioCallbackSink):
+    """
+    PortAudio blocking stream written from a dedicated thread. write()
+    blocks until the device has room, so the device still sets the pace.
+    """
+
+    name = 'blocking'
+
+    def __init__(self, rate, channels, frame_size, device_index=None, cache=None, sample_format='int16'):
+        super().__init__(rate, channels, frame_size, device_index, cache, sample_format)
+        self.thread = None
+
+    def _stream_options(self):
+        return {}
+
+    def start(self, render):
+        super().start(render)
+        self.thread = threading.Thread(target=self._run, name="BlockingSink", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            # Paused while the watchdog reopens the device
+            if not self.output_ok.wait(timeout=0.1):
+                continue
+            try:
+                # Stream.write() parses its argument like the callback result: bytes only
+                self.stream.write(bytes(self.converter.convert(self.render(self.frame_size))))
+                self.last_period = time.monotonic()
+            except Exception as e:
+                if self.running and self.output_ok.is_set():
+                    logger.error(f"Audio output write failed: {e}")
+                    self.output_ok.clear()
+                    self.failed = True
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+        super().stop()
+
+
+class ClockedSink(AudioSink):
+    """
+    Sink without a device: a thread calls render() once per period on a
+    monotonic timer and passes the bytes to write(). Deadlines are absolute,
+    so scheduling jitter does not accumulate into drift.
+    """
+
+    def __init__(self, rate, channels, frame_size, sample_format='int16'):
+        super().__init__(rate, channels, frame_size, sample_format)
+        self.period_s = frame_size / rate
+        self.thread = None
+        self.errors = 0  # Periods lost to an exception in render() or write()
+
+    def start(self, render):
+        self.render = render
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=f"{self.name.capitalize()}Sink", daemon=True)
+        self.thread.start()
+        logger.info(f"Audio output started on {self.name} sink")
+
+    def _run(self):
+        deadline = time.monotonic()
+        while self.running:
+            now = time.monotonic()
+            try:
+                self.write(now, self.converter.convert(self.render(self.frame_size)))
+            except Exception as e:
+                # Skip this period and keep the clock running
+                self.errors += 1
+                if self.errors % 100 == 1:  # Log every 100th failed period
+                    logger.error(f"Rendering to the {self.name} sink failed: {e} (total {self.errors})")
+            deadline += self.period_s
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -self.period_s * 10:
+                deadline = time.monotonic()  # Far behind (suspended?): resync
+
+    def write(self, now, data):
+        raise NotImplementedError
+
+    def counters(self):
+        return {'output_errors': self.errors}
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+
+
+class NullSink(ClockedSink):
+    """
+    Discards audio. Optionally hands every block to on_block(time, data);
+    data is reused by the next period, so copy what you keep.
+    """
+
+    name = 'null'
+
+    def __init__(self, rate, channels, frame_size, on_block=None, sample_format='int16'):
+        """
+        Args:
+            on_block: Optional callable(monotonic_time, data) for each period
+        """
+        super().__init__(rate, channels, frame_size, sample_format)
+        self.on_block = on_block
+
+    def write(self, now, data):
+        if self.on_block:
+            self.on_block(now, data)
+
+
+class FileSink(ClockedSink):
+    """
+    Streams the output to a WAV file (.wav, int16 or 24-bit) or raw PCM in
+    the sink's sample format (any other extension).
+    """
+
+    name = 'file'
+
+    def __init__(self, rate, channels, frame_size, path, sample_format='int16'):
+        super().__init__(rate, channels, frame_size, sample_format)
+        self.wav = os.path.splitext(path)[1].lower() == '.wav'
+        if self.wav and sample_format == 'float32':
+            raise ValueError("WAV output is int16 or int24; use a raw output path for float32")
+        self.path = path
+        self.file = None
+
+    def start(self, render):
+        try:
+            if self.wav:
+                self.file = wave.open(self.path, 'wb')
+                self.file.setnchannels(self.channels)
+                self.file.setsampwidth(self.converter.sample_bytes)
+                self.file.setframerate(self.rate)
+            else:
+                self.file = open(self.path, 'wb')
+        except OSError as e:
+            raise SinkError(f"Failed to open output file {self.path}: {e}") from e
+        super().start(render)
+
+    def write(self, now, data):
+        if isinstance(self.file, wave.Wave_write):
+            self.file.writeframesraw(data)
+        else:
+            self.file.write(data)
+
+    def stop(self):
+        super().stop()
+        if self.file:
+            self.file.close()  # Also patches the WAV header with the final length
+            self.file = None
+
+
+def create_sink(kind, rate, channels, frame_size, device_index=None, path=None, cache=None, sample_format='int16'):
+    """
+    Build a sink by name (one of SINK_TYPES). Cheap: nothing is imported
+    or opened until the sink is started.
+
+    Args:
+        device_index: Output device for the PyAudio sinks
+        path: Output file for the file sink
+        cache: DeviceCache for the PyAudio sinks
+        sample_format: Output sample format (the sink converts the mono int16 mix)
+    """
+    if kind == 'callback':
+        return PyAudioCallbackSink(rate, channels, frame_size, device_index, cache, sample_format)
+    if kind == 'blocking':
+        return PyAudioBlockingSink(rate, channels, frame_size, device_index, cache, sample_format)
+    if kind == 'null':
+        return NullSink(rate, channels, frame_size, sample_format=sample_format)
+    if kind == 'file':
+        if not path:
+            raise ValueError("The file sink needs an output path")
+        return FileSink(rate, channels, frame_size, path, sample_format)
+    raise ValueError(f"Unknown sink type: {kind}")
+
+
+def select_output_device(pa, cache=None, remember=True):
+    """
+    Cached device if it is still present, else scan for the virtual cable.
+
+    Args:
+        cache: DeviceCache to consult, and to update after a scan if remember is set
+    Returns:
+        Device index, or None for the default output
+    """
+    if cache:
+        index = cache.lookup(pa)
+        if index is not None:
+            logger.info(f"Selected Audio Device (cached): {cache.entry['name']} [{cache.entry['host_api']}]")
+            return index
+    index = find_virtual_cable(pa)
+    if cache and remember and index is not None:
+        fingerprint = device_fingerprint(pa, index)
+        if fingerprint:
+            cache.store(fingerprint, index)
+    return index
+
+
+def find_virtual_cable(pa):
+    """Finds the index of VB-Audio Virtual Cable (CABLE Input)."""
+    count = pa.get_device_count()
+    candidates = ["CABLE Input", "VB-Audio", "Virtual Audio Cable"]
+    found_devices = []
+
+    for i in range(count):
+        try:
+            info = pa.get_device_info_by_index(i)
+            name = info.get("name", "")
+            if any(c in name for c in candidates) and info.get("maxOutputChannels") > 0:
+                # found a candidate
+                host_api_index = info.get("hostApi")
+                try:
+                    host_api_info = pa.get_host_api_info_by_index(host_api_index)
+                    host_api_name = host_api_info.get("name", "Unknown")
+                except:
+                    host_api_name = "Unknown"
+                
+                found_devices.append({
+                    "index": i,
+                    "name": name,
+                    "host_api": host_api_name,
+                    "host_api_index": host_api_index
+                })
+        except Exception:
+            continue
+    
+    if not found_devices:
+        logger.warning("Virtual Audio Cable NOT found! Using default speakers.")
+        logger.warning("CAUTION: This may cause an audio feedback loop if microphone is active.")
+        return None
+        
+    # Prioritize WASAPI
+    # WASAPI usually provides better latency and native 48kHz support which Discord prefers
+    best_device = None
+    for dev in found_devices:
+        if "WASAPI" in dev["host_api"]:
+            best_device = dev
+            break
+    
+    if not best_device:
+        # Fallback to MME or whatever was found first
+        best_device = found_devices[0]
+        
+    logger.info(f"Selected Audio Device: {best_device['name']}")
+    logger.info(f"  > Index: {best_device['index']}")
+    logger.info(f"  > API:   {best_device['host_api']}")
+    
+    if "WASAPI" not in best_device['host_api']:
+        logger.warning("NOTE: WASAPI driver not found for Virtual Cable.") 
+        logger.warning("If audio sounds bad in Discord, try installing VB-Cable correctly or check audio settings.")
+
+    return best_device['index']
@@ -0,0 +1,152 @@
+import math
+
+from protocol import ProtocolError, FRAME_DURATIONS_MS, encode_control
+from SampleFormat import SAMPLE_FORMATS
+
+CODECS = ('opus', 'pcm')
+CHANNEL_COUNTS = (1, 2)  # Stereo is downmixed to the mono output
+OPUS_BITRATE_RANGE = (6000, 510000)
+DEFAULT_OPUS_BITRATE = 32000
+MIN_FEC_FRAME_MS = 10  # Opus in-band FEC only exists in SILK frames (10 ms and longer)
+GAIN_RANGE = (0.0, 4.0)  # Linear mixing gain a client may ask for (mute up to +12 dB)
+
+
+def _pick(name, offered, default, supported):
+    """First offered value (a value or a list in preference order) the server supports."""
+    choices = offered if isinstance(offered, list) else [default if offered is None else offered]
+    for choice in choices:
+        if isinstance(choice, bool):
+            continue
+        for value in supported:
+            if choice == value:
+                return value
+    raise ProtocolError(f"No supported {name} in {choices} (supported: {', '.join(map(str, supported))})")
+
+
+def parse_gain(value):
+    """Mixing gain from a client message, clamped to GAIN_RANGE."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ProtocolError(f"Invalid gain: {value!r}")
+    return float(min(max(value, GAIN_RANGE[0]), GAIN_RANGE[1]))
+
+
+class StreamConfig:
+    """
+    Audio format of one session: codec, sample rate, channels, frame
+    duration, for Opus the encoder bitrate and in-band FEC, for PCM the
+    sample format, whether the sender leaves out silent frames (DTX),
+    whether it wants receiver reports (feedback) and its gain in the mix.
+
+    Either agreed in the handshake (negotiate) or the server's defaults for
+    clients that start streaming without one.
+    """
+
+    def __init__(self, codec='opus', rate=48000, channels=1, frame_ms=20, bitrate=None, fec=False, dtx=False,
+                 sample_format='int16', feedback=False, gain=1.0):
+        """
+        Args:
+            codec: 'opus' or 'pcm'
+            rate: Sample rate (and timestamp clock) in Hz
+            channels: Channels in each frame
+            frame_ms: Frame duration, one of FRAME_DURATIONS_MS
+            bitrate: Opus encoder bitrate in bit/s (None for PCM)
+            fec: Whether the sender adds Opus in-band FEC
+            dtx: Whether the sender replaces silence with Opus DTX frames or silence markers
+            sample_format: Sample format of PCM payloads, one of SAMPLE_FORMATS (Opus decodes to int16)
+            feedback: Whether the server sends periodic receiver reports (Feedback.FeedbackReporter)
+            gain: Linear gain applied to this client in the mix
+        """
+        self.codec = codec
+        self.rate = rate
+        self.channels = channels
+        self.frame_ms = frame_ms
+        self.bitrate = bitrate
+        self.fec = fec
+        self.dtx = dtx
+        self.sample_format = sample_format
+        self.feedback = feedback
+        self.gain = gain
+
+    @property
+    def use_opus(self):
+        return self.codec == 'opus'
+
+    @property
+    def frame_size(self):
+        """Samples per channel in each frame."""
+        return int(round(self.rate * self.frame_ms / 1000))
+
+    def as_dict(self):
+        return {
+            'codec': self.codec,
+            'rate': self.rate,
+            'channels': self.channels,
+            'frame_ms': self.frame_ms,
+            'frame_size': self.frame_size,
+            'bitrate': self.bitrate,
+            'fec': self.fec,
+            'dtx': self.dtx,
+            'sample_format': self.sample_format,
+            'feedback': self.feedback,
+            'gain': self.gain
+        }
+
+    def to_message(self):
+        """The 'config' control message sent back to the client."""
+        return encode_control('config', **self.as_dict())
+
+    def __str__(self):
+        gain = f" x{self.gain:g}" if self.gain != 1.0 else ''
+        if self.use_opus:
+            return (f"opus {self.rate}Hz/{self.channels}ch {self.frame_ms}ms "
+                    f"{self.bitrate // 1000}kbit/s{' +FEC' if self.fec else ''}{' +DTX' if self.dtx else ''}{gain}")
+        sample_format = f" {self.sample_format}" if self.sample_format != 'int16' else ''
+        return f"pcm {self.rate}Hz/{self.channels}ch {self.frame_ms}ms{sample_format}{' +DTX' if self.dtx else ''}{gain}"
+
+    @classmethod
+    def negotiate(cls, hello, default, codecs=CODECS, rates=(48000,)):
+        """
+        Agree on a format from a client's hello.
+
+        Every field is optional and may be a single value or a list in the
+        client's order of preference; missing fields take the default:
+
+            {"type": "hello", "codec": ["opus", "pcm"], "rate": 48000,
+             "channels": 1, "frame_ms": [10, 20], "bitrate": 24000, "fec": true,
+             "dtx": true, "sample_format": ["float32", "int16"], "feedback": true, "gain": 0.8}
+
+        Args:
+            hello: Decoded hello message
+            default: StreamConfig used for missing fields
+            codecs: Codecs this server can decode
+            rates: Sample rates the output runs at (there is no resampler)
+        Returns:
+            StreamConfig
+        Raises:
+            ProtocolError: If the message is not a hello or nothing offered is supported
+        """
+        if hello.get('type') != 'hello':
+            raise ProtocolError(f"Expected a hello message, got '{hello.get('type')}'")
+
+        codec = _pick('codec', hello.get('codec'), default.codec, codecs)
+        rate = _pick('sample rate', hello.get('rate'), default.rate, rates)
+        channels = _pick('channel count', hello.get('channels'), default.channels, CHANNEL_COUNTS)
+        frame_ms = _pick('frame duration', hello.get('frame_ms'), default.frame_ms, FRAME_DURATIONS_MS)
+
+        bitrate = None
+        fec = False
+        sample_format = 'int16'
+        if codec == 'pcm':
+            sample_format = _pick('sample format', hello.get('sample_format'), default.sample_format, SAMPLE_FORMATS)
+        else:
+            bitrate = hello.get('bitrate', default.bitrate or DEFAULT_OPUS_BITRATE)
+            if isinstance(bitrate, bool) or not isinstance(bitrate, (int, float)) or not math.isfinite(bitrate):
+                raise ProtocolError(f"Invalid Opus bitrate: {bitrate!r}")
+            bitrate = int(min(max(bitrate, OPUS_BITRATE_RANGE[0]), OPUS_BITRATE_RANGE[1]))
+            fec = bool(hello.get('fec', default.fec)) and frame_ms >= MIN_FEC_FRAME_MS
+
+        dtx = bool(hello.get('dtx', default.dtx))
+        feedback = bool(hello.get('feedback', False))
+        gain = parse_gain(hello.get('gain', default.gain))
+
+        return cls(codec, rate, channels, frame_ms, bitrate, fec, dtx, sample_format, feedback, gain)
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import secrets
+
+from protocol import parse_datagram, ProtocolError, DATAGRAM_KEY_SIZE
+
+logger = logging.getLogger("UdpTransport")
+
+
+class UdpTransport(asyncio.DatagramProtocol):
+    """
+    UDP audio transport running alongside the WebSocket server.
+
+    The WebSocket connection carries the handshake and control messages;
+    the server hands each session a random key and the client then sends
+    one frame per datagram, prefixed with that key. Datagrams feed the
+    same decode path as WebSocket frames, so a lost or late
+    datagram only costs its own slot instead of holding back every later
+    frame the way a TCP retransmission does.
+    """
+
+    def __init__(self, submit, publish=None):
+        """
+        Args:
+            submit: Callable(session, frame) that queues a frame for decoding
+            publish: Optional callable(session, message) that relays the raw frame
+        """
+        self.submit = submit
+        self.publish = publish
+        self.transport = None
+        self.sessions = {}  # key -> Session
+        self.stats = {
+            'datagrams': 0,
+            'malformed': 0,
+            'unknown_key': 0,
+            'wrong_source': 0
+        }
+
+    def register(self, session):
+        """Assign a UDP key to a session. Returns the key."""
+        key = secrets.randbits(32)
+        while key in self.sessions:
+            key = secrets.randbits(32)
+        self.sessions[key] = session
+        session.udp_key = key
+        return key
+
+    def unregister(self, session):
+        key = session.udp_key
+        if key is not None:
+            self.sessions.pop(key, None)
+            session.udp_key = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        sock = transport.get_extra_info('socket')
+        if sock:
+            try:
+                import socket
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 262144)
+            except OSError as e:
+                logger.warning(f"Could not enlarge UDP receive buffer: {e}")
+
+    def datagram_received(self, data, addr):
+        self.stats['datagrams'] += 1
+        try:
+            key, frame = parse_datagram(data)
+        except ProtocolError as e:
+            self.stats['malformed'] += 1
+            if self.stats['malformed'] % 100 == 1:
+                logger.warning(f"Dropping malformed datagram from {addr[0]}: {e}")
+            return
+
+        session = self.sessions.get(key)
+        if session is None:
+            self.stats['unknown_key'] += 1
+            return
+
+        # Only accept audio from the host that owns the WebSocket session
+        if addr[0] != session.remote:
+            self.stats['wrong_source'] += 1
+            return
+
+        session.metrics.on_frame(len(data))
+        self.submit(session, frame)
+        if self.publish:
+            self.publish(session, memoryview(data)[DATAGRAM_KEY_SIZE:])
+
+    def error_received(self, exc):
+        logger.warning(f"UDP transport error: {exc}")
+
+    def close(self):
+        if self.transport:
+            self.transport.close()
+            self.transport = None
@@ -0,0 +1,332 @@
+"""
+Headless network-impairment benchmark for the AudioLink server.
+
+Runs the real server in-process against a null sink (no sound card
+needed), streams a reference signal to it over the real WebSocket
+protocol through an impairment shim, and compares what comes out with
+what went in:
+
+    python benchmark.py                      # all scenarios, PCM
+    python benchmark.py --scenario burst --opus --duration 30
+    python benchmark.py --loss 5 --jitter-ms 15 --json
+    python benchmark.py --frame-ms 5         # negotiate 5 ms frames in the handshake
+    python benchmark.py --period-size 256    # smaller output periods
+    python benchmark.py --scenario drift --duration 90   # watch drift correction converge
+
+Reported per scenario: JitterBuffer underruns, output glitches (silent
+callbacks while streaming), concealment ratio, mean/p99 mouth-to-ear
+playout delay and signal fidelity (SNR of the aligned output, and the
+share of audible output blocks that could be aligned at all). The drift
+scenario runs the sender's clock fast. residual_ppm, the slope of the
+playout delay over the last quarter of the run, shows whether the
+server's drift correction (correction_ppm) has caught up: it is the
+sender's drift_ppm without correction and near zero once converged.
+"""
+import argparse
+import asyncio
+import heapq
+import json
+import logging
+import random
+import time
+
+import numpy as np
+import websockets
+
+import server
+from protocol import pack_frame, encode_control, decode_control, FRAME_DURATIONS_MS
+from Sinks import NullSink
+
+RATE = server.RATE
+FRAME_SIZE = server.FRAME_SIZE
+FRAME_S = FRAME_SIZE / RATE
+MAX_DELAY_S = 0.5  # Longest playout delay the aligner searches for
+
+# name -> impairment settings
+SCENARIOS = {
+    'clean': {},
+    'jitter': {'jitter_ms': 15},
+    'loss': {'loss': 0.03},
+    'burst': {'burst_loss': 0.02, 'burst_length': 4},
+    'reorder': {'jitter_ms': 5, 'reorder': 0.05},
+    'wifi': {'delay_ms': 5, 'jitter_ms': 12, 'loss': 0.01, 'burst_loss': 0.005, 'burst_length': 3, 'reorder': 0.02},
+    'drift': {'drift_ppm': 500},  # Sender clock, not the network: see run_scenario
+}
+
+
+class ImpairmentShim:
+    """
+    Delays, drops and reorders frames before they reach the socket.
+
+    Loss is either independent (loss) or bursty: with probability
+    burst_loss a burst starts and the next burst_length frames are lost.
+    Reordered frames are held back by one to three extra frame periods.
+    """
+
+    def __init__(self, send, delay_ms=0, jitter_ms=0, loss=0.0, burst_loss=0.0, burst_length=3, reorder=0.0, seed=1,
+                 frame_s=FRAME_S):
+        self.send = send
+        self.frame_s = frame_s
+        self.delay_s = delay_ms / 1000.0
+        self.jitter_s = jitter_ms / 1000.0
+        self.loss = loss
+        self.burst_loss = burst_loss
+        self.burst_length = burst_length
+        self.reorder = reorder
+        self.rng = random.Random(seed)
+        self.burst_left = 0
+        self.pending = []  # heap of (deliver_at, seq, message)
+        self.wakeup = asyncio.Event()
+        self.stats = {'sent': 0, 'dropped': 0, 'reordered': 0}
+
+    def submit(self, seq, message):
+        if self.burst_left > 0:
+            self.burst_left -= 1
+            self.stats['dropped'] += 1
+            return
+        if self.burst_loss and self.rng.random() < self.burst_loss:
+            self.burst_left = self.burst_length - 1
+            self.stats['dropped'] += 1
+            return
+        if self.loss and self.rng.random() < self.loss:
+            self.stats['dropped'] += 1
+            return
+
+        delay = self.delay_s + (self.rng.expovariate(1.0 / self.jitter_s) if self.jitter_s else 0.0)
+        if self.reorder and self.rng.random() < self.reorder:
+            delay += self.frame_s * self.rng.randint(1, 3)
+            self.stats['reordered'] += 1
+        heapq.heappush(self.pending, (time.monotonic() + delay, seq, message))
+        self.wakeup.set()
+
+    async def run(self):
+        """Deliver queued frames when they are due."""
+        while True:
+            if not self.pending:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            deliver_at = self.pending[0][0]
+            now = time.monotonic()
+            if deliver_at > now:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), deliver_at - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, _, message = heapq.heappop(self.pending)
+            await self.send(message)
+            self.stats['sent'] += 1
+
+    def idle(self):
+        return not self.pending
+
+
+def reference_signal(n, seed=1):
+    """n samples of seeded noise with a speech-like spectrum: no periodicity to confuse alignment."""
+    rng = np.random.default_rng(seed)
+    spectrum = np.fft.rfft(rng.standard_normal(n))
+    freqs = np.fft.rfftfreq(n, 1.0 / RATE)
+    spectrum /= np.sqrt(1.0 + (freqs / 3000.0) ** 4)  # Roll off above ~3 kHz
+    shaped = np.fft.irfft(spectrum, n)
+    shaped *= 8000.0 / np.sqrt(np.mean(shaped ** 2))
+    return np.clip(shaped, -32768, 32767).astype(np.int16)
+
+
+def analyse(blocks, reference, t0, stream_end, clock=1.0):
+    """
+    Align every output block against the reference by FFT cross-correlation.
+
+    A block can only contain audio that was already captured, so block k
+    is searched in the last MAX_DELAY_S of reference before its play time.
+    clock is the sender's sample clock relative to ours (1.0005 is 500 ppm fast).
+    """
+    times, delays, snrs = [], [], []
+    glitches = 0
+    audible = 0
+    started = False
+    block_size = max((len(block) for _, block in blocks), default=FRAME_SIZE)
+    window = int(MAX_DELAY_S * RATE) + block_size
+    nfft = 1 << (window + block_size - 1).bit_length()
+    ref = reference.astype(np.float64)
+    ref_energy = np.concatenate(([0.0], np.cumsum(ref ** 2)))
+
+    for t_out, block in blocks:
+        if t_out >= stream_end:
+            break
+        x = block.astype(np.float64)
+        n = len(x)
+        x_energy = np.dot(x, x)
+        if x_energy == 0.0:
+            if started:
+                glitches += 1
+            continue
+        started = True
+        audible += 1
+
+        end = min(int((t_out - t0) * RATE * clock), len(ref))
+        start = max(0, end - window)
+        if end - start < n:
+            continue
+        segment = ref[start:end]
+        corr = np.fft.irfft(np.fft.rfft(segment, nfft) * np.conj(np.fft.rfft(x, nfft)), nfft)
+        corr = corr[:len(segment) - n + 1]
+        lag = int(np.argmax(corr))
+        k = start + lag
+        seg_energy = ref_energy[k + n] - ref_energy[k]
+        if seg_energy == 0.0 or corr[lag] / np.sqrt(x_energy * seg_energy) < 0.8:
+            continue  # Concealed or otherwise unrecognisable
+
+        error = x - ref[k:k + n]
+        snrs.append(min(99.0, 10 * np.log10(seg_energy / max(np.dot(error, error), 1e-9))))
+        delays.append(t_out - (t0 + k / (RATE * clock)))
+        times.append(t_out)
+
+    matched_ratio = len(snrs) / audible if audible else 0.0
+    return times, delays, snrs, glitches, matched_ratio
+
+
+async def run_scenario(name, impairments, args, port):
+    blocks = []  # (monotonic time, int16 samples) for every output period
+    sink = NullSink(RATE, server.CHANNELS, args.period_size,
+                    on_block=lambda now, data: blocks.append((now, np.frombuffer(data, dtype=np.int16).copy())))
+    audio_server = server.AudioServer(
+        use_opus=args.opus,
+        target_buffer_ms=args.buffer_ms,
+        adaptive=not args.fixed_buffer,
+        drift_correction=not args.no_drift_correction,
+        metrics_log_interval=0,
+        sink=sink,
+        period_size=args.period_size
+    )
+
+    server_task = asyncio.create_task(audio_server.start_server(host="127.0.0.1", port=port))
+    await asyncio.sleep(0.2)
+
+    impairments = dict(impairments)
+    # The sender captures and sends by its own clock
+    clock = 1.0 + impairments.pop('drift_ppm', 0) * 1e-6
+    frame_size = int(RATE * args.frame_ms / 1000) if args.frame_ms else FRAME_SIZE
+    frame_s = frame_size / RATE
+    frames = int(args.duration / frame_s)
+    reference = reference_signal(frames * frame_size, seed=args.seed)
+    encoder = None
+    if args.opus:
+        import opuslib
+        encoder = opuslib.Encoder(RATE, 1, opuslib.APPLICATION_VOIP)
+
+    async with websockets.connect(f"ws://127.0.0.1:{port}", compression=None) as ws:
+        if args.frame_ms:
+            await ws.send(encode_control('hello', codec='opus' if args.opus else 'pcm', rate=RATE, channels=1,
+                                         frame_ms=args.frame_ms, fec=True))
+            config = decode_control(await ws.recv())
+            if config['type'] != 'config':
+                raise RuntimeError(f"Handshake failed: {config}")
+        shim = ImpairmentShim(ws.send, seed=args.seed, frame_s=frame_s, **impairments)
+        shim_task = asyncio.create_task(shim.run())
+        t0 = time.monotonic()
+        for seq in range(frames):
+            # Frame seq is complete (captured) one frame after its first sample
+            await asyncio.sleep(max(0.0, t0 + (seq + 1) * frame_s / clock - time.monotonic()))
+            pcm = reference[seq * frame_size:(seq + 1) * frame_size].tobytes()
+            payload = encoder.encode(pcm, frame_size) if encoder else pcm
+            shim.submit(seq, pack_frame(seq, seq * frame_size, payload))
+        while not shim.idle():
+            await asyncio.sleep(frame_s)
+        stream_end = time.monotonic()
+        session = audio_server.active_sessions[0] if audio_server.active_sessions else None
+        stats = session.get_stats() if session else {}
+        await asyncio.sleep(MAX_DELAY_S)
+        shim_task.cancel()
+
+    audio_server.stop_audio_stream()
+    server_task.cancel()
+
+    times, delays, snrs, glitches, matched_ratio = analyse(blocks, reference, t0, stream_end, clock)
+    played = stats.get('packets_played', 0) + stats.get('concealed', 0)
+    # Seconds of delay gained per second of playout, late in the run
+    tail = len(delays) * 3 // 4
+    residual = np.polyfit(times[tail:], delays[tail:], 1)[0] if len(delays) - tail >= 2 else None
+    return {
+        'scenario': name,
+        'frames_sent': frames,
+        'shim_dropped': shim.stats['dropped'],
+        'shim_reordered': shim.stats['reordered'],
+        'underruns': stats.get('underruns', 0),
+        'output_glitches': glitches,
+        'concealment_ratio': round(stats.get('concealed', 0) / played, 4) if played else 0.0,
+        'delay_mean_ms': round(float(np.mean(delays)) * 1000, 1) if delays else None,
+        'delay_p99_ms': round(float(np.percentile(delays, 99)) * 1000, 1) if delays else None,
+        'snr_median_db': round(float(np.median(snrs)), 1) if snrs else None,
+        'matched_ratio': round(matched_ratio, 3),
+        'target_ms': stats.get('target_ms'),
+        'jitter_ms': round(stats.get('jitter_ms', 0.0), 1),
+        'drift_ppm': round((clock - 1.0) * 1e6),
+        'correction_ppm': round((1.0 - stats.get('resample_ratio', 1.0)) * 1e6),
+        'residual_ppm': round(float(residual) * 1e6) if residual is not None else None
+    }
+
+
+def print_table(results):
+    columns = ['scenario', 'shim_dropped', 'underruns', 'output_glitches', 'concealment_ratio',
+               'delay_mean_ms', 'delay_p99_ms', 'snr_median_db', 'matched_ratio', 'target_ms',
+               'drift_ppm', 'correction_ppm', 'residual_ppm']
+    widths = [max(len(c), *(len(str(r[c])) for r in results)) for c in columns]
+    print('  '.join(c.ljust(w) for c, w in zip(columns, widths)))
+    for r in results:
+        print('  '.join(str(r[c]).ljust(w) for c, w in zip(columns, widths)))
+
+
+async def main(args):
+    if args.scenario == 'custom':
+        scenarios = {'custom': {
+            'delay_ms': args.delay_ms, 'jitter_ms': args.jitter_ms, 'loss': args.loss / 100.0,
+            'burst_loss': args.burst_loss / 100.0, 'burst_length': args.burst_length, 'reorder': args.reorder / 100.0,
+            'drift_ppm': args.drift_ppm
+        }}
+    elif args.scenario == 'all':
+        scenarios = SCENARIOS
+    else:
+        scenarios = {args.scenario: SCENARIOS[args.scenario]}
+
+    results = []
+    for i, (name, impairments) in enumerate(scenarios.items()):
+        results.append(await run_scenario(name, impairments, args, args.port + i))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='AudioLink headless impairment benchmark')
+    parser.add_argument('--scenario', choices=['all', 'custom', *SCENARIOS], default='all',
+                        help='Preset impairment scenario; "custom" uses the flags below (default: all)')
+    parser.add_argument('--duration', type=float, default=20.0, help='Seconds streamed per scenario (default: 20)')
+    parser.add_argument('--opus', action='store_true', help='Stream Opus instead of PCM (needs opuslib)')
+    parser.add_argument('--frame-ms', type=float, choices=FRAME_DURATIONS_MS,
+                        help='Negotiate this frame duration in a handshake (default: 20 ms frames, no handshake)')
+    parser.add_argument('--period-size', type=int, default=server.CHUNK,
+                        help=f'Server output period in samples (default: {server.CHUNK})')
+    parser.add_argument('--buffer-ms', type=int, default=40, help='Server JitterBuffer target (default: 40)')
+    parser.add_argument('--fixed-buffer', action='store_true', help='Disable adaptive playout delay')
+    parser.add_argument('--no-drift-correction', action='store_true', help='Disable drift resampling on the server')
+    parser.add_argument('--delay-ms', type=float, default=0, help='Custom: constant extra delay')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='Custom: mean of exponential jitter')
+    parser.add_argument('--loss', type=float, default=0, help='Custom: independent loss in percent')
+    parser.add_argument('--burst-loss', type=float, default=0, help='Custom: burst start probability in percent')
+    parser.add_argument('--burst-length', type=int, default=3, help='Custom: frames lost per burst')
+    parser.add_argument('--reorder', type=float, default=0, help='Custom: reordered frames in percent')
+    parser.add_argument('--drift-ppm', type=float, default=0, help='Custom: sender clock offset in ppm (+ is fast)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for signal and impairments')
+    parser.add_argument('--port', type=int, default=18765, help='First local port used for the server')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    parser.add_argument('--verbose', action='store_true', help='Keep server logging')
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.disable(logging.WARNING)
+
+    asyncio.run(main(args))
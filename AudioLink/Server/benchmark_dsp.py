@@ -0,0 +1,61 @@
+"""
+Microbenchmark for the per-session DSP chain.
+
+Runs every stage on synthetic speech-like frames (bursts of shaped noise
+with pauses and level swings) and reports the cost per frame against the
+frame's real-time budget:
+
+    python benchmark_dsp.py
+    python benchmark_dsp.py --frames 5000 --frame-ms 10 --stages highpass,limiter
+"""
+import argparse
+import time
+
+import numpy as np
+
+from DspChain import DspChain, DEFAULT_STAGES
+from Metrics import Histogram, PROCESSING_BUCKETS
+
+RATE = 48000
+
+
+def speech_like(frames, frame_size, seed=1):
+    """Noise bursts of varying level with pauses, plus 50 Hz rumble."""
+    rng = np.random.default_rng(seed)
+    n = frames * frame_size
+    t = np.arange(n) / RATE
+    envelope = np.repeat(rng.choice([0.0, 0.3, 1.0, 3.0], size=n // 9600 + 1), 9600)[:n]
+    signal = rng.standard_normal(n) * 2000 * envelope + 1500 * np.sin(2 * np.pi * 50 * t)
+    return np.clip(signal, -32768, 32767).astype(np.int16).reshape(frames, frame_size)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='DSP chain microbenchmark')
+    parser.add_argument('--frames', type=int, default=2000, help='Frames to process (default: 2000)')
+    parser.add_argument('--frame-ms', type=float, default=20.0, help='Frame duration (default: 20)')
+    parser.add_argument('--stages', default=','.join(DEFAULT_STAGES), help='Comma-separated stages')
+    args = parser.parse_args()
+
+    frame_size = int(RATE * args.frame_ms / 1000)
+    frames = speech_like(args.frames, frame_size)
+    chain = DspChain(args.stages.split(','), RATE)
+
+    # Warm up (per-block-size setup, allocator), then measure from a clean slate
+    for frame in frames[:50]:
+        chain.process(frame)
+    chain.timings = {name: Histogram(PROCESSING_BUCKETS) for name in chain.timings}
+    chain.total = Histogram(PROCESSING_BUCKETS)
+
+    start = time.perf_counter()
+    for frame in frames:
+        chain.process(frame)
+    wall = time.perf_counter() - start
+
+    budget_us = args.frame_ms * 1000
+    print(f"{args.frames} frames of {args.frame_ms:g} ms ({frame_size} samples)")
+    print(f"{'stage':<10} {'mean us':>9} {'p99 us':>9} {'% budget':>9}")
+    for name, h in list(chain.timings.items()) + [('chain', chain.total)]:
+        mean_us = h.mean() * 1e6
+        print(f"{name:<10} {mean_us:>9.1f} {h.quantile(0.99) * 1e6:>9.1f} {100 * mean_us / budget_us:>8.2f}%")
+    print(f"Wall time per frame incl. conversion: {wall / args.frames * 1e6:.1f} us "
+          f"({100 * wall / args.frames * 1e6 / budget_us:.2f}% of one core per client)")
@@ -0,0 +1,154 @@
+"""
+AudioLink wire protocol.
+
+Every binary WebSocket message carries exactly one audio frame, prefixed
+with a compact 8-byte little-endian header:
+
+    offset  size  field
+    0       1     version    (PROTOCOL_VERSION)
+    1       1     flags      (FLAG_SILENCE, other bits reserved)
+    2       2     sequence   (uint16, +1 per frame, wraps)
+    4       4     timestamp  (uint32, sample clock of the first sample, wraps)
+
+The payload that follows is either an Opus packet or raw 16-bit PCM.
+
+Discontinuous transmission (negotiated with "dtx": true): while the mic
+is silent the client stops sending audio. It sends a silence marker
+instead, a frame with FLAG_SILENCE whose payload is the uint16 sequence
+number N where the silence is declared to end. The slots from the
+marker's own sequence number up to N - 1 are played as comfort noise
+rather than concealed as lost, and are never decoded. The client renews
+the marker before N while the silence lasts, and simply resumes sending
+audio (even before N) when speech returns. Opus packets of at most
+OPUS_DTX_BYTES bytes (libopus DTX output) are treated the same way.
+
+In UDP mode each datagram carries one such frame prefixed with the 4-byte
+session key the server announced over the WebSocket. Control messages
+travel as JSON text frames on the WebSocket: {"type": "...", ...}.
+
+A client may open with a "hello" text frame offering its stream format
+(see StreamConfig.negotiate); the server answers with the "config" it
+will decode, or an "error". A client whose first message is a binary
+frame gets the server's default format (legacy clients).
+
+Handshake clients also receive {"type": "token", "token": ...}. If the
+connection drops, a new connection whose hello carries "resume": <token>
+within the server's grace period gets the same session back (decoder,
+buffer and sequence position). The server answers with the session's
+"config" and {"type": "resumed", "last_seq": N}, the last sequence number
+it received, and the client simply continues its sequence.
+"""
+import json
+import struct
+from collections import namedtuple
+
+PROTOCOL_VERSION = 1
+
+HEADER = struct.Struct('<BBHI')
+HEADER_SIZE = HEADER.size
+
+DATAGRAM_KEY = struct.Struct('<I')
+DATAGRAM_KEY_SIZE = DATAGRAM_KEY.size
+
+SEQ_MODULO = 1 << 16
+TIMESTAMP_MODULO = 1 << 32
+
+FRAME_DURATIONS_MS = (2.5, 5, 10, 20)  # Frame lengths a session may negotiate
+
+FLAG_SILENCE = 0x01  # Payload is a silence marker, not audio
+SILENCE_END = struct.Struct('<H')
+OPUS_DTX_BYTES = 2  # libopus DTX frames are 1-2 bytes and carry no audio
+
+Frame = namedtuple('Frame', ['seq', 'timestamp', 'flags', 'payload'])
+
+
+class ProtocolError(ValueError):
+    """Raised when a message does not follow the AudioLink wire format."""
+
+
+def pack_frame(seq, timestamp, payload, flags=0):
+    """Prefix an encoded frame with the AudioLink header."""
+    return HEADER.pack(
+        PROTOCOL_VERSION,
+        flags,
+        seq % SEQ_MODULO,
+        timestamp % TIMESTAMP_MODULO
+    ) + payload
+
+
+def parse_frame(message):
+    """
+    Split a binary message into its header fields and payload.
+
+    Returns:
+        Frame(seq, timestamp, flags, payload)
+    """
+    if len(message) < HEADER_SIZE:
+        raise ProtocolError(f"Message too short for frame header ({len(message)} bytes)")
+
+    version, flags, seq, timestamp = HEADER.unpack_from(message)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}")
+
+    return Frame(seq, timestamp, flags, message[HEADER_SIZE:])
+
+
+def pack_silence(seq, timestamp, end_seq):
+    """Silence marker: slots seq .. end_seq - 1 are silent."""
+    return pack_frame(seq, timestamp, SILENCE_END.pack(end_seq % SEQ_MODULO), FLAG_SILENCE)
+
+
+def silence_end(frame):
+    """Sequence number where the silence declared by a marker frame ends."""
+    if len(frame.payload) != SILENCE_END.size:
+        raise ProtocolError(f"Silence marker payload must be {SILENCE_END.size} bytes, got {len(frame.payload)}")
+    (end_seq,) = SILENCE_END.unpack(frame.payload)
+    return end_seq
+
+
+def seq_delta(seq, reference):
+    """Signed distance from reference to seq, accounting for wrap-around."""
+    delta = (seq - reference) % SEQ_MODULO
+    if delta >= SEQ_MODULO // 2:
+        delta -= SEQ_MODULO
+    return delta
+
+
+def pack_datagram(key, frame_message):
+    """Prefix a packed frame with the session key for UDP transport."""
+    return DATAGRAM_KEY.pack(key) + frame_message
+
+
+def parse_datagram(datagram):
+    """
+    Split a UDP datagram into its session key and frame.
+
+    Returns:
+        (key, Frame)
+    """
+    if len(datagram) < DATAGRAM_KEY_SIZE:
+        raise ProtocolError(f"Datagram too short for session key ({len(datagram)} bytes)")
+    (key,) = DATAGRAM_KEY.unpack_from(datagram)
+    return key, parse_frame(datagram[DATAGRAM_KEY_SIZE:])
+
+
+def encode_control(msg_type, **fields):
+    """Build a JSON control message for a WebSocket text frame."""
+    return json.dumps({'type': msg_type, **fields}, separators=(',', ':'))
+
+
+
+def decode_control(text):
+    """
+    Parse a JSON control message from a WebSocket text frame.
+
+    Returns:
+        dict with at least a string 'type'
+    """
+    try:
+        message = json.loads(text)
+    except ValueError as e:
+        raise ProtocolError(f"Invalid control message: {e}") from e
+    if not isinstance(message, dict) or not isinstance(message.get('type'), str):
+        raise ProtocolError("Control message must be a JSON object with a 'type'")
+    return message
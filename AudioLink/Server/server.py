@@ -1,10 +1,31 @@
+import time
+STARTED = time.perf_counter()  # Time-to-ready is measured from here
+
 import asyncio
+import importlib
+import importlib.util
 import websockets
-import pyaudio
+import os
 import sys
 import logging
+import secrets
 import struct
-from JitterBuffer import JitterBuffer
+from Session import Session
+from Mixer import Mixer
+from protocol import parse_frame, encode_control, decode_control, ProtocolError
+from UdpTransport import UdpTransport
+from DecodeWorker import DecodeWorker
+from Metrics import ServerMetrics
+from Sinks import SinkError, SINK_TYPES, create_sink
+from SampleFormat import SAMPLE_FORMATS
+from AudioProcess import AudioProcessSink
+from DeviceCache import DeviceCache
+from Recorder import create_recorder
+from Feedback import FeedbackReporter
+from DspChain import DEFAULT_STAGES, STAGES
+from Relay import Relay, SUBSCRIBE_PATH
+from StreamConfig import StreamConfig, CODECS, DEFAULT_OPUS_BITRATE, parse_gain
+from Calibration import Calibrator, format_report
 
 # Configure Logging
 logging.basicConfig(
@@ -14,156 +35,235 @@ logging.basicConfig(
 logger = logging.getLogger("AudioServer")
 
 # Audio Configuration
-FORMAT = pyaudio.paInt16
 CHANNELS = 1
 RATE = 48000
 CHUNK = 960  # 20ms at 48kHz (samples)
 FRAME_SIZE = 960  # Opus frame size for 20ms at 48kHz
 
 class AudioServer:
-    def __init__(self, use_opus=True):
+    def __init__(self, use_opus=True, target_buffer_ms=40, adaptive=True, drift_correction=True, max_clients=16,
+                 udp_port=None, queue_size=256, overload_policy='drop-oldest', metrics_port=None,
+                 metrics_log_interval=10.0, sink=None, record_dir=None, dsp_stages=None, highpass_hz=80.0,
+                 relay=False, relay_queue=64, period_size=CHUNK, resume_grace=10.0, feedback_interval=1.0):
         """
         Args:
-            use_opus: If True, decode Opus. If False, expect raw PCM (backward compatibility).
+            use_opus: Default codec for clients that skip the handshake: Opus, or raw PCM if False
+            target_buffer_ms: JitterBuffer target depth in milliseconds (initial target if adaptive)
+            adaptive: Let the JitterBuffer follow the measured network jitter
+            drift_correction: Resample to compensate phone/PC clock drift
+            max_clients: Maximum number of simultaneous streaming clients
+            udp_port: If set, also accept audio as UDP datagrams on this port
+                      (the WebSocket then only carries control messages)
+            queue_size: Frames that may wait for the decode worker
+            overload_policy: 'drop-oldest' or 'backpressure' when that queue is full
+            metrics_port: If set, serve Prometheus metrics on http://127.0.0.1:<port>/metrics
+            metrics_log_interval: Seconds between JSON metrics log lines (0 disables)
+            sink: Output backend (Sinks.AudioSink); defaults to a PyAudio callback stream
+                  on the virtual cable
+            record_dir: If set, record every session as received (Ogg Opus, or WAV in PCM mode)
+            dsp_stages: DSP stages run on every decoded frame, e.g. ('highpass', 'gate', 'agc', 'limiter')
+            highpass_hz: High-pass cutoff for the 'highpass' stage
+            relay: Let local listeners subscribe to the received frames at /subscribe
+            relay_queue: Frames buffered per subscriber before the oldest are dropped
+            period_size: Output period in samples (the sink's buffer size), independent of the frame size
+            resume_grace: Seconds a session outlives a dropped connection, waiting for the
+                          client to resume it with its token (0 disables resuming)
+            feedback_interval: Seconds between receiver reports to clients that ask for them
+                               in the handshake (0 disables them)
         """
-        self.p = pyaudio.PyAudio()
-        self.stream = None
-        self.connected = False
+        self.record_dir = record_dir
+        if record_dir:
+            os.makedirs(record_dir, exist_ok=True)
+        self.period_size = period_size
+        self.sink = sink if sink is not None else create_sink('callback', RATE, CHANNELS, period_size,
+                                                              cache=DeviceCache())
+        self.output_lock = asyncio.Lock()  # The first phones to connect open the output once
         self.use_opus = use_opus
+        self.max_clients = max_clients
+        # Format of clients that start streaming without a handshake
+        self.default_config = StreamConfig(
+            'opus' if use_opus else 'pcm', RATE, CHANNELS, FRAME_SIZE * 1000 // RATE,
+            bitrate=DEFAULT_OPUS_BITRATE if use_opus else None, fec=use_opus
+        )
+        self.session_options = {
+            'period_size': period_size,
+            'target_buffer_ms': target_buffer_ms,
+            'adaptive': adaptive,
+            'drift_correction': drift_correction,
+            'dsp_stages': dsp_stages,
+            'highpass_hz': highpass_hz
+        }
+        self.sessions = {}  # session_id -> Session
+        self.connections = {}  # session_id -> WebSocket currently feeding the session
+        self.tokens = {}  # Resume token -> Session
+        self.resume_grace = resume_grace
+        self.closing = False  # Set while the server shuts down: dropped connections are not held
+        self.feedback_interval = feedback_interval
+        self.background_tasks = set()
+        self.active_sessions = ()  # Immutable snapshot read by the audio callback
+        self.silence = b''
+        self.output_tap = None  # Optional callable(data) seeing every rendered block (calibration)
+        self.next_session_id = 1
+        self.mixer = Mixer(period_size, max_clients)
+        self.decode_worker = DecodeWorker(
+            lambda: self.active_sessions,
+            frame_duration_ms=period_size * 1000 / RATE,
+            queue_size=queue_size,
+            policy=overload_policy
+        )
+        self.metrics = ServerMetrics()
+        self.sink.on_recovery = self.metrics.output_recovery.observe
+        self.metrics_port = metrics_port
+        self.metrics_log_interval = metrics_log_interval
+        self.relay = Relay(relay_queue) if relay else None
+        self.udp_port = udp_port
+        self.udp = UdpTransport(
+            self.decode_worker.submit,
+            self.relay.publish if self.relay else None
+        ) if udp_port else None
         
-        # Initialize Opus Decoder
+        # Only check that opuslib is installed here; importing it (and loading
+        # the Opus DLL) waits until the first Opus session
+        self.opus_loaded = False
+        opus_installed = importlib.util.find_spec('opuslib') is not None
+        self.codecs = tuple(codec for codec in CODECS if codec != 'opus' or opus_installed)
         if self.use_opus:
-            try:
-                import opuslib
-                self.opus_decoder = opuslib.Decoder(RATE, CHANNELS)
-                logger.info("Opus decoder initialized")
-            except ImportError:
+            if not opus_installed:
                 logger.error("Opus library (opuslib) not installed. Please install with:")
                 logger.error("  pip install opuslib")
                 logger.error("Then install Opus library:")
                 logger.error("  conda install -c conda-forge opus")
                 logger.error("Or run in PCM mode: python server.py --pcm")
                 sys.exit(1)
-            except Exception as e:
-                logger.error(f"Failed to initialize Opus decoder: {e}")
-                logger.error("This usually means the Opus DLL is not found.")
-                logger.error("Install with: conda install -c conda-forge opus")
-                logger.error("Or run in PCM mode: python server.py --pcm")
-                sys.exit(1)
+            logger.info("Opus mode (PLC/FEC concealment enabled)")
         else:
-            self.opus_decoder = None
             logger.info("Running in PCM mode (no Opus)")
-        
-        # Initialize Jitter Buffer
-        self.jitter_buffer = JitterBuffer(target_buffer_ms=40, frame_duration_ms=20)
-        self.playback_task = None
-        self.output_device_index = self._find_virtual_cable()
-
-    def _find_virtual_cable(self):
-        """Finds the index of VB-Audio Virtual Cable (CABLE Input)."""
-        count = self.p.get_device_count()
-        candidates = ["CABLE Input", "VB-Audio", "Virtual Audio Cable"]
-        found_devices = []
-
-        for i in range(count):
-            try:
-                info = self.p.get_device_info_by_index(i)
-                name = info.get("name", "")
-                if any(c in name for c in candidates) and info.get("maxOutputChannels") > 0:
-                    # found a candidate
-                    host_api_index = info.get("hostApi")
-                    try:
-                        host_api_info = self.p.get_host_api_info_by_index(host_api_index)
-                        host_api_name = host_api_info.get("name", "Unknown")
-                    except:
-                        host_api_name = "Unknown"
-                    
-                    found_devices.append({
-                        "index": i,
-                        "name": name,
-                        "host_api": host_api_name,
-                        "host_api_index": host_api_index
-                    })
-            except Exception:
-                continue
-        
-        if not found_devices:
-            logger.warning("Virtual Audio Cable NOT found! Using default speakers.")
-            logger.warning("CAUTION: This may cause an audio feedback loop if microphone is active.")
-            return None
-            
-        # Prioritize WASAPI
-        # WASAPI usually provides better latency and native 48kHz support which Discord prefers
-        best_device = None
-        for dev in found_devices:
-            if "WASAPI" in dev["host_api"]:
-                best_device = dev
-                break
-        
-        if not best_device:
-            # Fallback to MME or whatever was found first
-            best_device = found_devices[0]
-            
-        logger.info(f"Selected Audio Device: {best_device['name']}")
-        logger.info(f"  > Index: {best_device['index']}")
-        logger.info(f"  > API:   {best_device['host_api']}")
-        
-        if "WASAPI" not in best_device['host_api']:
-            logger.warning("NOTE: WASAPI driver not found for Virtual Cable.") 
-            logger.warning("If audio sounds bad in Discord, try installing VB-Cable correctly or check audio settings.")
 
-        return best_device['index']
-
-    def start_audio_stream(self):
-        """Initializes the PyAudio output stream."""
+    async def load_opus(self):
+        """Import the Opus decoder on first use, off the event loop. Returns False if it cannot load."""
+        if self.opus_loaded:
+            return True
+        start = time.perf_counter()
         try:
-            self.stream = self.p.open(
-                format=FORMAT,
-                channels=CHANNELS,
-                rate=RATE,
-                output=True,
-                output_device_index=self.output_device_index,
-                frames_per_buffer=CHUNK,
-                stream_callback=self._audio_callback
-            )
-            device_name = "Default Output"
-            if self.output_device_index is not None:
-                try:
-                    info = self.p.get_device_info_by_index(self.output_device_index)
-                    device_name = info.get("name")
-                except:
-                    device_name = f"Index {self.output_device_index}"
-            
-            logger.info(f"Audio Output Stream Started on: {device_name}")
+            opuslib = await asyncio.to_thread(importlib.import_module, 'opuslib')
+            opuslib.Decoder(RATE, CHANNELS)
         except Exception as e:
-            logger.error(f"Failed to start audio stream: {e}")
-            sys.exit(1)
+            logger.error(f"Failed to initialize Opus decoder: {e}")
+            logger.error("This usually means the Opus DLL is not found.")
+            logger.error("Install with: conda install -c conda-forge opus")
+            logger.error("Or run in PCM mode: python server.py --pcm")
+            return False
+        self.opus_loaded = True
+        logger.info(f"Opus decoder loaded in {(time.perf_counter() - start) * 1000:.0f} ms")
+        return True
+
+    async def ensure_output(self):
+        """Open the output sink if it is not running yet (PortAudio setup runs off the event loop)."""
+        async with self.output_lock:
+            if not self.sink.running:
+                start = time.perf_counter()
+                await asyncio.to_thread(self.start_audio_stream)
+                self.metrics.output_open_s = time.perf_counter() - start
+                logger.info(f"Audio output ready in {self.metrics.output_open_s * 1000:.0f} ms")
+
 
-    def _audio_callback(self, in_data, frame_count, time_info, status):
+    def start_audio_stream(self):
+        """Start the output sink. Raises SinkError if it cannot be opened."""
+        self.sink.start(self.render)
+
+    def render(self, frame_count):
         """
-        PyAudio callback function. Called by PyAudio when it needs more audio data.
-        This runs in a separate thread managed by PortAudio.
+        Produce frame_count samples of output as int16 PCM. Called by the
+        sink on its own thread (the PortAudio callback thread for the default
+        sink), with whatever block size the host API asks for. Takes exactly
+        frame_count decoded samples from every active session and mixes them.
+
+        Returns a byte memoryview of the mixer's reused output buffer (valid
+        until the next call), so rendering allocates no sample memory.
         """
-        # Pop frame from jitter buffer
-        frame = self.jitter_buffer.pop()
+        start = time.perf_counter()
+        for session in self.active_sessions:
+            samples = session.read_output(frame_count)
+            if samples is not None:
+                self.mixer.add(samples, session.gain)
+
+        frame = self.mixer.mix()
         
         if frame is None:
-            # Initial buffering or no data: return silence
-            return (b'\x00' * (frame_count * 2), pyaudio.paContinue)
-        
-        # frame is already decoded PCM bytes
-        return (frame, pyaudio.paContinue)
+            # Initial buffering or no clients: return silence
+            if len(self.silence) != frame_count * 2:
+                self.silence = bytes(frame_count * 2)
+            data = self.silence
+        else:
+            data = memoryview(frame).cast('B')
+
+        if self.output_tap is not None:
+            self.output_tap(data)
+        self.metrics.callback_duration.observe(time.perf_counter() - start)
+        return data
 
     def stop_audio_stream(self):
-        if self.stream:
-            self.stream.stop_stream()
-            self.stream.close()
-        self.p.terminate()
+        self.decode_worker.stop()
+        self.sink.stop()
+        # The writer threads are daemons: finish any file the event loop did not get to
+        for session in self.sessions.values():
+            if session.recorder:
+                session.recorder.close()
         logger.info("Audio Output Stream Stopped")
 
+    async def negotiate(self, websocket):
+        """
+        Agree on the session's stream format.
+
+        A client that opens with a text frame must send a hello; one that
+        starts with audio gets the default format. A hello carrying the
+        resume token of a session still held by the server gets that
+        session back, in its original format.
+
+        Returns:
+            (StreamConfig, first audio message or None, Session to resume or None),
+            or (None, None, None) if the connection was closed
+        """
+        try:
+            first = await websocket.recv()
+        except websockets.exceptions.ConnectionClosed:
+            return None, None, None
+        if isinstance(first, bytes):
+            return self.default_config, first, None
+
+        try:
+            hello = decode_control(first)
+            token = hello.get('resume')
+            if token is not None:
+                session = self.tokens.get(token) if isinstance(token, str) else None
+                if session is not None:
+                    return session.config, None, session
+                logger.info(f"{websocket.remote_address[0]}: resume token unknown or expired, starting a new session")
+            offered = hello.get('codec', self.default_config.codec)
+            if 'opus' in self.codecs and 'opus' in (offered if isinstance(offered, list) else [offered]):
+                if not await self.load_opus():
+                    # opuslib is installed but the Opus library cannot be loaded: PCM only
+                    self.codecs = tuple(codec for codec in self.codecs if codec != 'opus')
+            config = StreamConfig.negotiate(hello, self.default_config, self.codecs, (RATE,))
+            config.feedback = config.feedback and self.feedback_interval > 0
+        except ProtocolError as e:
+            logger.warning(f"Rejecting {websocket.remote_address[0]}: {e}")
+            await websocket.send(encode_control('error', reason=str(e)))
+            await websocket.close(1003, "Unsupported stream format")
+            return None, None, None
+        return config, None, None
+
     async def audio_handler(self, websocket):
         """Handles incoming WebSocket connections and audio data."""
         remote_ip = websocket.remote_address[0]
+
+        if websocket.path.startswith(SUBSCRIBE_PATH):
+            if self.relay:
+                await self.relay.serve(websocket, websocket.path, self.sessions)
+            else:
+                await websocket.close(1008, "Relay disabled (start the server with --relay)")
+            return
+
         logger.info(f"Client connected from {remote_ip}")
         
         # Log connection quality hints
@@ -174,86 +274,318 @@ class AudioServer:
         logger.info("✓ Stay close to your router for optimal signal")
         logger.info("=" * 60)
         
-        self.connected = True
+        self.metrics.on_connect(remote_ip)
 
-        if not self.stream:
-            self.start_audio_stream()
+        config, first_frame, session = await self.negotiate(websocket)
+        if config is None:
+            return
 
-        # Statistics reporting
-        stats_counter = 0
+        resumed = session is not None
+        if resumed:
+            self.resume_session(session, websocket)
+        else:
+            # Only a client that sent a hello hears its resume token
+            session = await self.start_session(websocket, config, resumable=first_frame is None)
+            if session is None:
+                return
 
         try:
+            if first_frame is None:
+                await websocket.send(config.to_message())
+                if resumed:
+                    # Where the stream stopped arriving; the client may resend what follows
+                    highest = session.jitter_buffer.highest_seq
+                    await websocket.send(encode_control(
+                        'resumed', session=session.session_id,
+                        last_seq=highest & 0xFFFF if highest is not None else None
+                    ))
+                elif session.token:
+                    await websocket.send(encode_control('token', session=session.session_id, token=session.token,
+                                                        grace_s=self.resume_grace))
+            if self.udp:
+                key = session.udp_key if session.udp_key is not None else self.udp.register(session)
+                await websocket.send(encode_control('udp', port=self.udp_port, key=key))
+                logger.info(f"Session {session}: offered UDP audio on port {self.udp_port}")
+
+            if first_frame is not None:
+                await self.handle_frame(session, first_frame)
             async for message in websocket:
                 if isinstance(message, bytes):
-                    # Decode audio
-                    if self.use_opus:
-                        try:
-                            # Opus frame -> PCM
-                            pcm_data = self.opus_decoder.decode(message, FRAME_SIZE)
-                        except opuslib.OpusError as e:
-                            logger.warning(f"Opus decode error: {e}")
-                            continue
-                    else:
-                        # Raw PCM
-                        pcm_data = message
-                    
-                    # Push to jitter buffer
-                    self.jitter_buffer.push(pcm_data)
-                    
-                    # Log statistics every 100 packets (~2 seconds)
-                    stats_counter += 1
-                    if stats_counter % 100 == 0:
-                        stats = self.jitter_buffer.get_stats()
-                        logger.info(
-                            f"Stats: Depth={stats['current_depth']:.1f} "
-                            f"Avg={stats['avg_depth']:.1f} "
-                            f"Underruns={stats['underruns']} "
-                            f"Overruns={stats['overruns']}"
-                        )
+                    await self.handle_frame(session, message)
                 else:
-                    logger.warning(f"Received non-binary message: {message}")
+                    self.handle_control(session, message)
 
         except websockets.exceptions.ConnectionClosed:
             logger.info(f"Connection closed by {remote_ip}")
         except Exception as e:
             logger.error(f"Error in connection handler: {e}")
         finally:
-            self.connected = False
-            self.jitter_buffer.reset()
-            logger.info("Client disconnected")
+            # A session resumed on a newer connection no longer belongs to this one
+            if self.connections.get(session.session_id) is websocket:
+                del self.connections[session.session_id]
+                # A close code of 1000 means the phone stopped on purpose; while the
+                # server shuts down it closes every connection itself (1001)
+                if session.token and websocket.close_code != 1000 and not self.closing:
+                    self.park_session(session)
+                else:
+                    await self.end_session(session)
+
+    async def start_session(self, websocket, config, resumable=False):
+        """
+        Create a session for a new connection. Returns None if it was refused.
+        Only resumable sessions get a token and are held when the connection drops.
+        """
+        remote_ip = websocket.remote_address[0]
+        if len(self.sessions) >= self.max_clients:
+            logger.warning(f"Rejecting {remote_ip}: {self.max_clients} clients already connected")
+            await websocket.close(1013, "Server full")
+            return None
+        if config.use_opus and not await self.load_opus():
+            await websocket.close(1011, "Opus decoder unavailable")
+            return None
+
+        session = Session(
+            self.next_session_id, remote_ip, use_opus=config.use_opus, rate=config.rate,
+            channels=config.channels, frame_size=config.frame_size, sample_format=config.sample_format,
+            gain=config.gain, **self.session_options
+        )
+        session.config = config
+        if config.feedback:
+            session.feedback = FeedbackReporter(config, self.feedback_interval)
+        self.next_session_id += 1
+        self.sessions[session.session_id] = session
+        self.active_sessions = tuple(self.sessions.values())
+        logger.info(f"Session {session} started: {config} ({len(self.sessions)} active)")
+
+        try:
+            await self.ensure_output()
+        except SinkError as e:
+            logger.error(str(e))
+            self.sessions.pop(session.session_id, None)
+            self.active_sessions = tuple(self.sessions.values())
+            await websocket.close(1011, "Audio output unavailable")
+            return None
+
+        if resumable and self.resume_grace > 0:
+            session.token = secrets.token_urlsafe(16)
+            self.tokens[session.token] = session
+        self.connections[session.session_id] = websocket
+        if self.record_dir:
+            session.recorder = create_recorder(self.record_dir, session, session.use_opus, session.rate,
+                                               session.channels, config.sample_format)
+        if self.relay:
+            self.relay.session_event(session, 'start')
+        return session
+
+    def park_session(self, session):
+        """
+        Hold a session whose connection dropped for resume_grace seconds.
+
+        It stays in the mix: the JitterBuffer underruns and conceals the
+        gap in real time, so when the phone comes back its frames continue
+        the same sequence, slots whose time has passed are skipped rather
+        than concealed twice, and playout resumes at the depth it had.
+        """
+        session.parked_at = time.monotonic()
+        session.expiry = asyncio.create_task(self.expire_session(session))
+        logger.info(f"Session {session} lost its connection, holding it {self.resume_grace:g} s for a resume")
+
+    async def expire_session(self, session):
+        await asyncio.sleep(self.resume_grace)
+        if session.parked_at is not None:
+            logger.info(f"Session {session} was not resumed within {self.resume_grace:g} s")
+            await self.end_session(session)
+
+    def resume_session(self, session, websocket):
+        """Attach a new connection to a held (or still connected) session."""
+        previous = self.connections.get(session.session_id)
+        self.connections[session.session_id] = websocket
+        if previous is not None:
+            # The old connection has not noticed it is dead yet
+            task = asyncio.create_task(previous.close(1000, "Resumed on a new connection"))
+            self.background_tasks.add(task)
+            task.add_done_callback(self.background_tasks.discard)
+        if session.parked_at is not None:
+            gap = time.monotonic() - session.parked_at
+            session.parked_at = None
+            session.expiry.cancel()
+        else:
+            gap = 0.0
+        self.metrics.resume_gap.observe(gap)
+        session.jitter_buffer.resume()
+        if session.feedback:
+            # The gap was concealed on purpose; it is not the link's loss
+            session.feedback.reset()
+        # The phone may come back on another address (WiFi to mobile data)
+        session.remote = websocket.remote_address[0]
+        logger.info(f"Session {session} resumed after {gap * 1000:.0f} ms")
+
+    async def end_session(self, session):
+        """Tear a session down for good."""
+        if self.udp:
+            self.udp.unregister(session)
+        self.sessions.pop(session.session_id, None)
+        self.active_sessions = tuple(self.sessions.values())
+        self.tokens.pop(session.token, None)
+        if self.relay:
+            self.relay.session_event(session, 'end')
+        if session.recorder:
+            # Finishing the file may wait on the disk; keep that off the event loop
+            await asyncio.to_thread(session.recorder.close)
+        logger.info(f"Client disconnected: session {session} ended ({len(self.sessions)} active)")
+
+    def handle_control(self, session, message):
+        """
+        Apply a control message sent during the stream. Clients may change
+        their gain in the mix at any time: {"type": "gain", "gain": 0.5}
+        """
+        try:
+            control = decode_control(message)
+            if control['type'] != 'gain':
+                raise ProtocolError(f"Unexpected control message '{control['type']}'")
+            # The audio callback reads session.gain; a float store is atomic
+            session.gain = parse_gain(control.get('gain'))
+        except ProtocolError as e:
+            logger.warning(f"Session {session}: {e}")
+            return
+        logger.info(f"Session {session}: gain set to {session.gain:g}")
+
+    async def handle_frame(self, session, message):
+        """Parse one binary WebSocket message and queue it for decoding."""
+        try:
+            frame = parse_frame(message)
+        except ProtocolError as e:
+            logger.warning(f"Dropping malformed frame: {e}")
+            return
+
+        session.metrics.on_frame(len(message))
+        if self.relay:
+            self.relay.publish(session, message)
+
+        # Hand over to the decode worker (reordered by sequence number there)
+        await self.decode_worker.submit_async(session, frame)
+
+    async def send_feedback(self):
+        """Send every session that asked for them a receiver report, each feedback_interval."""
+        while True:
+            await asyncio.sleep(self.feedback_interval)
+            for session_id, websocket in list(self.connections.items()):
+                session = self.sessions.get(session_id)
+                if session is None or session.feedback is None:
+                    continue
+                message = session.feedback.report(session.get_stats())
+                if message is None:
+                    continue
+                recommendation = session.feedback.changed()
+                if recommendation:
+                    logger.info(f"Session {session}: recommending {recommendation['bitrate'] // 1000} kbit/s, "
+                                f"FEC {'on' if recommendation['fec'] else 'off'}, "
+                                f"{recommendation['packet_loss_perc']}% expected loss")
+                try:
+                    await websocket.send(message)
+                except websockets.exceptions.ConnectionClosed:
+                    pass
+
+    def _metrics_counters(self):
+        counters = {
+            'decode_queue_dropped': self.decode_worker.stats['frames_dropped'],
+            'playout_errors': self.decode_worker.stats['errors']
+        }
+        if self.relay:
+            counters['relay_frames_dropped'] = self.relay.dropped()
+        counters.update(self.sink.counters())
+        if self.udp:
+            counters.update((f'udp_{name}', value) for name, value in self.udp.stats.items())
+        return counters
 
     async def start_server(self, host="0.0.0.0", port=8765):
         logger.info(f"Starting WebSocket server on {host}:{port}")
         logger.info("Optimized for WiFi 5GHz - Low latency mode enabled")
+
+        self.decode_worker.start()
+
+        # Keep references so the background tasks are not garbage collected
+        self.metrics_tasks = [asyncio.create_task(self.metrics.monitor_loop_lag())]
+        if self.metrics_log_interval:
+            self.metrics_tasks.append(asyncio.create_task(
+                self.metrics.log_periodically(lambda: self.active_sessions, self.metrics_log_interval)))
+        if self.feedback_interval:
+            self.metrics_tasks.append(asyncio.create_task(self.send_feedback()))
+        if self.metrics_port:
+            await self.metrics.serve(lambda: self.active_sessions, self._metrics_counters, port=self.metrics_port)
+
+        if self.udp:
+            loop = asyncio.get_running_loop()
+            await loop.create_datagram_endpoint(lambda: self.udp, local_addr=(host, self.udp_port))
+            logger.info(f"UDP audio transport listening on {host}:{self.udp_port}")
         
-        # Create server with optimizations for low latency
-        async with websockets.serve(
-            self.audio_handler, 
-            host, 
-            port,
-            # Optimize for low latency on WiFi 5GHz
-            compression=None,  # Disable compression (audio already compressed with Opus)
-            max_size=None,     # No message size limit
-            ping_interval=5,   # Keep connection alive
-            ping_timeout=10,   # Detect disconnections quickly
-            close_timeout=5    # Fast cleanup on disconnect
-        ) as server:
-            # Apply TCP optimizations to all connections
-            for websocket in server.websockets:
-                try:
-                    # Enable TCP_NODELAY (disable Nagle's algorithm) for minimum latency
-                    sock = websocket.transport.get_extra_info('socket')
-                    if sock:
-                        import socket
-                        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-                        # Set send/receive buffer sizes for optimal WiFi 5GHz performance
-                        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 65536)
-                        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 65536)
-                        logger.info("TCP optimizations applied (TCP_NODELAY enabled)")
-                except Exception as e:
-                    logger.warning(f"Could not apply TCP optimizations: {e}")
+        try:
+            # Create server with optimizations for low latency
+            async with websockets.serve(
+                self.audio_handler, 
+                host, 
+                port,
+                # Optimize for low latency on WiFi 5GHz
+                compression=None,  # Disable compression (audio already compressed with Opus)
+                max_size=None,     # No message size limit
+                ping_interval=5,   # Keep connection alive
+                ping_timeout=10,   # Detect disconnections quickly
+                close_timeout=5    # Fast cleanup on disconnect
+            ) as server:
+                self.metrics.ready_s = time.perf_counter() - STARTED
+                logger.info(f"Ready for connections {self.metrics.ready_s * 1000:.0f} ms after launch")
+
+                # Apply TCP optimizations to all connections
+                for websocket in server.websockets:
+                    try:
+                        # Enable TCP_NODELAY (disable Nagle's algorithm) for minimum latency
+                        sock = websocket.transport.get_extra_info('socket')
+                        if sock:
+                            import socket
+                            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                            # Set send/receive buffer sizes for optimal WiFi 5GHz performance
+                            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 65536)
+                            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 65536)
+                            logger.info("TCP optimizations applied (TCP_NODELAY enabled)")
+                    except Exception as e:
+                        logger.warning(f"Could not apply TCP optimizations: {e}")
             
-            await asyncio.Future()  # run forever
+                try:
+                    await asyncio.Future()  # run forever
+                finally:
+                    # Leaving this block closes every connection: end those sessions instead of holding them
+                    self.closing = True
+        finally:
+            await self.close_sessions()
+
+    async def close_sessions(self):
+        """End every session still held, including those waiting to be resumed."""
+        self.closing = True
+        for session in list(self.sessions.values()):
+            if session.expiry is not None:
+                session.expiry.cancel()
+            await self.end_session(session)
+
+    async def calibrate(self, host="0.0.0.0", port=8765, capture_device=None, chirps=5):
+        """
+        Serve as usual while a Calibrator measures the playout delay; stop afterwards.
+
+        Args:
+            capture_device: Input device (index or name) hearing the output, None to look
+                            for CABLE Output, False to measure up to the render only
+            chirps: Chirps sent
+        Returns:
+            The calibration report (see Calibration.format_report)
+        """
+        server_task = asyncio.create_task(self.start_server(host=host, port=port))
+        while self.metrics.ready_s is None:
+            if server_task.done():
+                server_task.result()  # Startup failed: raise its error
+            await asyncio.sleep(0.05)
+        try:
+            return await Calibrator(self, port, RATE, capture_device, chirps).run()
+        finally:
+            server_task.cancel()
 
 if __name__ == "__main__":
     import argparse
@@ -275,9 +607,61 @@ if __name__ == "__main__":
     parser.add_argument('--pcm', action='store_true', help='Use PCM mode instead of Opus')
     parser.add_argument('--list-devices', action='store_true', help='List all available audio output devices and exit')
     parser.add_argument('--device', type=int, help='Manually select audio device index')
+    parser.add_argument('--rescan-devices', action='store_true',
+                        help='Ignore the cached output device and scan for the virtual cable again')
+    parser.add_argument('--period-size', type=int, default=CHUNK,
+                        help=f'Output period in samples, independent of the network frame size; '
+                             f'128-256 for low latency on WASAPI (default: {CHUNK})')
+    parser.add_argument('--buffer-ms', type=int, default=40, help='JitterBuffer target depth in ms (default: 40)')
+    parser.add_argument('--fixed-buffer', action='store_true', help='Disable adaptive playout delay and keep --buffer-ms fixed')
+    parser.add_argument('--no-drift-correction', action='store_true', help='Disable phone/PC clock drift compensation')
+    parser.add_argument('--max-clients', type=int, default=16, help='Maximum simultaneous phones mixed into the output (default: 16)')
+    parser.add_argument('--udp', action='store_true', help='Receive audio over UDP datagrams (WebSocket carries control only)')
+    parser.add_argument('--udp-port', type=int, default=8766, help='UDP audio port (default: 8766)')
+    parser.add_argument('--queue-size', type=int, default=256, help='Frames that may wait for the decode worker (default: 256)')
+    parser.add_argument('--overload-policy', choices=DecodeWorker.POLICIES, default='drop-oldest',
+                        help='What to do when the decode queue is full (default: drop-oldest)')
+    parser.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics on http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--metrics-log-interval', type=float, default=10.0,
+                        help='Seconds between compact JSON metrics log lines, 0 to disable (default: 10)')
+    parser.add_argument('--sink', choices=SINK_TYPES, default='callback',
+                        help='Audio output backend: PyAudio callback/blocking stream, null (headless) or file (default: callback)')
+    parser.add_argument('--audio-process', action='store_true',
+                        help='Play audio from a separate process fed through shared memory, '
+                             'isolated from network and logging load')
+    parser.add_argument('--audio-process-lead-ms', type=float, default=20,
+                        help='Audio rendered ahead for --audio-process; covers stalls in the server (default: 20)')
+    parser.add_argument('--resume-grace', type=float, default=10.0,
+                        help='Seconds a dropped phone may take to reconnect and resume its session, 0 to disable (default: 10)')
+    parser.add_argument('--feedback-interval', type=float, default=1.0,
+                        help='Seconds between loss/jitter reports with bitrate and FEC advice to phones '
+                             'that ask for them, 0 to disable (default: 1)')
+    parser.add_argument('--record', metavar='DIR', help='Record every session into DIR (Ogg Opus, or WAV with --pcm)')
+    parser.add_argument('--dsp', nargs='?', const=','.join(DEFAULT_STAGES), metavar='STAGES',
+                        help=f"Clean up each phone's audio; optional comma list of {', '.join(STAGES)} "
+                             f"(default when given: {','.join(DEFAULT_STAGES)})")
+    parser.add_argument('--highpass-hz', type=float, default=80.0, help='High-pass cutoff for --dsp (default: 80)')
+    parser.add_argument('--relay', action='store_true',
+                        help='Let local apps subscribe to the raw stream at ws://127.0.0.1:8765/subscribe[/<session>]')
+    parser.add_argument('--relay-queue', type=int, default=64,
+                        help='Frames buffered per subscriber before the oldest are dropped (default: 64)')
+    parser.add_argument('--output-format', choices=SAMPLE_FORMATS, default='int16',
+                        help="Output sample format; match the device's mix format (e.g. float32) to skip the OS "
+                             "conversion (default: int16)")
+    parser.add_argument('--output-channels', type=int, default=CHANNELS,
+                        help='Output channels, each carrying the mono mix (e.g. 2 for a stereo device; default: 1)')
+    parser.add_argument('--output-file', help='Output path for --sink file (.wav for WAV, anything else for raw PCM)')
+    parser.add_argument('--calibrate', action='store_true',
+                        help='Measure the real playout delay with test chirps, print a breakdown and '
+                             'suggested buffer settings, then exit (phones may stay connected)')
+    parser.add_argument('--calibrate-capture', metavar='DEVICE',
+                        help='Input device hearing the output for --calibrate, index or name '
+                             '(default: CABLE Output if present; "none" to stop at the server output)')
+    parser.add_argument('--calibrate-chirps', type=int, default=5, help='Chirps sent by --calibrate (default: 5)')
     args = parser.parse_args()
     
     if args.list_devices:
+        import pyaudio
         p = pyaudio.PyAudio()
         print("\nAvailable Audio Output Devices:")
         print(f"{'Index':<6} {'API':<20} {'Name'}")
@@ -306,20 +690,76 @@ if __name__ == "__main__":
     print(f" Connect your phone to WiFi and enter this IP:")
     print(f"\n      {local_ip}\n")
     print(f" Port: {port}")
+    if args.udp:
+        print(f" UDP audio port: {args.udp_port}")
     print("="*50 + "\n")
-    
-    server = AudioServer(use_opus=not args.pcm)
-    
+
     # Manual device override
     if args.device is not None:
-        server.output_device_index = args.device
         logger.info(f"Manually selected output device index: {args.device}")
 
+    if args.dsp:
+        unknown = [name for name in args.dsp.split(',') if name not in STAGES]
+        if unknown:
+            parser.error(f"Unknown DSP stage(s): {', '.join(unknown)}")
+
+    cache = None
+    if args.sink in ('callback', 'blocking') and args.device is None:
+        cache = DeviceCache()
+        if args.rescan_devices:
+            cache.clear()
+
+    try:
+        if args.audio_process:
+            sink = AudioProcessSink(args.sink, RATE, args.output_channels, args.period_size, device_index=args.device,
+                                    path=args.output_file, cache=cache, lead_ms=args.audio_process_lead_ms,
+                                    sample_format=args.output_format)
+        else:
+            sink = create_sink(args.sink, RATE, args.output_channels, args.period_size, device_index=args.device,
+                               path=args.output_file, cache=cache, sample_format=args.output_format)
+    except ValueError as e:
+        parser.error(str(e))
+
+    server = AudioServer(
+        use_opus=not args.pcm,
+        target_buffer_ms=args.buffer_ms,
+        adaptive=not args.fixed_buffer,
+        drift_correction=not args.no_drift_correction,
+        max_clients=args.max_clients,
+        udp_port=args.udp_port if args.udp else None,
+        queue_size=args.queue_size,
+        overload_policy=args.overload_policy,
+        metrics_port=args.metrics_port,
+        metrics_log_interval=args.metrics_log_interval,
+        sink=sink,
+        record_dir=args.record,
+        dsp_stages=args.dsp.split(',') if args.dsp else None,
+        highpass_hz=args.highpass_hz,
+        relay=args.relay,
+        relay_queue=args.relay_queue,
+        period_size=args.period_size,
+        resume_grace=args.resume_grace,
+        feedback_interval=args.feedback_interval
+    )
+
+    if args.calibrate:
+        capture = args.calibrate_capture
+        if capture is not None:
+            capture = False if capture.lower() == 'none' else int(capture) if capture.isdigit() else capture
+        elif args.sink not in ('callback', 'blocking'):
+            capture = False  # Nothing plays into the cable
+        try:
+            report = asyncio.run(server.calibrate(host="0.0.0.0", port=port, capture_device=capture,
+                                                  chirps=args.calibrate_chirps))
+        except (KeyboardInterrupt, RuntimeError, OSError) as e:
+            logger.error(f"Calibration failed: {e}" if str(e) else "Calibration interrupted")
+            report = None
+        server.stop_audio_stream()
+        if report:
+            print(format_report(report))
+        sys.exit(0 if report and report['chirps_found'] else 1)
+
     try:
-        # Check for PyAudio devices
-        info = server.p.get_host_api_info_by_index(0)
-        numdevices = info.get('deviceCount')
-        
         asyncio.run(server.start_server(host="0.0.0.0", port=port))
     except KeyboardInterrupt:
         logger.info("Server stopping...")
@@ -0,0 +1,111 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from Calibration import MIN_CORRELATION, Calibrator, Recording, chirp, find_delay
+
+RATE = 48000
+
+
+def test_find_delay_locates_a_chirp_in_noise():
+    rng = np.random.default_rng(7)
+    reference = chirp(RATE)
+    captured = rng.normal(0, 1000, RATE).astype(np.int16)
+    captured[12345:12345 + len(reference)] += reference // 2
+
+    lag, score = find_delay(reference, captured)
+
+    assert lag == 12345
+    assert 0.9 < score <= 1.0
+
+
+def test_find_delay_rejects_noise_and_short_captures():
+    rng = np.random.default_rng(7)
+    reference = chirp(RATE)
+
+    _, score = find_delay(reference, rng.normal(0, 1000, RATE).astype(np.int16))
+    assert score < MIN_CORRELATION
+    assert find_delay(reference, reference[:-1]) == (None, 0.0)
+
+
+def test_recording_locates_a_chirp_across_a_gap_between_blocks():
+    reference = chirp(RATE)
+    block = 480
+    recording = Recording(RATE, 2.0)
+    signal = np.zeros(RATE, dtype=np.int16)
+    signal[20 * block + 100:20 * block + 100 + len(reference)] = reference
+
+    # The callback missed 50 ms after block 10: offsets stay contiguous, times do not
+    for k in range(len(signal) // block):
+        start_time = 100.0 + k * block / RATE + (0.05 if k > 10 else 0.0)
+        recording.add(signal[k * block:(k + 1) * block], start_time)
+
+    found, score = recording.locate(reference, 100.0)
+
+    assert score > 0.99
+    assert abs(found - (100.0 + (20 * block + 100) / RATE + 0.05)) < 1e-9
+    # A search starting after the chirp does not find it
+    assert recording.locate(reference, 100.5)[0] is None
+
+
+def test_recording_stops_when_full():
+    recording = Recording(RATE, 0.01, max_blocks=2)
+
+    recording.add(np.ones(300, dtype=np.int16), 1.0)
+    recording.add(np.ones(300, dtype=np.int16), 1.1)
+    recording.add(np.ones(300, dtype=np.int16), 1.2)
+
+    assert recording.length == 480 and recording.blocks == 2
+
+
+def network(source='phone #1', frame_ms=20, jitter_ms=2.0, iat_p99_ms=25.0, lost=0, underruns=0):
+    return {'source': source, 'frame_ms': frame_ms, 'jitter_ms': jitter_ms, 'iat_p99_ms': iat_p99_ms,
+            'lost': lost, 'underruns': underruns, 'target_ms': 40}
+
+
+def suggest(networks, period_size=256, output_median=None, render=(100.0, 105.0)):
+    calibrator = Calibrator(SimpleNamespace(period_size=period_size), 0, RATE)
+    report = {
+        'frame_ms': 20,
+        'period_ms': period_size * 1000.0 / RATE,
+        'render_ms': {'median': render[0], 'min': render[0], 'max': render[1]},
+        'output_ms': {'median': output_median} if output_median is not None else None,
+        'networks': networks,
+        'suggestions': []
+    }
+    calibrator._suggest(report)
+    return report['suggestions']
+
+
+def test_steady_network_gets_a_fixed_buffer_rounded_up_to_whole_frames():
+    # One frame + 4 x 2 ms jitter = 28 ms, rounded up to two frames
+    assert suggest([network()]) == ["--buffer-ms 40 --fixed-buffer (arrivals are steady: p99 gap 25.0 ms)"]
+
+
+def test_worst_network_sets_an_adaptive_buffer_capped_at_100_ms():
+    suggestions = suggest([network(), network('phone #2', jitter_ms=15.0, iat_p99_ms=130.0, lost=3, underruns=2)])
+
+    assert suggestions == [
+        "--buffer-ms 100 (adaptive; measured jitter 15.0 ms)",
+        "Underruns during calibration: consider --udp, 5 GHz WiFi, or a larger --buffer-ms"
+    ]
+
+
+def test_loopback_underruns_and_output_device_hints():
+    loopback = network('local loopback; connect a phone to measure its network', underruns=5)
+
+    # Calibration's own stream underruns after it ends: not the network's fault
+    assert len(suggest([loopback])) == 1
+
+    # The output device holding more than three periods, and delay moving by more than a frame
+    suggestions = suggest([loopback], period_size=1024, output_median=80.0, render=(100.0, 130.0))
+    assert suggestions[1:] == [
+        "The output device holds several periods: try --period-size 256",
+        "Delay varied by more than a frame between chirps: the buffer adapted, "
+        "or the server is overloaded (see --audio-process)"
+    ]
+    assert len(suggest([loopback], period_size=256, output_median=80.0)) == 1
@@ -0,0 +1,109 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from ClockDrift import DriftCompensator, DriftEstimator, FractionalResampler
+from JitterBuffer import JitterBuffer
+
+FRAME_SIZE = 960
+
+
+def simulate(drift_ppm, seconds, seed=0):
+    """Run the estimator against a buffer whose depth moves by drift minus correction each frame."""
+    rng = np.random.default_rng(seed)
+    estimator = DriftEstimator()
+    depth = 2.0
+    depths = []
+    for _ in range(int(seconds / 0.02)):
+        depth += drift_ppm * 1e-6 - (1.0 - estimator.ratio)
+        # The buffer only holds whole frames; where in between it reads is down to timing
+        estimator.update(np.floor(depth + rng.random()))
+        depths.append(depth)
+    return estimator, depths
+
+
+def test_no_drift_keeps_the_ratio_at_exactly_one():
+    estimator, _ = simulate(0, 300)
+
+    assert estimator.baseline is not None
+    assert estimator.ratio == 1.0
+    assert estimator.drift_ppm == 0.0
+
+
+@pytest.mark.parametrize('drift_ppm', [200, -300, 800])
+def test_drift_is_learned_and_the_depth_held(drift_ppm):
+    estimator, depths = simulate(drift_ppm, 600)
+
+    assert (1.0 - estimator.ratio) * 1e6 == pytest.approx(drift_ppm, rel=0.1)
+    assert max(abs(d - 2.0) for d in depths) < 2.0
+    assert abs(depths[-1] - 2.0) < 0.5
+
+
+def test_depth_offset_from_the_target_is_not_drift():
+    estimator = DriftEstimator()
+    for _ in range(20000):
+        estimator.update(3.0)
+
+    assert estimator.ratio == 1.0
+
+
+def test_resampler_passes_samples_through_at_unity_ratio():
+    resampler = FractionalResampler()
+    block = np.arange(1, 101, dtype=np.int16)
+    resampler.process(block, 0.999)  # Leaves a fractional phase behind
+
+    out = resampler.process(block, 1.0).copy()
+    again = resampler.process(block, 1.0)
+
+    assert out[1:].tolist() == block[:-1].tolist()
+    assert again[0] == 100 and again[1:].tolist() == block[:-1].tolist()
+
+
+def test_resampler_output_length_follows_the_ratio():
+    resampler = FractionalResampler()
+    block = np.zeros(FRAME_SIZE, dtype=np.int16)
+
+    produced = sum(len(resampler.process(block, 0.999)) for _ in range(1000))
+
+    assert produced == pytest.approx(FRAME_SIZE * 1000 * 0.999, abs=1)
+
+
+def test_compensator_is_lossless_without_drift():
+    compensator = DriftCompensator(FRAME_SIZE, output_size=256)
+    rng = np.random.default_rng(1)
+    sent = rng.integers(-8000, 8000, FRAME_SIZE * 700).astype(np.int16)
+
+    received = []
+    for index in range(700):
+        compensator.feed(sent[index * FRAME_SIZE:(index + 1) * FRAME_SIZE].tobytes(), 2)
+        while compensator.available() >= 256:
+            received.append(compensator.read().copy())
+    received = np.concatenate(received)
+
+    assert compensator.estimator.ratio == 1.0
+    np.testing.assert_array_equal(received[1:], sent[:len(received) - 1])
+
+
+def test_compensator_holds_the_ratio_without_a_depth():
+    compensator = DriftCompensator(FRAME_SIZE)
+    compensator.estimator.ratio = 0.9995
+    updates = compensator.estimator.updates
+
+    compensator.feed(bytes(FRAME_SIZE * 2), None)
+
+    assert compensator.estimator.updates == updates
+    assert compensator.estimator.ratio == 0.9995
+
+
+def test_fill_level_counts_the_part_of_a_frame_captured_since_the_last_arrival():
+    buffer = JitterBuffer(target_buffer_ms=40, frame_duration_ms=20)
+    for seq in range(3):
+        buffer.push(b'frame', seq=seq, arrival_time=10.0 + seq * 0.02)
+
+    assert buffer.depth() == 3
+    assert buffer.fill_level(now=10.045) == pytest.approx(3.25)
+    assert buffer.fill_level(now=11.0) == 4.0  # A stalled sender counts one frame at most
@@ -0,0 +1,158 @@
+import os
+import sys
+import types
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from Concealment import OpusConcealer, PcmConcealer
+
+FRAME_SIZE = 480
+
+
+class FakeOpusError(Exception):
+    pass
+
+
+class FakeDecoder:
+    """Stands in for opuslib.Decoder: same attributes, canned PCM."""
+
+    def __init__(self, fail=False):
+        self.decoder_state = object()
+        self.fail = fail
+        self.calls = []
+
+    def decode(self, opus_data, frame_size, decode_fec=False):
+        self.calls.append(('decode', opus_data, decode_fec))
+        if self.fail:
+            raise FakeOpusError(-4)
+        return np.full(frame_size, 1000, dtype=np.int16).tobytes()
+
+    def reset_state(self):
+        pass
+
+
+@pytest.fixture
+def raw_calls(monkeypatch):
+    """Replace opuslib (its shared library is not needed) and record the low-level PLC calls."""
+    calls = []
+
+    def decode(state, data, length, frame_size, decode_fec, channels=2):
+        calls.append((state, data, length, frame_size, decode_fec, channels))
+        return bytes(frame_size * channels * 2)
+
+    api_decoder = types.ModuleType('opuslib.api.decoder')
+    api_decoder.decode = decode
+    api = types.ModuleType('opuslib.api')
+    api.decoder = api_decoder
+    opuslib = types.ModuleType('opuslib')
+    opuslib.OpusError = FakeOpusError
+    opuslib.api = api
+    monkeypatch.setitem(sys.modules, 'opuslib', opuslib)
+    monkeypatch.setitem(sys.modules, 'opuslib.api', api)
+    monkeypatch.setitem(sys.modules, 'opuslib.api.decoder', api_decoder)
+    return calls
+
+
+def test_opus_plc_uses_the_decoder_state(raw_calls):
+    decoder = FakeDecoder()
+    concealer = OpusConcealer(decoder, FRAME_SIZE)
+
+    pcm = concealer.conceal()
+
+    assert len(pcm) == FRAME_SIZE * 2
+    assert raw_calls == [(decoder.decoder_state, None, 0, FRAME_SIZE, False, 1)]
+    assert concealer.stats == {'concealed': 1, 'fec_recovered': 0}
+
+
+def test_opus_fec_recovers_from_the_next_packet(raw_calls):
+    decoder = FakeDecoder()
+    concealer = OpusConcealer(decoder, FRAME_SIZE)
+
+    concealer.conceal(next_payload=b'next')
+
+    assert decoder.calls == [('decode', b'next', True)]
+    assert raw_calls == []
+    assert concealer.stats == {'concealed': 1, 'fec_recovered': 1}
+
+
+def test_opus_fec_failure_falls_back_to_plc(raw_calls):
+    concealer = OpusConcealer(FakeDecoder(fail=True), FRAME_SIZE)
+
+    concealer.conceal(next_payload=b'next')
+
+    assert len(raw_calls) == 1
+    assert concealer.stats == {'concealed': 1, 'fec_recovered': 0}
+
+
+def test_opus_plc_failure_falls_back_to_comfort_noise(raw_calls, monkeypatch):
+    concealer = OpusConcealer(FakeDecoder(), FRAME_SIZE)
+
+    def failing_plc(*args, **kwargs):
+        raise FakeOpusError(-3)
+
+    monkeypatch.setattr(concealer, '_decode_raw', failing_plc)
+    concealer.noise_level = 100.0
+
+    pcm = np.frombuffer(concealer.conceal(), dtype=np.int16)
+
+    assert len(pcm) == FRAME_SIZE
+    assert 0 < np.abs(pcm).max() < 1000
+    assert concealer.stats['concealed'] == 1
+
+
+def test_pcm_concealment_reads_the_shared_noise_table():
+    concealer = PcmConcealer(FRAME_SIZE)
+    concealer.decode(np.full(FRAME_SIZE, 200, dtype=np.int16).tobytes())
+    concealer.conceal()
+    table = concealer.noise_table
+
+    for _ in range(5):
+        concealer.conceal()
+
+    assert concealer.noise_table is table  # Generated once, not per concealed frame
+    assert concealer.stats['concealed'] == 6
+
+
+def test_opus_corrupt_packet_is_concealed(raw_calls):
+    concealer = OpusConcealer(FakeDecoder(fail=True), FRAME_SIZE)
+
+    pcm = concealer.decode(b'corrupt')
+
+    assert len(pcm) == FRAME_SIZE * 2
+    assert len(raw_calls) == 1
+    assert concealer.stats['concealed'] == 1
+
+
+def test_opus_decode_tracks_the_level(raw_calls):
+    concealer = OpusConcealer(FakeDecoder(), FRAME_SIZE)
+
+    concealer.decode(b'packet')
+
+    assert concealer.last_rms == pytest.approx(1000)
+    assert raw_calls == []
+
+
+def test_pcm_conceal_fades_out_then_back_in():
+    concealer = PcmConcealer(FRAME_SIZE)
+    frame = np.full(FRAME_SIZE, 8000, dtype=np.int16).tobytes()
+
+    assert concealer.decode(frame) == frame
+    concealer.rng = np.random.default_rng(1)
+    concealed = np.frombuffer(concealer.conceal(), dtype=np.int16)
+    resumed = np.frombuffer(concealer.decode(frame), dtype=np.int16)
+
+    # The noise level follows the 8000-RMS frame up to its cap, so the tail is capped noise
+    assert concealer.noise_level == 300
+    rng = np.random.default_rng(1)
+    table = rng.standard_normal(FRAME_SIZE * concealer.NOISE_TABLE_FRAMES).astype(np.float32)
+    start = int(rng.integers(0, len(table) - FRAME_SIZE))
+    noise = (table[start:start + FRAME_SIZE] * np.float32(300)).astype(np.int16)
+    ramp = np.linspace(1.0, 0.0, FRAME_SIZE, dtype=np.float32)
+    expected = (np.float32(8000) * ramp + noise * ramp[::-1]).astype(np.int16)
+    np.testing.assert_array_equal(concealed, expected)
+    assert abs(int(concealed[0]) - 8000) < 100
+    assert resumed[0] == 0 and resumed[-1] == 8000
+    assert concealer.stats['concealed'] == 1
@@ -0,0 +1,75 @@
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from DecodeWorker import DecodeWorker
+
+
+class FakeSession:
+    def __init__(self, broken=False):
+        self.broken = broken
+        self.received = []
+        self.fills = 0
+
+    def receive(self, frame):
+        if self.broken:
+            raise ValueError("corrupt payload")
+        self.received.append(frame)
+
+    def fill(self, periods):
+        self.fills += 1
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_a_failing_session_does_not_stop_the_worker():
+    broken, healthy = FakeSession(broken=True), FakeSession()
+    worker = DecodeWorker(lambda: (broken, healthy), frame_duration_ms=5)
+    worker.start()
+    try:
+        worker.submit(broken, b'bad')
+        worker.submit(healthy, b'good')
+        wait_for(lambda: healthy.received == [b'good'])
+
+        fills = healthy.fills
+        worker.submit(healthy, b'more')
+        wait_for(lambda: healthy.received == [b'good', b'more'] and healthy.fills > fills + 2)
+        assert worker.thread.is_alive()
+        assert worker.get_stats()['errors'] == 1
+    finally:
+        worker.stop()
+
+
+def test_drop_oldest_keeps_the_newest_frames():
+    session = FakeSession()
+    worker = DecodeWorker(lambda: (), queue_size=2)
+
+    assert worker.submit(session, 1) and worker.submit(session, 2)
+    assert not worker.submit(session, 3)
+    assert [worker.queue.get_nowait()[1] for _ in range(2)] == [2, 3]
+    assert worker.stats['frames_dropped'] == 1
+
+
+def test_backpressure_waits_for_room():
+    session = FakeSession()
+    worker = DecodeWorker(lambda: (), frame_duration_ms=5, queue_size=1, policy='backpressure')
+    worker.running = True
+
+    async def send_two():
+        await worker.submit_async(session, 1)
+        second = asyncio.create_task(worker.submit_async(session, 2))
+        await asyncio.sleep(0.02)
+        assert not second.done()  # Held until the worker takes the first frame
+        worker.queue.get_nowait()
+        assert await second
+
+    asyncio.run(send_two())
+    assert worker.stats['frames_dropped'] == 0
@@ -0,0 +1,143 @@
+import json
+import os
+import sys
+import threading
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from DeviceCache import DeviceCache, device_fingerprint
+from Sinks import PyAudioCallbackSink
+
+SPEAKERS = {'name': 'Speakers (Realtek)', 'hostApi': 0, 'maxOutputChannels': 2}
+MICROPHONE = {'name': 'Microphone (Realtek)', 'hostApi': 0, 'maxOutputChannels': 0}
+CABLE_MME = {'name': 'CABLE Input (VB-Audio Virtual Cable)', 'hostApi': 1, 'maxOutputChannels': 2}
+CABLE = {'name': 'CABLE Input (VB-Audio Virtual Cable)', 'hostApi': 0, 'maxOutputChannels': 2}
+HOST_APIS = [{'name': 'Windows WASAPI'}, {'name': 'MME'}]
+
+
+class FakeStream:
+    def __init__(self, device):
+        self.device = device
+        self.active = True
+
+    def is_active(self):
+        return self.active
+
+    def stop_stream(self):
+        self.active = False
+
+    def close(self):
+        pass
+
+
+class FakePyAudio:
+    """The PortAudio calls the cache and the sink use, over a mutable device list."""
+
+    def __init__(self, devices):
+        self.devices = devices
+        self.queries = 0
+        self.streams = []
+
+    def get_device_count(self):
+        return len(self.devices)
+
+    def get_device_info_by_index(self, index):
+        self.queries += 1
+        if not 0 <= index < len(self.devices):
+            raise OSError("Invalid device index")
+        return self.devices[index]
+
+    def get_host_api_info_by_index(self, index):
+        return HOST_APIS[index]
+
+    def open(self, output_device_index=None, **options):
+        if output_device_index is not None and output_device_index >= len(self.devices):
+            raise OSError("Invalid device")
+        stream = FakeStream(output_device_index)
+        self.streams.append(stream)
+        return stream
+
+    def terminate(self):
+        pass
+
+
+def test_fingerprint_survives_an_index_shift(tmp_path):
+    path = str(tmp_path / 'devices.json')
+    pa = FakePyAudio([SPEAKERS, CABLE])
+    cache = DeviceCache(path)
+    cache.store(device_fingerprint(pa, 1), 1)
+
+    # Fast path: the cached index still carries the device
+    pa.queries = 0
+    assert DeviceCache(path).lookup(pa) == 1
+    assert pa.queries == 1
+
+    # A headset plugged in shifts the indices
+    pa = FakePyAudio([SPEAKERS, MICROPHONE, CABLE_MME, CABLE])
+    assert DeviceCache(path).lookup(pa) == 3
+    with open(path, encoding='utf-8') as f:
+        assert json.load(f)['output']['index'] == 3
+
+    assert DeviceCache(path).lookup(FakePyAudio([SPEAKERS])) is None
+
+
+def test_input_devices_and_bad_indices_have_no_fingerprint():
+    pa = FakePyAudio([SPEAKERS, MICROPHONE])
+    assert device_fingerprint(pa, 0) == {'name': 'Speakers (Realtek)', 'host_api': 'Windows WASAPI'}
+    assert device_fingerprint(pa, 1) is None
+    assert device_fingerprint(pa, 5) is None
+
+
+def test_unreadable_cache_is_ignored(tmp_path):
+    path = tmp_path / 'devices.json'
+    path.write_text('{not json')
+    assert DeviceCache(str(path)).entry is None
+
+
+def fake_pyaudio_module(world):
+    module = types.SimpleNamespace(paInt16=8, paInt24=4, paFloat32=1, paContinue=0, paOutputUnderflow=4)
+    module.PyAudio = lambda: FakePyAudio(world)
+    return module
+
+
+def test_watchdog_reopens_the_output_after_the_device_vanishes(tmp_path):
+    world = [SPEAKERS, CABLE]
+    recovered = threading.Event()
+    sink = PyAudioCallbackSink(48000, 1, 480, cache=DeviceCache(str(tmp_path / 'devices.json')))
+    sink.pyaudio = fake_pyaudio_module(world)
+    sink.WATCHDOG_INTERVAL_S = 0.01
+    sink.on_recovery = lambda seconds: recovered.set()
+    sink.start(lambda frames: bytes(frames * 2))
+    try:
+        assert sink.stream.device == 1
+        assert sink.fingerprint['name'].startswith('CABLE Input')
+
+        # Unplugged: the stream stops and the device list loses the cable
+        world.remove(CABLE)
+        sink.stream.active = False
+        assert recovered.wait(2.0)
+        assert sink.stream.device is None  # Fallback: default output
+        assert sink.cache.entry['name'].startswith('CABLE Input')  # Still preferred
+
+        # Back again: the next recovery returns to the cable
+        recovered.clear()
+        world.append(CABLE)
+        sink.stream.active = False
+        assert recovered.wait(2.0)
+        assert sink.stream.device == 1
+    finally:
+        sink.stop()
+
+
+def test_watchdog_notices_a_stalled_callback(tmp_path):
+    sink = PyAudioCallbackSink(48000, 1, 480, device_index=0)
+    sink.pyaudio = fake_pyaudio_module([SPEAKERS])
+    sink.start(lambda frames: bytes(frames * 2))
+    try:
+        assert not sink._lost()
+        sink.last_period = time.monotonic() - sink.STALL_TIMEOUT_S - 0.1
+        assert sink._lost()
+    finally:
+        sink.stop()
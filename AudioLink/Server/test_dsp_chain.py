@@ -0,0 +1,130 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from DspChain import FULL_SCALE, Agc, DspChain, HighPass, Limiter, NoiseGate
+
+RATE = 48000
+FRAME = 960
+
+
+def direct_form_highpass(stage, x):
+    """Reference: the same biquad run sample by sample (direct form II transposed)."""
+    b0, b1, b2 = stage.b
+    a1, a2 = stage.a
+    y = np.zeros(len(x))
+    z1 = z2 = 0.0
+    for i, sample in enumerate(x):
+        y[i] = b0 * sample + z1
+        z1, z2 = b1 * sample - a1 * y[i] + z2, b2 * sample - a2 * y[i]
+    return y
+
+
+def gain_curve(stage, levels):
+    """Run constant-level frames through a stage and return its per-sample gain."""
+    gains = []
+    for level in levels:
+        x = np.full((FRAME, 1), level, dtype=np.float32)
+        stage.process(x)
+        gains.append(x[:, 0] / level)
+    return np.concatenate(gains)
+
+
+def test_highpass_matches_a_direct_form_filter_across_blocks():
+    rng = np.random.default_rng(3)
+    t = np.arange(12 * FRAME) / RATE
+    signal = (8000 * np.sin(2 * np.pi * 30 * t) + 4000 * np.sin(2 * np.pi * 1000 * t)
+              + rng.normal(0, 500, len(t)) + 3000).astype(np.float32)
+    stage = HighPass(RATE, cutoff_hz=80.0)
+    expected = direct_form_highpass(stage, signal.astype(np.float64))
+
+    # Changing the block size mid-stream must keep the state continuous too
+    out = []
+    position = 0
+    for size in [FRAME] * 5 + [480] * 4 + [FRAME] * 4 + [240] * 4:
+        x = signal[position:position + size].reshape(-1, 1).copy()
+        stage.process(x)
+        out.append(x[:, 0])
+        position += size
+
+    np.testing.assert_allclose(np.concatenate(out), expected, atol=0.05)
+
+
+def test_limiter_never_exceeds_its_ceiling_on_a_full_scale_burst():
+    rng = np.random.default_rng(5)
+    stage = Limiter(RATE, ceiling_db=-1.0)
+    t = np.arange(20 * FRAME) / RATE
+    signal = 3000 * np.sin(2 * np.pi * 440 * t)
+    burst = slice(5 * FRAME, 12 * FRAME)
+    signal[burst] = np.clip(32767 * np.sign(signal[burst]) + rng.normal(0, 2000, 7 * FRAME), -32768, 32767)
+    out = []
+    for k in range(20):
+        x = signal[k * FRAME:(k + 1) * FRAME].astype(np.float32).reshape(-1, 1)
+        stage.process(x)
+        out.append(x[:, 0])
+    out = np.concatenate(out)
+
+    assert np.max(np.abs(out)) <= stage.ceiling * (1 + 1e-6)
+    # Quiet audio well after the burst is only delayed by the look-ahead again
+    np.testing.assert_allclose(out[-FRAME:], signal[-FRAME - stage.lookahead:-stage.lookahead], atol=1.0)
+
+
+def assert_click_free(gains, frame_steps):
+    """Gain moves at most about one frame's change spread over the frame, also across frame edges."""
+    assert np.max(np.abs(np.diff(gains))) <= frame_steps / FRAME * 1.01
+
+
+def test_gate_opens_and_closes_with_monotonic_ramps():
+    stage = NoiseGate(RATE)
+    speech = 0.1 * FULL_SCALE  # -20 dBFS
+    pause = 0.0005 * FULL_SCALE  # -66 dBFS, below the closing threshold
+
+    opening = gain_curve(stage, [speech] * 3)
+    assert np.all(np.diff(opening) >= 0)
+    assert opening[-1] == pytest.approx(1.0)
+    assert_click_free(opening, 1.0 - 10 ** (stage.floor_db / 20))
+
+    closing = gain_curve(stage, [pause] * 60)
+    assert np.all(np.diff(closing) <= 1e-7)
+    assert closing[-1] == pytest.approx(10 ** (stage.floor_db / 20), rel=1e-4)
+    # Held open for hold_ms, then fading at release_db_per_s
+    hold = int(stage.hold_s * RATE)
+    assert np.all(closing[:hold - FRAME] == pytest.approx(1.0))
+    assert_click_free(closing, 1.0 - 10 ** (-stage.release_db_per_s * FRAME / RATE / 20))
+
+
+def test_agc_gain_rises_slowly_falls_faster_and_never_clicks():
+    stage = Agc(RATE)
+    quiet = 0.01 * FULL_SCALE  # -40 dBFS: wants +20 dB
+    loud = 0.5 * FULL_SCALE  # -6 dBFS: wants -14 dB, limited to min_gain_db
+    silence = 0.0001 * FULL_SCALE  # Below activity_db: leaves the gain alone
+
+    rising = gain_curve(stage, [quiet] * 50)
+    assert np.all(np.diff(rising) >= 0)
+    assert stage.gain_db == pytest.approx(6.0)  # release_db_per_s over one second
+
+    held = gain_curve(stage, [silence] * 10)
+    assert np.all(held == pytest.approx(10 ** (6.0 / 20), rel=1e-5))
+
+    falling = gain_curve(stage, [loud] * 50)
+    assert np.all(np.diff(falling) <= 1e-7)
+    assert stage.gain_db == pytest.approx(stage.min_gain_db)
+
+    gains = np.concatenate((rising, held, falling))
+    assert_click_free(gains, 10 ** (6.0 / 20) * (1 - 10 ** (-stage.attack_db_per_s * FRAME / RATE / 20)))
+
+
+def test_chain_returns_int16_and_rejects_unknown_stages():
+    chain = DspChain(rate=RATE)
+    frame = (np.sin(2 * np.pi * 440 * np.arange(FRAME) / RATE) * 20000).astype(np.int16)
+
+    out = chain.process(frame.tobytes())
+
+    assert out.dtype == np.int16 and out.shape == (FRAME,)
+    assert out is chain.process(frame)  # Reused between calls
+    with pytest.raises(ValueError):
+        DspChain(('highpass', 'reverb'))
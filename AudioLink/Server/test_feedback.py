@@ -0,0 +1,78 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from Feedback import BitratePolicy, FeedbackReporter
+from JitterBuffer import JitterBuffer
+from StreamConfig import StreamConfig
+
+
+def test_heavy_loss_cuts_the_bitrate_and_turns_fec_on():
+    policy = BitratePolicy(32000, 20, fec_allowed=True)
+
+    policy.update(0.2, 0.0, jitter_ms=2.0)
+
+    assert policy.recommendation() == {'bitrate': 29000, 'fec': True, 'packet_loss_perc': 20}
+
+
+def test_moderate_loss_holds_the_bitrate():
+    policy = BitratePolicy(32000, 20, fec_allowed=False)
+    policy.update(0.2, 0.0, jitter_ms=2.0)
+
+    policy.update(0.05, 0.0, jitter_ms=2.0)
+
+    assert policy.recommendation()['bitrate'] == 29000
+    assert policy.recommendation()['fec'] is False  # Not agreed in the handshake
+
+
+def test_clean_link_grows_back_to_the_agreed_bitrate_only_with_low_jitter():
+    policy = BitratePolicy(32000, 20, fec_allowed=True)
+    policy.update(0.5, 0.0, jitter_ms=2.0)
+    assert policy.recommendation()['bitrate'] == 24000
+
+    policy.update(0.0, 0.0, jitter_ms=15.0)
+    assert policy.recommendation()['bitrate'] == 24000
+
+    for _ in range(10):
+        policy.update(0.0, 0.0, jitter_ms=2.0)
+    assert policy.recommendation()['bitrate'] == 32000
+
+
+def test_fec_decays_until_the_loss_is_below_half_the_threshold():
+    policy = BitratePolicy(32000, 20, fec_allowed=True)
+    policy.update(0.01, 0.0, jitter_ms=2.0)
+
+    states = []
+    for _ in range(3):
+        policy.update(0.0, 0.0, jitter_ms=2.0)
+        states.append(policy.fec)
+
+    # Smoothed loss 0.0075, 0.0056, 0.0042
+    assert states == [True, True, False]
+
+
+def test_underrun_burst_counts_each_missing_frame_once():
+    buffer = JitterBuffer(target_buffer_ms=40, frame_duration_ms=20)
+    reporter = FeedbackReporter(StreamConfig(bitrate=32000, fec=True))
+    reporter.report(buffer.get_stats())
+
+    # Five frames play, the link stalls for two pops, frames 5 and 6 are
+    # skipped as lost when 7-9 arrive, and 5 turns up afterwards
+    for seq in range(5):
+        buffer.push(b'frame', seq=seq)
+    for _ in range(7):
+        buffer.pop()
+    for seq in range(7, 10):
+        buffer.push(b'frame', seq=seq)
+    for _ in range(3):
+        buffer.pop()
+    buffer.push(b'frame', seq=5)
+
+    report = json.loads(reporter.report(buffer.get_stats()))
+
+    # 10 slots: 8 played, 6 never arrived, 5 came too late
+    assert report['loss'] == 0.1
+    assert report['late'] == 0.1
+    assert (report['bitrate'], report['fec'], report['packet_loss_perc']) == (29000, True, 10)
@@ -0,0 +1,301 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from JitterBuffer import JitterBuffer, SILENCE
+
+
+def fixed_buffer(target_ms=40):
+    return JitterBuffer(target_buffer_ms=target_ms, frame_duration_ms=20)
+
+
+def drain(buffer, pops):
+    return [buffer.pop() for _ in range(pops)]
+
+
+def test_waits_for_the_target_depth_before_playing():
+    buffer = fixed_buffer(target_ms=60)
+    buffer.push(b'0', seq=0)
+    buffer.push(b'1', seq=1)
+
+    assert buffer.pop() is None
+    assert not buffer.started
+
+    buffer.push(b'2', seq=2)
+    assert drain(buffer, 3) == [b'0', b'1', b'2']
+
+
+def test_reordered_frames_play_in_sequence_order():
+    buffer = fixed_buffer()
+    for seq in (0, 2, 1, 4, 3, 5):
+        buffer.push(f'{seq}'.encode(), seq=seq)
+
+    assert drain(buffer, 6) == [b'0', b'1', b'2', b'3', b'4', b'5']
+    assert buffer.stats['lost'] == 0
+
+
+def test_duplicates_are_dropped():
+    buffer = fixed_buffer()
+    assert buffer.push(b'0', seq=0)
+    assert buffer.push(b'1', seq=1)
+    assert not buffer.push(b'1 again', seq=1)
+
+    assert drain(buffer, 2) == [b'0', b'1']
+    assert buffer.stats['duplicates'] == 1
+
+
+def test_missing_frame_is_reported_for_concealment():
+    buffer = fixed_buffer()
+    for seq in (0, 1, 3):
+        buffer.push(f'{seq}'.encode(), seq=seq)
+
+    assert drain(buffer, 2) == [b'0', b'1']
+    assert buffer.missing() == [2]
+    assert buffer.pop() is None
+    assert buffer.last_lost
+    assert buffer.peek() == b'3'  # The next packet, for Opus FEC
+    assert buffer.pop() == b'3'
+    assert buffer.stats['lost'] == 1
+
+
+def test_frame_arriving_after_its_slot_is_late():
+    buffer = fixed_buffer()
+    for seq in (0, 1, 3):
+        buffer.push(f'{seq}'.encode(), seq=seq)
+    drain(buffer, 3)
+
+    assert not buffer.push(b'2', seq=2)
+    assert buffer.stats['late'] == 1
+    assert buffer.pop() == b'3'
+
+
+def test_sequence_wraps_around_without_a_gap():
+    buffer = fixed_buffer()
+    seqs = [65533, 65534, 65535, 0, 1, 2]
+    for seq in seqs:
+        buffer.push(f'{seq}'.encode(), seq=seq)
+
+    assert drain(buffer, 6) == [f'{seq}'.encode() for seq in seqs]
+    assert buffer.stats['lost'] == 0
+
+
+def test_reordering_across_the_wrap():
+    buffer = fixed_buffer()
+    for seq in (65534, 0, 65535, 1):
+        buffer.push(f'{seq}'.encode(), seq=seq)
+
+    assert drain(buffer, 4) == [b'65534', b'65535', b'0', b'1']
+
+
+def test_underrun_skips_the_missing_slots_it_already_concealed():
+    buffer = fixed_buffer()
+    for seq in range(3):
+        buffer.push(b'frame', seq=seq)
+    drain(buffer, 3)
+
+    # Nothing arrives for two periods, then the stream continues without frames 3 and 4
+    assert drain(buffer, 2) == [None, None]
+    for seq in range(5, 8):
+        buffer.push(f'{seq}'.encode(), seq=seq)
+
+    assert buffer.pop() == b'5'  # Not concealed a second time
+    assert buffer.stats['underruns'] == 2
+    assert buffer.stats['lost'] == 2
+
+
+def test_resume_skips_the_outage_without_an_overrun():
+    buffer = fixed_buffer()
+    for seq in range(3):
+        buffer.push(b'frame', seq=seq)
+    drain(buffer, 3)
+
+    # The connection drops for a second; the sender keeps counting
+    assert drain(buffer, 50) == [None] * 50
+    buffer.resume()
+    for seq in range(53, 55):
+        buffer.push(f'{seq}'.encode(), seq=seq)
+
+    assert drain(buffer, 2) == [b'53', b'54']
+    assert buffer.stats['overruns'] == 0
+    assert buffer.stats['lost'] == 0
+    assert not buffer.resuming
+
+
+def test_reset_starts_over():
+    buffer = fixed_buffer()
+    for seq in range(3):
+        buffer.push(b'frame', seq=seq)
+    drain(buffer, 3)
+
+    buffer.reset()
+    buffer.push(b'a', seq=40000)
+    buffer.push(b'b', seq=40001)
+
+    assert drain(buffer, 2) == [b'a', b'b']
+    assert buffer.stats['packets_played'] == 2
+
+
+def test_frames_delayed_by_an_underrun_still_play():
+    buffer = fixed_buffer()
+    for seq in range(3):
+        buffer.push(b'frame', seq=seq)
+    drain(buffer, 3)
+
+    assert buffer.pop() is None
+    buffer.push(b'3', seq=3)
+    buffer.push(b'4', seq=4)
+
+    assert drain(buffer, 2) == [b'3', b'4']
+    assert buffer.stats['lost'] == 0
+
+
+def declare_silence(buffer, seq, end_seq):
+    # Arrived long ago: the sender has reached the end of the silence
+    return buffer.push_silence(seq, end_seq, arrival_time=time.monotonic() - 60)
+
+
+def test_declared_silence_is_neither_lost_nor_an_underrun():
+    buffer = fixed_buffer()
+    for seq in range(3):
+        buffer.push(b'frame', seq=seq)
+    drain(buffer, 3)
+
+    assert declare_silence(buffer, 3, 10)
+    assert drain(buffer, 7) == [SILENCE] * 7
+    buffer.push(b'10', seq=10)
+    assert buffer.pop() == b'10'
+
+    stats = buffer.get_stats()
+    assert (stats['silent'], stats['lost'], stats['underruns']) == (7, 0, 0)
+
+
+def test_speech_arriving_inside_a_silence_ends_it():
+    buffer = fixed_buffer()
+    for seq in range(3):
+        buffer.push(b'frame', seq=seq)
+    drain(buffer, 3)
+
+    declare_silence(buffer, 3, 8)
+    buffer.push(b'5', seq=5)
+    buffer.push(b'6', seq=6)
+
+    assert buffer.silence_end == 5
+    assert drain(buffer, 4) == [SILENCE, SILENCE, b'5', b'6']
+    assert buffer.stats['lost'] == 0
+
+
+def test_continuing_markers_extend_the_silence():
+    buffer = fixed_buffer()
+    for seq in range(3):
+        buffer.push(b'frame', seq=seq)
+    drain(buffer, 3)
+
+    declare_silence(buffer, 3, 6)
+    declare_silence(buffer, 6, 9)
+
+    assert drain(buffer, 6) == [SILENCE] * 6
+    assert (buffer.silence_start, buffer.silence_end) == (3, 9)
+
+
+def test_late_or_empty_marker_is_refused():
+    buffer = fixed_buffer()
+    for seq in range(6):
+        buffer.push(b'frame', seq=seq)
+    drain(buffer, 6)
+
+    assert not declare_silence(buffer, 2, 4)
+    assert buffer.stats['late'] == 1
+    assert not declare_silence(buffer, 6, 6)
+    assert buffer.silence_end is None
+
+
+def test_silence_across_the_wrap():
+    buffer = fixed_buffer()
+    for seq in (65530, 65531, 65532):
+        buffer.push(b'frame', seq=seq)
+    drain(buffer, 3)
+
+    declare_silence(buffer, 65533, 2)
+    assert drain(buffer, 5) == [SILENCE] * 5
+    buffer.push(b'2', seq=2)
+    assert buffer.pop() == b'2'
+    assert buffer.stats['lost'] == 0
+
+
+class JitterySender:
+    """Pushes one frame per output period, every other frame delayed by `jitter` seconds."""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.seq = 0
+        self.played = []
+
+    def run(self, periods, jitter=0.0):
+        for _ in range(periods):
+            seq = self.seq
+            arrival = seq * 0.02 + (jitter if seq % 2 else 0.0)
+            self.buffer.push(seq, seq=seq, timestamp=seq * 960, arrival_time=arrival)
+            self.seq += 1
+
+            # What Session does: skip a silent frame when the buffer may shrink
+            out = self.buffer.pop()
+            if out is not None and self.buffer.should_shrink():
+                out = self.buffer.shrink()
+            self.played.append(out)
+
+
+def adaptive_buffer():
+    return JitterBuffer(target_buffer_ms=40, min_buffer_ms=20, max_buffer_ms=100, frame_duration_ms=20,
+                        adaptive=True, adapt_interval=10)
+
+
+def test_target_grows_with_jitter_up_to_the_maximum():
+    buffer = adaptive_buffer()
+    sender = JitterySender(buffer)
+    sender.run(20)
+    calm_target = buffer.target_frames
+
+    sender.run(100, jitter=0.06)
+
+    assert buffer.jitter_ms > 40
+    assert calm_target < buffer.target_frames == buffer.max_frames
+
+
+def test_growing_stretches_playout_with_concealed_frames():
+    buffer = adaptive_buffer()
+    sender = JitterySender(buffer)
+    sender.run(20)
+    depth = buffer.depth()
+
+    sender.run(100, jitter=0.06)
+
+    assert buffer.stats['stretched'] == buffer.depth() - depth > 0
+    played = [frame for frame in sender.played if frame is not None]
+    assert played == sorted(played)
+    assert buffer.stats['lost'] == buffer.stats['underruns'] == 0
+
+
+def test_target_shrinks_back_to_the_minimum_by_skipping_silent_frames():
+    buffer = adaptive_buffer()
+    sender = JitterySender(buffer)
+    sender.run(20)
+    sender.run(100, jitter=0.06)
+    deep = buffer.depth()
+
+    sender.run(300)
+
+    assert buffer.target_frames == buffer.min_frames
+    assert buffer.stats['shrunk'] == deep - buffer.depth() > 0
+    assert buffer.stats['lost'] == buffer.stats['underruns'] == 0
+
+
+def test_fixed_mode_measures_jitter_but_keeps_its_target():
+    buffer = fixed_buffer()
+    sender = JitterySender(buffer)
+    sender.run(100, jitter=0.06)
+
+    assert buffer.jitter_ms > 40
+    assert buffer.target_frames == 2
+    assert buffer.stats['stretched'] == buffer.stats['shrunk'] == 0
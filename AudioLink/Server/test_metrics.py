@@ -0,0 +1,45 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import Metrics
+import server
+from Metrics import ServerMetrics
+from Sinks import NullSink
+
+
+def test_reconnects_are_counted_per_host():
+    metrics = ServerMetrics()
+    for remote in ('10.0.0.2', '10.0.0.3', '10.0.0.2'):
+        metrics.on_connect(remote)
+
+    assert (metrics.connections, metrics.reconnects) == (3, 1)
+
+
+def test_known_hosts_are_capped(monkeypatch):
+    monkeypatch.setattr(Metrics, 'MAX_KNOWN_REMOTES', 3)
+    metrics = ServerMetrics()
+    for host in range(1, 5):
+        metrics.on_connect(f'10.0.0.{host}')
+    metrics.on_connect('10.0.0.2')  # Still remembered, and now the most recent
+
+    assert list(metrics.known_remotes) == ['10.0.0.3', '10.0.0.4', '10.0.0.2']
+    metrics.on_connect('10.0.0.1')  # Forgotten first
+    assert metrics.reconnects == 1
+    assert len(metrics.known_remotes) == 3
+
+
+def test_every_udp_counter_is_exported():
+    audio_server = server.AudioServer(use_opus=False, metrics_log_interval=0, udp_port=8766,
+                                      sink=NullSink(server.RATE, server.CHANNELS, server.CHUNK))
+    audio_server.udp.datagram_received(b'short', ('10.0.0.2', 40000))
+
+    counters = audio_server._metrics_counters()
+    for name in audio_server.udp.stats:
+        assert f'udp_{name}' in counters
+    assert counters['udp_datagrams'] == 1 and counters['udp_malformed'] == 1
+
+    text = audio_server.metrics.render((), counters)
+    assert 'audiolink_udp_wrong_source_total 0' in text
+    assert 'audiolink_udp_datagrams_total 1' in text
@@ -0,0 +1,88 @@
+import asyncio
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import server
+from Mixer import Mixer
+from Sinks import NullSink
+from StreamConfig import StreamConfig
+from protocol import encode_control
+
+
+class FakeWebSocket:
+    remote_address = ('127.0.0.1', 50000)
+
+    async def close(self, code, reason):
+        raise AssertionError(f"closed: {code} {reason}")
+
+
+def block(value, size=4):
+    return np.full(size, value, dtype=np.int16)
+
+
+def test_gain_scales_each_client():
+    mixer = Mixer(4)
+    mixer.add(block(1000), gain=0.5)
+    mixer.add(block(-200), gain=2.0)
+    assert mixer.mix().tolist() == [100] * 4
+
+    mixer.add(block(1000), gain=0.0)
+    assert mixer.mix().tolist() == [0] * 4
+
+
+def test_single_client_with_gain():
+    mixer = Mixer(4)
+    mixer.add(np.array([100, -100, 3, 0], dtype=np.int16), gain=1.5)
+    assert mixer.mix().tolist() == [150, -150, 4, 0]
+
+
+def test_sum_saturates_instead_of_wrapping():
+    mixer = Mixer(4)
+    for _ in range(3):
+        mixer.add(block(20000))
+    assert mixer.mix().tolist() == [32767] * 4
+
+    mixer.add(block(-30000))
+    mixer.add(block(-30000))
+    assert mixer.mix().tolist() == [-32768] * 4
+
+    mixer.add(block(16384), gain=4.0)
+    assert mixer.mix().tolist() == [32767] * 4
+
+
+def test_grows_for_more_clients_and_longer_blocks():
+    mixer = Mixer(2, max_clients=1)
+    mixer.add(block(1, size=2))
+    mixer.add(block(2, size=2))
+    mixer.add(block(3, size=2))
+    assert mixer.mix().tolist() == [6, 6]
+
+    mixer.add(block(7, size=6))
+    assert mixer.mix().tolist() == [7] * 6
+    assert mixer.mix() is None
+
+
+def test_clients_set_their_gain_in_the_hello_and_during_the_stream():
+    audio_server = server.AudioServer(use_opus=False, metrics_log_interval=0,
+                                      sink=NullSink(server.RATE, server.CHANNELS, server.CHUNK))
+
+    async def connect():
+        websocket = FakeWebSocket()
+        config = StreamConfig.negotiate({'type': 'hello', 'codec': 'pcm', 'gain': 0.25}, audio_server.default_config)
+        return await audio_server.start_session(websocket, config)
+
+    session = asyncio.run(connect())
+    assert session.gain == 0.25
+
+    audio_server.handle_control(session, encode_control('gain', gain=3.0))
+    assert session.gain == 3.0
+    audio_server.handle_control(session, encode_control('gain', gain='max'))
+    audio_server.handle_control(session, encode_control('mute'))
+    assert session.gain == 3.0
+    audio_server.handle_control(session, encode_control('gain', gain=10))
+    assert session.gain == 4.0
+    audio_server.stop_audio_stream()
@@ -0,0 +1,73 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from protocol import (HEADER_SIZE, PROTOCOL_VERSION, ProtocolError, decode_control, encode_control, pack_datagram,
+                      pack_frame, pack_silence, parse_datagram, parse_frame, seq_delta, silence_end)
+
+
+def test_header_layout():
+    message = pack_frame(0x1234, 0x89ABCDEF, b'payload', flags=1)
+
+    assert message[:HEADER_SIZE] == bytes([PROTOCOL_VERSION, 1, 0x34, 0x12, 0xEF, 0xCD, 0xAB, 0x89])
+    assert message[HEADER_SIZE:] == b'payload'
+
+
+def test_frame_round_trip_wraps_seq_and_timestamp():
+    frame = parse_frame(pack_frame(65536 + 7, (1 << 32) + 960, b'\x01\x02'))
+
+    assert (frame.seq, frame.timestamp, frame.flags, frame.payload) == (7, 960, 0, b'\x01\x02')
+
+
+def test_short_message_is_rejected():
+    with pytest.raises(ProtocolError):
+        parse_frame(b'\x01\x00\x00')
+
+
+def test_unknown_version_is_rejected():
+    message = bytearray(pack_frame(1, 0, b''))
+    message[0] = PROTOCOL_VERSION + 1
+
+    with pytest.raises(ProtocolError):
+        parse_frame(bytes(message))
+
+
+@pytest.mark.parametrize('seq, reference, delta', [
+    (5, 3, 2),
+    (3, 5, -2),
+    (2, 65534, 4),
+    (65534, 2, -4),
+    (32767, 0, 32767),
+    (32768, 0, -32768),
+])
+def test_seq_delta_across_the_wrap(seq, reference, delta):
+    assert seq_delta(seq, reference) == delta
+
+
+def test_silence_marker_round_trip():
+    frame = parse_frame(pack_silence(65530, 0, 65530 + 10))
+
+    assert frame.flags == 1
+    assert silence_end(frame) == 4
+
+
+def test_silence_marker_payload_length_is_checked():
+    with pytest.raises(ProtocolError):
+        silence_end(parse_frame(pack_frame(1, 0, b'\x00\x00\x00', flags=1)))
+
+
+def test_datagram_round_trip():
+    key, frame = parse_datagram(pack_datagram(0xDEADBEEF, pack_frame(9, 90, b'x')))
+
+    assert key == 0xDEADBEEF
+    assert (frame.seq, frame.payload) == (9, b'x')
+
+
+def test_control_messages():
+    assert decode_control(encode_control('hello', codec='opus')) == {'type': 'hello', 'codec': 'opus'}
+    for text in ('not json', '[1, 2]', '{"codec": "opus"}'):
+        with pytest.raises(ProtocolError):
+            decode_control(text)
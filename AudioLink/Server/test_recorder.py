@@ -0,0 +1,224 @@
+import asyncio
+import os
+import socket
+import struct
+import sys
+import time
+import wave
+
+import numpy as np
+import websockets
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from protocol import SEQ_MODULO, pack_frame, pack_silence, parse_frame
+from Recorder import OPUS_PRE_SKIP, OggOpusRecorder, WavRecorder, ogg_crc
+import server
+from Session import Session
+from Sinks import NullSink
+from protocol import encode_control
+
+FRAME_SIZE = 4
+
+
+def audio(seq, value=1000):
+    return parse_frame(pack_frame(seq, seq * FRAME_SIZE, np.full(FRAME_SIZE, value, dtype=np.int16).tobytes()))
+
+
+def marker(seq, end_seq):
+    return parse_frame(pack_silence(seq, seq * FRAME_SIZE, end_seq))
+
+
+def reference_crc(data):
+    """Bitwise Ogg CRC-32: polynomial 0x04c11db7, MSB first, init 0, no final xor."""
+    crc = 0
+    for byte in data:
+        crc ^= byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7 if crc & 0x80000000 else crc << 1) & 0xFFFFFFFF
+    return crc
+
+
+def read_pages(path):
+    """Split an Ogg file into (flags, granule, page_seq, packets), checking every CRC."""
+    data = open(path, 'rb').read()
+    pages = []
+    offset = 0
+    while offset < len(data):
+        magic, version, flags, granule, serial, page_seq, crc, segments = struct.unpack_from('<4sBBqIIIB', data, offset)
+        assert magic == b'OggS' and version == 0
+        lacing = data[offset + 27:offset + 27 + segments]
+        end = offset + 27 + segments + sum(lacing)
+        page = bytearray(data[offset:end])
+        page[22:26] = bytes(4)
+        assert crc == reference_crc(bytes(page))
+
+        packets, packet, position = [], b'', offset + 27 + segments
+        for size in lacing:
+            packet += data[position:position + size]
+            position += size
+            if size < 255:
+                packets.append(packet)
+                packet = b''
+        pages.append((flags, granule, page_seq, packets))
+        offset = end
+    return pages
+
+
+def read_wav(path):
+    with wave.open(str(path), 'rb') as wav:
+        return np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+
+
+def test_ogg_crc_matches_the_reference():
+    assert ogg_crc(b'123456789') == reference_crc(b'123456789') == 0x89A1897F
+    payload = bytes(range(256)) * 5
+    assert ogg_crc(payload) == reference_crc(payload)
+
+
+def test_ogg_opus_pages_and_granule_positions(tmp_path):
+    path = tmp_path / 'session.opus'
+    recorder = OggOpusRecorder(str(path), 960)
+    for seq in range(60):
+        if seq != 10:
+            recorder.add(parse_frame(pack_frame(seq, seq * 960, bytes([seq]) * (300 if seq == 5 else 40))))
+    recorder.close()
+
+    pages = read_pages(path)
+    head, tags, first, last = pages
+
+    assert head[0] == 0x02 and head[3][0][:8] == b'OpusHead'
+    assert struct.unpack_from('<H', head[3][0], 10)[0] == OPUS_PRE_SKIP
+    assert tags[3][0][:8] == b'OpusTags'
+    assert [page[2] for page in pages] == [0, 1, 2, 3]
+
+    # 50 packets per page; the missing frame 10 leaves a granule gap, not a packet
+    assert len(first[3]) == 50
+    assert first[1] == 51 * 960
+    assert first[3][5] == bytes([5]) * 300  # Laced over two segments
+    assert first[3][10] == bytes([11]) * 40
+    assert last[0] == 0x04
+    assert len(last[3]) == 9
+    assert last[1] == 60 * 960
+    assert recorder.stats['frames'] == 59 and recorder.stats['lost'] == 1
+
+
+def test_wav_fills_lost_frames_with_silence(tmp_path):
+    recorder = WavRecorder(str(tmp_path / 'lost.wav'), FRAME_SIZE)
+    for seq in (0, 1, 3, 2, 5):
+        recorder.add(audio(seq, value=seq + 1))
+    recorder.close()
+
+    samples = read_wav(tmp_path / 'lost.wav').reshape(-1, FRAME_SIZE)
+    assert samples[:, 0].tolist() == [1, 2, 3, 4, 0, 6]
+    assert recorder.stats['frames'] == 5 and recorder.stats['lost'] == 1
+
+
+class FullDiskRecorder(WavRecorder):
+    def _write(self, index, payload):
+        raise OSError(28, "No space left on device")
+
+
+def test_write_error_stops_the_recording_without_blocking_close(tmp_path):
+    recorder = FullDiskRecorder(str(tmp_path / 'full.wav'), FRAME_SIZE, queue_size=16)
+    for seq in range(40):
+        recorder.add(audio(seq))
+    recorder.thread.join(1.0)
+
+    assert not recorder.thread.is_alive()
+    assert not recorder.active
+    start = time.monotonic()
+    recorder.close(timeout=1.0)
+    assert time.monotonic() - start < 0.5
+    recorder.add(audio(40))  # Ignored once inactive
+    assert recorder.queue.qsize() <= 16
+
+
+def test_long_dtx_silence_keeps_the_recording_in_sequence(tmp_path):
+    # Longer than half the 16-bit sequence space, renewed every 50 frames
+    silence = 40000
+    recorder = WavRecorder(str(tmp_path / 'dtx.wav'), FRAME_SIZE)
+    for seq in range(10):
+        recorder.add(audio(seq))
+    for seq in range(10, 10 + silence, 50):
+        recorder.add(marker(seq, (seq + 50) % SEQ_MODULO))
+    for seq in range(10 + silence, 20 + silence):
+        recorder.add(audio(seq % SEQ_MODULO))
+    recorder.close()
+
+    samples = read_wav(tmp_path / 'dtx.wav').reshape(-1, FRAME_SIZE)
+    assert len(samples) == 20 + silence
+    assert (samples[10:10 + silence] == 0).all()
+    assert (samples[10 + silence:] == 1000).all()
+    assert recorder.stats == {'frames': 20, 'silent': silence, 'lost': 0, 'late': 0, 'dropped': 0}
+
+
+def test_session_passes_silence_markers_to_the_recorder():
+    class Tap:
+        def __init__(self):
+            self.frames = []
+
+        def add(self, frame):
+            self.frames.append(frame)
+
+    session = Session(1, '127.0.0.1', use_opus=False, frame_size=FRAME_SIZE)
+    session.recorder = Tap()
+    session.receive(audio(0))
+    session.receive(marker(1, 40))
+
+    assert [frame.seq for frame in session.recorder.frames] == [0, 1]
+
+
+async def stop_while_recording(directory, frames):
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    audio_server = server.AudioServer(use_opus=False, metrics_log_interval=0, feedback_interval=0,
+                                      sink=NullSink(server.RATE, server.CHANNELS, server.CHUNK),
+                                      record_dir=str(directory), resume_grace=5.0)
+    server_task = asyncio.create_task(audio_server.start_server(host='127.0.0.1', port=port))
+    await asyncio.sleep(0.2)
+    ws = await websockets.connect(f'ws://127.0.0.1:{port}', compression=None)
+    await ws.send(encode_control('hello', codec='pcm', rate=server.RATE, channels=1, frame_ms=20))
+    await ws.recv()
+    await ws.recv()
+    for seq in range(frames):
+        await ws.send(pack_frame(seq, seq * 960, np.full(960, seq, dtype=np.int16).tobytes()))
+    session = next(iter(audio_server.sessions.values()))
+    for _ in range(200):
+        if session.frames_received == frames:
+            break
+        await asyncio.sleep(0.01)
+
+    # As on Ctrl+C: the server task is cancelled with the phone still streaming
+    server_task.cancel()
+    try:
+        await server_task
+    except asyncio.CancelledError:
+        pass
+    audio_server.stop_audio_stream()
+
+
+def test_stopping_the_server_finishes_open_recordings(tmp_path):
+    asyncio.run(stop_while_recording(tmp_path, 30))
+
+    path, = tmp_path.iterdir()
+    samples = read_wav(path).reshape(-1, 960)
+    assert len(samples) == 30  # The header counts every frame written
+    assert samples[:, 0].tolist() == list(range(30))
+
+
+def test_stop_audio_stream_finishes_recorders_of_sessions_still_open(tmp_path):
+    audio_server = server.AudioServer(use_opus=False, metrics_log_interval=0,
+                                      sink=NullSink(server.RATE, server.CHANNELS, server.CHUNK))
+    session = Session(1, '127.0.0.1', use_opus=False, frame_size=FRAME_SIZE)
+    session.recorder = OggOpusRecorder(str(tmp_path / 'open.opus'), 960)
+    audio_server.sessions[1] = session
+    for seq in range(5):
+        session.recorder.add(parse_frame(pack_frame(seq, seq * 960, b'packet')))
+
+    audio_server.stop_audio_stream()
+
+    pages = read_pages(tmp_path / 'open.opus')
+    assert pages[-1][0] == 0x04  # End of stream
+    assert pages[-1][1] == 5 * 960 and len(pages[-1][3]) == 5
@@ -0,0 +1,166 @@
+import asyncio
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from Relay import Relay, Subscriber, is_loopback
+from protocol import DATAGRAM_KEY
+
+
+class FakeWebSocket:
+    """
+    Stands in for a websockets connection: records sends and closes, and
+    receives nothing until leave() (at once if stay is False).
+    """
+
+    def __init__(self, host, stay=False):
+        self.remote_address = (host, 50000)
+        self.sent = []
+        self.closed = None
+        self.left = asyncio.Event() if stay else None
+
+    async def send(self, message):
+        self.sent.append(message)
+
+    async def close(self, code, reason):
+        self.closed = (code, reason)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.left is not None:
+            await self.left.wait()
+        raise StopAsyncIteration
+
+    def leave(self):
+        self.left.set()
+
+    def frames(self):
+        """Binary messages sent after the initial stream announcement."""
+        return [message for message in self.sent if isinstance(message, bytes)]
+
+
+@pytest.mark.parametrize('host, local', [
+    ('127.0.0.1', True),
+    ('127.0.0.2', True),
+    ('::1', True),
+    ('::ffff:127.0.0.1', True),
+    ('192.168.1.20', False),
+    ('fe80::1%eth0', False),
+    ('not-an-address', False),
+])
+def test_is_loopback(host, local):
+    assert is_loopback(host) == local
+
+
+def test_remote_subscriber_is_refused():
+    relay = Relay()
+    websocket = FakeWebSocket('192.168.1.20')
+
+    asyncio.run(relay.serve(websocket, '/subscribe', {}))
+
+    assert websocket.closed[0] == 1008
+    assert websocket.sent == []
+    assert relay.stats['subscribers'] == 0
+
+
+def test_local_subscriber_is_served():
+    relay = Relay()
+    websocket = FakeWebSocket('127.0.0.1')
+
+    asyncio.run(relay.serve(websocket, '/subscribe/3', {}))
+
+    assert websocket.closed is None
+    assert relay.stats['subscribers'] == 1
+    assert relay.by_session == {}  # Removed again once the listener left
+
+
+def test_frames_fan_out_to_every_matching_subscriber():
+    async def scenario():
+        relay = Relay()
+        paths = ['/subscribe/1', '/subscribe/1', '/subscribe', '/subscribe/2']
+        websockets = [FakeWebSocket('127.0.0.1', stay=True) for _ in paths]
+        tasks = [asyncio.create_task(relay.serve(ws, path, {})) for ws, path in zip(websockets, paths)]
+        await asyncio.sleep(0)
+
+        for seq in range(3):
+            relay.publish(SimpleNamespace(session_id=1), b'one%d' % seq)
+        relay.publish(SimpleNamespace(session_id=5), b'five')
+        await asyncio.sleep(0.01)
+
+        for ws in websockets:
+            ws.leave()
+        await asyncio.gather(*tasks)
+        return relay, websockets
+
+    relay, (first, second, everything, other) = asyncio.run(scenario())
+
+    assert first.frames() == second.frames() == [b'one0', b'one1', b'one2']
+    # /subscribe gets every session, tagged with its id
+    assert everything.frames() == [DATAGRAM_KEY.pack(1) + b'one%d' % seq for seq in range(3)] \
+        + [DATAGRAM_KEY.pack(5) + b'five']
+    assert other.frames() == []
+    assert json.loads(other.sent[0])['type'] == 'stream'
+    assert relay.stats['frames'] == 4 and relay.stats['subscribers'] == 4
+    assert relay.by_session == {} and relay.all_sessions == set()
+
+
+def test_frames_without_subscribers_are_not_counted():
+    relay = Relay()
+
+    relay.publish(SimpleNamespace(session_id=1), b'frame')
+
+    assert relay.stats['frames'] == 0
+
+
+def test_slow_subscriber_drops_its_oldest_frames():
+    async def scenario():
+        websocket = FakeWebSocket('127.0.0.1')
+        subscriber = Subscriber(websocket, queue_size=3)
+        for seq in range(5):
+            subscriber.offer(b'frame%d' % seq)
+        sender = asyncio.create_task(subscriber.run())
+        await asyncio.sleep(0)
+        sender.cancel()
+        return websocket, subscriber
+
+    websocket, subscriber = asyncio.run(scenario())
+
+    assert websocket.sent == [b'frame2', b'frame3', b'frame4']
+    assert subscriber.stats == {'sent': 3, 'dropped': 2}
+
+
+def test_dropped_frames_of_departed_subscribers_are_kept():
+    async def scenario():
+        relay = Relay(queue_size=2)
+        websocket = FakeWebSocket('127.0.0.1', stay=True)
+        task = asyncio.create_task(relay.serve(websocket, '/subscribe/1', {}))
+        await asyncio.sleep(0)
+        # Published faster than the sender task gets to run
+        for seq in range(5):
+            relay.publish(SimpleNamespace(session_id=1), b'frame%d' % seq)
+        dropped_while_connected = relay.dropped()
+        websocket.leave()
+        await task
+        return relay, dropped_while_connected
+
+    relay, dropped_while_connected = asyncio.run(scenario())
+
+    assert dropped_while_connected == 4  # The stream announcement and frames 0-2
+    assert relay.dropped() == 4
+
+
+def test_invalid_subscribe_path_is_refused():
+    relay = Relay()
+    websocket = FakeWebSocket('127.0.0.1')
+
+    asyncio.run(relay.serve(websocket, '/subscribe/abc', {}))
+
+    assert websocket.closed[0] == 1008
+    assert relay.stats['subscribers'] == 0
@@ -0,0 +1,79 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from SampleFormat import InputConverter, OutputConverter
+
+SAMPLES = np.array([0, 1, -1, 16384, -32768, 32767], dtype=np.int16)
+
+
+def int24_bytes(values):
+    """Little-endian packed 24-bit samples."""
+    return b''.join(int(value).to_bytes(3, 'little', signed=True) for value in values)
+
+
+def test_mono_int16_passes_through():
+    data = SAMPLES.tobytes()
+    assert OutputConverter().convert(data) is data
+
+
+def test_int16_is_copied_onto_every_channel():
+    out = OutputConverter('int16', 3).convert(SAMPLES.tobytes())
+    assert np.frombuffer(out, dtype=np.int16).reshape(-1, 3).tolist() == [[value] * 3 for value in SAMPLES.tolist()]
+
+
+def test_int24_keeps_the_int16_in_the_top_bytes():
+    out = OutputConverter('int24', 2).convert(SAMPLES.tobytes())
+    assert bytes(out) == int24_bytes(np.repeat(SAMPLES.astype(np.int32) * 256, 2))
+
+
+def test_float32_scales_to_unit_range():
+    out = np.frombuffer(OutputConverter('float32', 2).convert(SAMPLES.tobytes()), dtype=np.float32)
+    assert out.reshape(-1, 2)[:, 0].tolist() == (SAMPLES / 32768.0).tolist()
+    assert (out.reshape(-1, 2)[:, 1] == out.reshape(-1, 2)[:, 0]).all()
+
+
+def test_output_buffer_grows_for_larger_blocks():
+    converter = OutputConverter('int24', 1)
+    converter.convert(SAMPLES[:2].tobytes())
+    out = converter.convert(SAMPLES.tobytes())
+    assert bytes(out) == int24_bytes(SAMPLES.astype(np.int32) * 256)
+
+
+def test_float32_input_is_clipped_and_scaled():
+    payload = np.array([0.0, 0.5, -0.5, -1.0, 1.0, 2.0, -3.0], dtype=np.float32).tobytes()
+    out = InputConverter('float32', 7).convert(payload)
+    assert out.tolist() == [0, 16384, -16384, -32768, 32767, 32767, -32768]
+
+
+def test_int24_input_keeps_the_top_two_bytes():
+    values = [0, 256, -256, 0x7FFFFF, -0x800000, 0x1234FF]
+    out = InputConverter('int24', 6).convert(int24_bytes(values))
+    assert out.tolist() == [value >> 8 for value in values]
+
+
+@pytest.mark.parametrize('make', [
+    lambda: OutputConverter('int8'),
+    lambda: OutputConverter('int16', 0),
+    lambda: InputConverter('int16', 960),
+    lambda: InputConverter('pcm_mulaw', 960),
+])
+def test_unknown_formats_are_refused(make):
+    with pytest.raises(ValueError):
+        make()
+
+
+def test_output_converter_reuses_its_buffer():
+    converter = OutputConverter('float32', 2)
+    first = converter.convert(np.full(256, 16384, dtype=np.int16).tobytes())
+    address = np.frombuffer(first, dtype=np.float32).ctypes.data
+
+    second = converter.convert(memoryview(np.full(256, -16384, dtype=np.int16)).cast('B'))
+
+    assert np.frombuffer(second, dtype=np.float32).ctypes.data == address
+    assert len(second) == 256 * 2 * 4
+    assert (np.frombuffer(second, dtype=np.float32) == -0.5).all()
@@ -0,0 +1,79 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from SampleRing import SampleRing
+
+
+def test_write_and_read_across_the_end_of_the_storage():
+    ring = SampleRing(8)
+    out = np.zeros(5, dtype=np.int16)
+    ring.write(np.arange(6, dtype=np.int16))
+    ring.read_into(out)
+
+    # Wraps: storage indices 6, 7, 0, 1, 2
+    assert ring.write(np.arange(10, 15, dtype=np.int16)) == 5
+    assert ring.available() == 6
+
+    out = np.zeros(6, dtype=np.int16)
+    assert ring.read_into(out) == 6
+    assert out.tolist() == [5, 10, 11, 12, 13, 14]
+    assert (ring.read_pos, ring.write_pos) == (11, 11)
+
+
+def test_full_ring_writes_only_what_fits():
+    ring = SampleRing(4)
+
+    assert ring.write(np.arange(6, dtype=np.int16)) == 4
+    assert ring.space() == 0
+    assert ring.write(np.arange(1, dtype=np.int16)) == 0
+
+    out = np.full(6, -1, dtype=np.int16)
+    assert ring.read_into(out) == 4
+    assert out.tolist() == [0, 1, 2, 3, -1, -1]  # The rest is left untouched
+
+
+def test_positions_keep_growing_over_many_laps():
+    ring = SampleRing(7)
+    out = np.zeros(5, dtype=np.int16)
+    expected = 0
+    for lap in range(1000):
+        block = np.arange(lap * 5, lap * 5 + 5, dtype=np.int16)
+        ring.write(block)
+        ring.read_into(out)
+        assert out.tolist() == list(range(expected, expected + 5))
+        expected += 5
+
+    assert ring.write_pos == ring.read_pos == 5000
+
+
+def test_skip_and_clear():
+    ring = SampleRing(8, dtype=np.float32)
+    ring.write(np.arange(6, dtype=np.float32))
+
+    assert ring.skip(4) == 4
+    assert ring.skip(10) == 2
+    assert ring.available() == 0
+
+    ring.write(np.ones(3, dtype=np.float32))
+    ring.clear()
+    assert ring.available() == 0 and ring.space() == 8
+
+
+def test_move_into_a_larger_ring_keeps_order_across_the_wrap():
+    ring = SampleRing(8)
+    out = np.zeros(6, dtype=np.int16)
+    ring.write(np.arange(6, dtype=np.int16))
+    ring.read_into(out)
+    ring.write(np.arange(6, 12, dtype=np.int16))  # Storage indices 6, 7, 0, 1, 2, 3
+
+    larger = SampleRing(16)
+    assert ring.move_into(larger) == 6
+    assert ring.available() == 0
+
+    out = np.zeros(6, dtype=np.int16)
+    assert larger.read_into(out) == 6
+    assert out.tolist() == [6, 7, 8, 9, 10, 11]
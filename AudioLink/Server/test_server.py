@@ -1,5 +1,6 @@
+import os
 import sys
-sys.path.insert(0, r'c:\Users\Rodrigo\Desktop\Mic_pc\AudioLink\Server')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 # Test if we can import the server module
 try:
@@ -0,0 +1,102 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from protocol import pack_frame, parse_frame
+from Session import Session
+
+FRAME_SIZE = 960
+
+
+def ramp_frame(seq):
+    """PCM frame whose samples count up across the whole stream (mod 2**15)."""
+    samples = (np.arange(seq * FRAME_SIZE, (seq + 1) * FRAME_SIZE) % 32768).astype(np.int16)
+    return parse_frame(pack_frame(seq, seq * FRAME_SIZE, samples.tobytes()))
+
+
+def pcm_session(period_size):
+    return Session(1, '127.0.0.1', use_opus=False, frame_size=FRAME_SIZE, period_size=period_size,
+                   target_buffer_ms=40, adaptive=False, drift_correction=False)
+
+
+def play(session, frames, block, lag_frames=2):
+    """
+    Feed frames and drain the output in blocks of `block`, as the worker and
+    callback would. The output trails the input by lag_frames (the target
+    depth), so the JitterBuffer never runs dry and nothing is concealed.
+    """
+    out = []
+    played = 0
+    for seq in range(frames):
+        session.receive(ramp_frame(seq))
+        session.fill()
+        while played + block <= (seq + 1 - lag_frames) * FRAME_SIZE:
+            samples = session.read_output(block)
+            if samples is None:
+                # A block bigger than planned misses once while the worker decodes further ahead
+                session.fill()
+                samples = session.read_output(block)
+            assert samples is not None
+            out.append(samples.copy())
+            played += block
+            session.fill()
+    return np.concatenate(out)
+
+
+def test_short_periods_are_sample_accurate():
+    session = pcm_session(period_size=256)
+    out = play(session, 20, 256)
+
+    assert len(out) % 256 == 0 and len(out) >= 15 * FRAME_SIZE
+    np.testing.assert_array_equal(out, np.arange(len(out)).astype(np.int16))
+    assert session.jitter_buffer.stats['lost'] == 0
+    assert session.jitter_buffer.stats['underruns'] == 0
+
+
+def test_callback_asking_for_more_than_planned_decodes_further_ahead():
+    session = pcm_session(period_size=256)
+    out = play(session, 20, 1500)
+
+    assert session.request_size == 1500
+    assert len(session.output_frame) >= 1500
+    assert session.output_ring.available() >= 1500  # A whole oversized block stays decoded ahead
+    np.testing.assert_array_equal(out, np.arange(len(out)).astype(np.int16))
+
+
+def test_fill_keeps_the_ring_one_period_ahead():
+    session = pcm_session(period_size=256)
+    for seq in range(4):
+        session.receive(ramp_frame(seq))
+    session.fill(lead_periods=1)
+    # Whole frames are decoded until at least one period is waiting
+    assert session.output_ring.available() == FRAME_SIZE
+
+    session.fill(lead_periods=3)
+    assert session.output_ring.available() == FRAME_SIZE
+    session.fill(lead_periods=4)
+    assert session.output_ring.available() == 2 * FRAME_SIZE
+
+
+def test_callback_asking_for_more_than_the_ring_holds_gets_a_larger_ring():
+    session = pcm_session(period_size=256)
+    capacity = session.output_ring.capacity
+    block = capacity
+    for seq in range(8):
+        session.receive(ramp_frame(seq))
+    session.fill()
+
+    # The first oversized request cannot be served yet; the worker grows the
+    # ring on its next fill and the callback moves into it on its next read
+    assert session.read_output(block) is None
+    session.fill()
+    assert session.grown_ring is not None
+    assert session.read_output(block) is None
+    assert session.output_ring.capacity > capacity and session.grown_ring is None
+
+    session.fill()
+    out = session.read_output(block)
+    assert out is not None
+    np.testing.assert_array_equal(out, np.arange(block).astype(np.int16))
@@ -0,0 +1,177 @@
+import asyncio
+import os
+import socket
+import sys
+import time
+
+import websockets
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import server
+from Sinks import NullSink
+from protocol import decode_control, encode_control, pack_frame
+
+FRAME_SIZE = 960
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+async def wait_for(condition, timeout=2.0):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("timed out")
+
+
+def pcm_frame(seq):
+    return pack_frame(seq, seq * FRAME_SIZE, bytes([seq % 256, 0]) * FRAME_SIZE)
+
+
+async def resume_after_a_drop():
+    port = free_port()
+    audio_server = server.AudioServer(use_opus=False, metrics_log_interval=0, feedback_interval=0,
+                                      sink=NullSink(server.RATE, server.CHANNELS, server.CHUNK),
+                                      adaptive=False, resume_grace=5.0)
+    server_task = asyncio.create_task(audio_server.start_server(host='127.0.0.1', port=port))
+    try:
+        await asyncio.sleep(0.2)
+        url = f'ws://127.0.0.1:{port}'
+
+        ws = await websockets.connect(url, compression=None)
+        await ws.send(encode_control('hello', codec='pcm', rate=server.RATE, channels=1, frame_ms=20))
+        assert decode_control(await ws.recv())['type'] == 'config'
+        token = decode_control(await ws.recv())
+        assert token['type'] == 'token'
+        session = audio_server.sessions[token['session']]
+        t0 = time.monotonic()
+        for seq in range(5):
+            await ws.send(pcm_frame(seq))
+        await wait_for(lambda: session.jitter_buffer.highest_seq == 4)
+
+        # The phone drops off the network rather than stopping, for longer than the buffer holds
+        await ws.close(1001)
+        await wait_for(lambda: session.parked_at is not None)
+        assert audio_server.active_sessions == (session,)
+        await asyncio.sleep(0.5)
+
+        ws = await websockets.connect(url, compression=None)
+        await ws.send(encode_control('hello', resume=token['token']))
+        assert decode_control(await ws.recv())['type'] == 'config'
+        resumed = decode_control(await ws.recv())
+        assert resumed == {'type': 'resumed', 'session': session.session_id, 'last_seq': 4}
+        assert session.parked_at is None
+        assert audio_server.sessions == {session.session_id: session}
+
+        # The same buffer carries on with the sequence the phone kept counting
+        played = session.jitter_buffer.stats['packets_played']
+        first = int((time.monotonic() - t0) / 0.02)
+        for seq in range(first, first + 5):
+            await ws.send(pcm_frame(seq))
+            await asyncio.sleep(0.02)
+        await wait_for(lambda: session.jitter_buffer.stats['packets_played'] >= played + 5)
+        assert session.jitter_buffer.stats['overruns'] == 0
+
+        await ws.close()
+        await wait_for(lambda: not audio_server.sessions)
+        assert token['token'] not in audio_server.tokens
+    finally:
+        audio_server.stop_audio_stream()
+        server_task.cancel()
+
+
+async def unknown_token_starts_a_new_session():
+    port = free_port()
+    audio_server = server.AudioServer(use_opus=False, metrics_log_interval=0, feedback_interval=0,
+                                      sink=NullSink(server.RATE, server.CHANNELS, server.CHUNK))
+    server_task = asyncio.create_task(audio_server.start_server(host='127.0.0.1', port=port))
+    try:
+        await asyncio.sleep(0.2)
+        async with websockets.connect(f'ws://127.0.0.1:{port}', compression=None) as ws:
+            await ws.send(encode_control('hello', codec='pcm', resume='expired'))
+            assert decode_control(await ws.recv())['type'] == 'config'
+            assert decode_control(await ws.recv())['type'] == 'token'
+            assert len(audio_server.sessions) == 1
+    finally:
+        audio_server.stop_audio_stream()
+        server_task.cancel()
+
+
+async def legacy_client_is_not_held_after_a_drop():
+    port = free_port()
+    audio_server = server.AudioServer(use_opus=False, metrics_log_interval=0, feedback_interval=0,
+                                      sink=NullSink(server.RATE, server.CHANNELS, server.CHUNK),
+                                      resume_grace=5.0)
+    server_task = asyncio.create_task(audio_server.start_server(host='127.0.0.1', port=port))
+    try:
+        await asyncio.sleep(0.2)
+        # No hello, so no token message: the client has no way to resume
+        ws = await websockets.connect(f'ws://127.0.0.1:{port}', compression=None)
+        await ws.send(pcm_frame(0))
+        await wait_for(lambda: len(audio_server.sessions) == 1)
+        session = next(iter(audio_server.sessions.values()))
+        assert session.token is None and not audio_server.tokens
+
+        await ws.close(1001)
+        await wait_for(lambda: not audio_server.sessions)
+        assert session.parked_at is None
+    finally:
+        audio_server.stop_audio_stream()
+        server_task.cancel()
+
+
+async def shutdown_ends_held_and_connected_sessions():
+    port = free_port()
+    audio_server = server.AudioServer(use_opus=False, metrics_log_interval=0, feedback_interval=0,
+                                      sink=NullSink(server.RATE, server.CHANNELS, server.CHUNK),
+                                      resume_grace=5.0)
+    server_task = asyncio.create_task(audio_server.start_server(host='127.0.0.1', port=port))
+    await asyncio.sleep(0.2)
+    url = f'ws://127.0.0.1:{port}'
+    hello = encode_control('hello', codec='pcm', rate=server.RATE, channels=1, frame_ms=20)
+
+    dropped = await websockets.connect(url, compression=None)
+    await dropped.send(hello)
+    await dropped.recv()
+    held = audio_server.sessions[decode_control(await dropped.recv())['session']]
+    await dropped.close(1001)
+    await wait_for(lambda: held.parked_at is not None)
+
+    connected = await websockets.connect(url, compression=None)
+    await connected.send(hello)
+    await connected.recv()
+    live = audio_server.sessions[decode_control(await connected.recv())['session']]
+
+    # The server closes the remaining connection with 1001 on its way out
+    server_task.cancel()
+    try:
+        await server_task
+    except asyncio.CancelledError:
+        pass
+    audio_server.stop_audio_stream()
+
+    assert live.parked_at is None and live.expiry is None
+    assert held.expiry.cancelled()
+    assert audio_server.sessions == {} and audio_server.tokens == {}
+    assert audio_server.active_sessions == ()
+
+
+def test_resumed_session_keeps_its_buffer():
+    asyncio.run(resume_after_a_drop())
+
+
+def test_unknown_token_starts_a_new_session():
+    asyncio.run(unknown_token_starts_a_new_session())
+
+
+def test_legacy_client_is_not_held_after_a_drop():
+    asyncio.run(legacy_client_is_not_held_after_a_drop())
+
+
+def test_shutdown_ends_held_and_connected_sessions():
+    asyncio.run(shutdown_ends_held_and_connected_sessions())
@@ -0,0 +1,68 @@
+import os
+import sys
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from SharedRing import SharedRing
+
+
+@pytest.fixture
+def rings():
+    producer = SharedRing(8)
+    consumer = SharedRing(8, producer.name)
+    yield producer, consumer
+    consumer.close()
+    producer.close()
+
+
+def test_attached_ring_sees_the_same_samples_and_positions(rings):
+    producer, consumer = rings
+    out = np.zeros(5, dtype=np.int16)
+
+    producer.write(np.arange(6, dtype=np.int16))
+    assert consumer.available() == 6
+    consumer.read_into(out)
+    assert producer.read_pos == 5
+
+    # Wraps: storage indices 6, 7, 0, 1, 2
+    assert producer.write(np.arange(10, 15, dtype=np.int16)) == 5
+    out = np.zeros(6, dtype=np.int16)
+    assert consumer.read_into(out) == 6
+    assert out.tolist() == [5, 10, 11, 12, 13, 14]
+    assert (producer.read_pos, producer.write_pos) == (11, 11)
+
+
+def test_full_shared_ring_writes_only_what_fits(rings):
+    producer, consumer = rings
+    assert producer.write(np.arange(10, dtype=np.int16)) == 8
+    assert consumer.space() == 0
+
+    consumer.skip(3)
+    assert producer.space() == 3
+
+
+def test_period_counters_are_shared(rings):
+    producer, consumer = rings
+    for underrun in (False, True, False, True, True):
+        consumer.count_period(underrun)
+    consumer.device_underflows = 2
+
+    assert (producer.periods, producer.underruns, producer.device_underflows) == (5, 3, 2)
+
+
+def test_only_the_creator_frees_the_block():
+    producer = SharedRing(4)
+    name = producer.name
+    consumer = SharedRing(4, name)
+
+    consumer.close()
+    probe = shared_memory.SharedMemory(name=name)  # Still there
+    probe.close()
+
+    producer.close()
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
@@ -0,0 +1,106 @@
+import os
+import sys
+import time
+import wave
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from Sinks import FileSink, NullSink, create_sink
+
+RATE = 48000
+PERIOD = 480  # 10 ms
+
+
+class CountingRender:
+    """render() stand-in: period n is filled with the value n."""
+
+    def __init__(self):
+        self.calls = 0
+        self.block = np.zeros(PERIOD, dtype=np.int16)
+
+    def __call__(self, frame_count):
+        assert frame_count == PERIOD
+        self.block[:] = self.calls
+        self.calls += 1
+        return memoryview(self.block).cast('B')
+
+
+def test_null_sink_renders_one_period_per_period_time():
+    times = []
+    sink = NullSink(RATE, 1, PERIOD, on_block=lambda now, data: times.append(now))
+    sink.start(CountingRender())
+    time.sleep(0.5)
+    sink.stop()
+
+    # 50 periods in 0.5 s; a loaded machine may run a few short, never ahead
+    assert 40 <= len(times) <= 51
+    intervals = np.diff(times)
+    assert abs(float(np.mean(intervals)) - PERIOD / RATE) < 0.002
+
+
+def test_null_sink_hands_on_converted_blocks():
+    blocks = []
+    sink = NullSink(RATE, 2, PERIOD, sample_format='float32',
+                    on_block=lambda now, data: blocks.append(np.frombuffer(data, dtype=np.float32).copy()))
+    sink.start(CountingRender())
+    time.sleep(0.05)
+    sink.stop()
+
+    assert blocks and blocks[1].shape == (PERIOD * 2,)
+    assert (blocks[1] == 1 / 32768).all()
+
+
+def test_null_sink_keeps_its_clock_running_through_render_errors():
+    render = CountingRender()
+    blocks = []
+
+    def failing(frame_count):
+        data = render(frame_count)
+        if render.calls % 3 == 0:
+            raise RuntimeError("decoder blew up")
+        return data
+
+    sink = NullSink(RATE, 1, PERIOD, on_block=lambda now, data: blocks.append(np.frombuffer(data, np.int16)[0]))
+    sink.start(failing)
+    time.sleep(0.2)
+    sink.stop()
+
+    assert render.calls >= 12
+    assert sink.errors == render.calls // 3
+    assert sink.counters() == {'output_errors': sink.errors}
+    # Every third period failed and was skipped; the ones around it were still handed on
+    assert blocks[:4] == [0, 1, 3, 4]
+
+
+def test_file_sink_writes_every_period_to_wav(tmp_path):
+    path = str(tmp_path / 'out.wav')
+    sink = FileSink(RATE, 2, PERIOD, path, sample_format='int24')
+    render = CountingRender()
+    sink.start(render)
+    time.sleep(0.1)
+    sink.stop()
+
+    with wave.open(path, 'rb') as wav:
+        assert (wav.getnchannels(), wav.getsampwidth(), wav.getframerate()) == (2, 3, RATE)
+        data = wav.readframes(wav.getnframes())
+    samples = np.frombuffer(data, dtype=np.uint8).reshape(-1, PERIOD * 2, 3)
+    assert len(samples) == render.calls
+    # Period n holds n in the top two bytes of every 24-bit sample
+    assert [int(period[0, 1]) for period in samples] == list(range(render.calls))
+
+
+def test_file_sink_refuses_float_wav(tmp_path):
+    with pytest.raises(ValueError):
+        FileSink(RATE, 1, PERIOD, str(tmp_path / 'out.wav'), sample_format='float32')
+
+
+def test_create_sink_builds_headless_sinks_without_pyaudio(tmp_path):
+    assert isinstance(create_sink('null', RATE, 1, PERIOD), NullSink)
+    assert isinstance(create_sink('file', RATE, 1, PERIOD, path=str(tmp_path / 'x.raw')), FileSink)
+    with pytest.raises(ValueError):
+        create_sink('file', RATE, 1, PERIOD)
+    with pytest.raises(ValueError):
+        create_sink('alsa', RATE, 1, PERIOD)
@@ -0,0 +1,68 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from protocol import ProtocolError, decode_control
+from StreamConfig import DEFAULT_OPUS_BITRATE, GAIN_RANGE, OPUS_BITRATE_RANGE, StreamConfig
+
+DEFAULT = StreamConfig('opus', 48000, 1, 20, bitrate=DEFAULT_OPUS_BITRATE, fec=True)
+
+
+def test_empty_hello_takes_the_defaults():
+    config = StreamConfig.negotiate({'type': 'hello'}, DEFAULT)
+    assert config.as_dict() == DEFAULT.as_dict()
+
+
+def test_first_supported_choice_wins():
+    hello = {'type': 'hello', 'codec': ['flac', 'pcm', 'opus'], 'frame_ms': [7, 10, 20],
+             'sample_format': ['int32', 'float32'], 'channels': 2}
+    config = StreamConfig.negotiate(hello, DEFAULT)
+
+    assert (config.codec, config.frame_ms, config.frame_size) == ('pcm', 10, 480)
+    assert (config.sample_format, config.channels) == ('float32', 2)
+    assert config.bitrate is None and not config.fec
+
+
+def test_opus_falls_back_when_the_server_cannot_decode_it():
+    config = StreamConfig.negotiate({'type': 'hello', 'codec': ['opus', 'pcm']}, DEFAULT, codecs=('pcm',))
+    assert config.codec == 'pcm'
+
+
+def test_opus_bitrate_is_clamped_and_fec_needs_silk_frames():
+    low = StreamConfig.negotiate({'type': 'hello', 'bitrate': 10}, DEFAULT)
+    high = StreamConfig.negotiate({'type': 'hello', 'bitrate': 10 ** 7, 'frame_ms': 5, 'fec': True}, DEFAULT)
+
+    assert low.bitrate == OPUS_BITRATE_RANGE[0]
+    assert high.bitrate == OPUS_BITRATE_RANGE[1]
+    assert not high.fec
+
+
+def test_gain_is_clamped():
+    assert StreamConfig.negotiate({'type': 'hello', 'gain': 0.5}, DEFAULT).gain == 0.5
+    assert StreamConfig.negotiate({'type': 'hello', 'gain': 100}, DEFAULT).gain == GAIN_RANGE[1]
+    assert StreamConfig.negotiate({'type': 'hello', 'gain': -1}, DEFAULT).gain == GAIN_RANGE[0]
+
+
+@pytest.mark.parametrize('hello', [
+    {'type': 'config'},
+    {'type': 'hello', 'codec': 'flac'},
+    {'type': 'hello', 'rate': 44100},
+    {'type': 'hello', 'channels': [True]},
+    {'type': 'hello', 'bitrate': 'fast'},
+    decode_control('{"type": "hello", "bitrate": NaN}'),
+    decode_control('{"type": "hello", "bitrate": Infinity}'),
+    decode_control('{"type": "hello", "gain": NaN}'),
+    {'type': 'hello', 'gain': 'loud'},
+])
+def test_unsupported_hello_is_refused(hello):
+    with pytest.raises(ProtocolError):
+        StreamConfig.negotiate(hello, DEFAULT)
+
+
+def test_config_message_round_trips():
+    message = decode_control(DEFAULT.to_message())
+    assert message.pop('type') == 'config'
+    assert message == DEFAULT.as_dict()
@@ -0,0 +1,70 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from protocol import pack_datagram, pack_frame
+from UdpTransport import UdpTransport
+
+
+class FakeMetrics:
+    def __init__(self):
+        self.frames = 0
+
+    def on_frame(self, size):
+        self.frames += 1
+
+
+class FakeSession:
+    def __init__(self, remote):
+        self.remote = remote
+        self.udp_key = None
+        self.metrics = FakeMetrics()
+
+
+def transport_with_session(remote='192.168.1.20'):
+    received, relayed = [], []
+    udp = UdpTransport(lambda session, frame: received.append((session, frame)),
+                       lambda session, message: relayed.append(bytes(message)))
+    session = FakeSession(remote)
+    key = udp.register(session)
+    return udp, session, key, received, relayed
+
+
+def test_datagram_reaches_its_session_and_the_relay():
+    udp, session, key, received, relayed = transport_with_session()
+    message = pack_frame(7, 7 * 960, b'opus')
+
+    udp.datagram_received(pack_datagram(key, message), ('192.168.1.20', 50000))
+
+    assert [(s, frame.seq, frame.payload) for s, frame in received] == [(session, 7, b'opus')]
+    assert relayed == [message]
+    assert session.metrics.frames == 1
+
+
+def test_unknown_key_and_wrong_source_are_rejected():
+    udp, session, key, received, relayed = transport_with_session()
+    message = pack_frame(1, 960, b'opus')
+
+    udp.datagram_received(pack_datagram(key ^ 1, message), ('192.168.1.20', 50000))
+    udp.datagram_received(pack_datagram(key, message), ('192.168.1.99', 50000))  # Guessed key, other host
+    udp.datagram_received(b'\x00\x01', ('192.168.1.20', 50000))
+
+    assert received == [] and relayed == []
+    assert udp.stats == {'datagrams': 3, 'malformed': 1, 'unknown_key': 1, 'wrong_source': 1}
+
+
+def test_unregistered_session_stops_receiving():
+    udp, session, key, received, _ = transport_with_session()
+    udp.unregister(session)
+
+    udp.datagram_received(pack_datagram(key, pack_frame(1, 960, b'opus')), ('192.168.1.20', 50000))
+
+    assert session.udp_key is None
+    assert received == [] and udp.stats['unknown_key'] == 1
+
+
+def test_keys_are_unique_per_session():
+    udp = UdpTransport(lambda session, frame: None)
+    keys = {udp.register(FakeSession('10.0.0.1')) for _ in range(100)}
+    assert len(keys) == len(udp.sessions) == 100